@@ -0,0 +1,279 @@
+"""
+ASGI entry point (async serving mode)
+/chat, /chat/stream and the status routes run as coroutines so slow LLM I/O overlaps across requests;
+retrieval and store calls run in a bounded thread pool, and every other route is served by the Flask app.
+
+Run: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import main
+from main import (
+    answer_cache, chat_store, llm_router, async_request_flight,
+    chat_lookup, chat_model_key, flight_key, history_digest, local_models_url, sse_event, vectorstore_status_payload
+)
+from backend.admission import OverloadedError
+from backend.chat_history import ChatHistoryStore
+from backend.http_client import local_llm_async_client, async_client_started
+from config import Config
+
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+flask_app = main.app
+retrieval_pool = ThreadPoolExecutor(max_workers=Config.RETRIEVAL_WORKERS, thread_name_prefix='retrieval')
+
+
+async def offload(func, *args, **kwargs):
+    """Run a blocking call (embedding, index search, SQLite) in the retrieval pool"""
+    return await asyncio.get_running_loop().run_in_executor(retrieval_pool, partial(func, *args, **kwargs))
+
+
+def load_session(request: Request) -> dict:
+    """Read the Flask session cookie (same signing key, so both apps share the conversation id)"""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = request.cookies.get(flask_app.session_interface.get_cookie_name(flask_app))
+    if not cookie or serializer is None:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def save_session(response, data: dict):
+    """Write data back as a Flask session cookie"""
+    interface = flask_app.session_interface
+    response.set_cookie(
+        interface.get_cookie_name(flask_app),
+        interface.get_signing_serializer(flask_app).dumps(data),
+        path=interface.get_cookie_path(flask_app),
+        domain=interface.get_cookie_domain(flask_app),
+        secure=interface.get_cookie_secure(flask_app),
+        httponly=interface.get_cookie_httponly(flask_app),
+        samesite=interface.get_cookie_samesite(flask_app)
+    )
+
+
+def conversation_of(session_data: dict) -> tuple:
+    """(conversation id, True if it was just created and the cookie must be set)"""
+    if 'conversation_id' in session_data:
+        return session_data['conversation_id'], False
+    session_data['conversation_id'] = ChatHistoryStore.new_conversation_id()
+    # Bỏ lịch sử cũ còn nằm trong cookie (trước khi lưu ở server)
+    session_data.pop('chat_history', None)
+    return session_data['conversation_id'], True
+
+
+def overloaded_response(error: OverloadedError) -> JSONResponse:
+    """503 with Retry-After when the LLM provider sheds the request"""
+    return JSONResponse(
+        {'error': str(error), 'retry_after': error.retry_after},
+        status_code=503,
+        headers={'Retry-After': str(error.retry_after)}
+    )
+
+
+async def chat(request: Request):
+    """Handle chat requests with RAG (async)"""
+    try:
+        data = await request.json()
+        user_message = data.get('message', '')
+        model_type = data.get('model_type', 'gemini')  # 'gemini' or 'local'
+        model_name = data.get('model_name')  # None: default model of the provider
+
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        session_data = load_session(request)
+        conversation, new_session = conversation_of(session_data)
+        model_key = chat_model_key(data)
+        # The history database is opened on first use; not on the event loop
+        store = await offload(chat_store.resolve)
+        # History is part of the prompt, so it is part of the cache and flight keys
+        chat_history = await offload(store.recent, conversation, Config.CHAT_HISTORY_PROMPT_TURNS)
+        cached, relevant_docs, chunk_ids, sources, query_embedding = await async_request_flight.do(
+            flight_key('lookup', user_message, model_key, chat_history=chat_history),
+            lambda: offload(chat_lookup, user_message, model_key, chat_history)
+        )
+        context = route = None
+        if cached is not None:
+            response, sources = cached['answer'], cached['sources']
+        else:
+            router = await offload(llm_router.resolve)
+
+            async def generate():
+                answer = await router.acomplete(user_message, relevant_docs, chat_history=chat_history, model_type=model_type, model_name=model_name)
+                return answer, router.provider.context_stats(), router.last_route()
+
+            response, context, route = await async_request_flight.do(flight_key('generate', user_message, model_key, chunk_ids, chat_history), generate)
+            if response.startswith('Error'):
+                context = route = None
+            elif not route['fallback']:
+                # Fallback answers are not cached under the requested model
+                await offload(answer_cache.put, user_message, model_key, chunk_ids, sources, response, query_embedding, history_digest(chat_history))
+        await offload(store.append, conversation, user_message, response)
+        result = JSONResponse({
+            'response': response,
+            'sources': sources,
+            'cached': cached is not None,
+            'context': context,
+            'provider': route
+        })
+        if new_session:
+            save_session(result, session_data)
+        return result
+    except OverloadedError as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def replay(answer: str):
+    """Cache hit: gửi toàn bộ câu trả lời trong một delta"""
+    yield {'html': answer, 'pending': ''}
+
+
+async def chat_stream(request: Request):
+    """Stream chat response tokens via Server-Sent Events (async; events: delta, done, error)"""
+    try:
+        data = await request.json()
+        user_message = data.get('message', '')
+        model_type = data.get('model_type', 'gemini')  # 'gemini' or 'local'
+        model_name = data.get('model_name')  # None: default model of the provider
+
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        session_data = load_session(request)
+        conversation, new_session = conversation_of(session_data)
+        model_key = chat_model_key(data)
+        store = await offload(chat_store.resolve)
+        chat_history = await offload(store.recent, conversation, Config.CHAT_HISTORY_PROMPT_TURNS)
+        cached, relevant_docs, chunk_ids, sources, query_embedding = await async_request_flight.do(
+            flight_key('lookup', user_message, model_key, chat_history=chat_history),
+            lambda: offload(chat_lookup, user_message, model_key, chat_history)
+        )
+        router = await offload(llm_router.resolve)
+        if cached is not None:
+            sources = cached['sources']
+            events = replay(cached['answer'])
+        else:
+            # Shed before the response headers go out
+            router.check(model_type)
+
+            async def open_events():
+                async for event in router.astream(user_message, relevant_docs, chat_history=chat_history, model_type=model_type, model_name=model_name):
+                    yield event
+                # Stats are only visible in the task that built the prompt
+                yield {'context': router.provider.context_stats(), 'provider': router.last_route()}
+
+            # Identical concurrent questions share one token stream
+            events = async_request_flight.stream(flight_key('stream', user_message, model_key, chunk_ids, chat_history), open_events)
+        # Câu hỏi được lưu ngay, câu trả lời được ghi khi stream kết thúc
+        turn_id = await offload(store.append, conversation, user_message)
+
+        async def generate():
+            parts = []
+            failed = False
+            saved = False
+            pending = ''
+            context_stats = route = None
+            try:
+                async for event in events:
+                    if 'html' not in event:
+                        context_stats, route = event.get('context'), event.get('provider')
+                        continue
+                    parts.append(event['html'])
+                    pending = event.get('pending', '')
+                    failed = failed or event.get('error', False)
+                    yield sse_event('delta', event)
+                response = ''.join(parts)
+                await offload(store.set_assistant, turn_id, response)
+                saved = True
+                context = provider = None
+                if cached is None and response and not failed:
+                    if not route['fallback']:
+                        await offload(answer_cache.put, user_message, model_key, chunk_ids, sources, response, query_embedding, history_digest(chat_history))
+                    context, provider = context_stats, route
+                yield sse_event('done', {'response': response, 'sources': sources, 'cached': cached is not None, 'context': context, 'provider': provider})
+            except Exception as e:
+                logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+                yield sse_event('error', {'error': str(e)})
+            finally:
+                # Client disconnected mid-stream (cancelled / closed): keep what the client has shown.
+                # Shielded so a second cancellation cannot drop the write
+                if not saved:
+                    await asyncio.shield(offload(store.set_assistant, turn_id, ''.join(parts) + pending))
+                # Leave the shared token stream now: once nobody reads it, the upstream is cancelled
+                await events.aclose()
+
+        result = StreamingResponse(
+            generate(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        if new_session:
+            save_session(result, session_data)
+        return result
+    except OverloadedError as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def vectorstore_status(request: Request):
+    """Get vectorstore and model status for UI (cached snapshot, no I/O on the event loop)"""
+    try:
+        return JSONResponse(vectorstore_status_payload())
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def local_models(request: Request):
+    """Get available local LLM models from LM Studio API (async)"""
+    try:
+        response = await local_llm_async_client().get(local_models_url(), timeout=(Config.LOCAL_LLM_CONNECT_TIMEOUT, 5))
+        if response.status_code == 200:
+            # LM Studio trả về {'data': [ {id: model_name, ...}, ... ]}
+            return JSONResponse({'models': [m['id'] for m in response.json().get('data', [])]})
+        return JSONResponse({'error': f'LM Studio returned status {response.status_code}'}, status_code=500)
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Preload and health checks start with the server, not on `import main`
+    main.start_background()
+    yield
+    if async_client_started():
+        await local_llm_async_client().aclose()
+    retrieval_pool.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/vectorstore-status', vectorstore_status, methods=['GET']),
+        Route('/local-models', local_models, methods=['GET']),
+        # Upload, documents, admin and pages stay on Flask (run in a2wsgi's thread pool)
+        Mount('/', app=WSGIMiddleware(flask_app, workers=Config.RETRIEVAL_WORKERS))
+    ],
+    lifespan=lifespan
+)
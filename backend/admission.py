@@ -0,0 +1,203 @@
+"""
+Admission Control Module
+Per-provider concurrency limit with a bounded priority wait queue and fast load shedding
+"""
+
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# Lower value = served first
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+class OverloadedError(Exception):
+    """Raised when a provider's wait queue is full or a queued request waited too long (maps to HTTP 503)"""
+
+    def __init__(self, provider: str, retry_after: int):
+        super().__init__(f"{provider} LLM is overloaded, please retry in {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'notify', 'granted')
+
+    def __init__(self, priority: int, seq: int, notify: Callable[[], None]):
+        self.priority = priority
+        self.seq = seq
+        self.notify = notify
+        self.granted = False
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """At most max_in_flight calls run; up to max_queue wait by priority, the rest are shed immediately.
+
+    Usable from threads (slot) and from asyncio (aslot); both share the same slots.
+    """
+
+    # Wait-time samples kept for percentiles
+    SAMPLE_SIZE = 512
+
+    def __init__(self, name: str, max_in_flight: int = 2, max_queue: int = 32, queue_timeout: float = 15):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=self.SAMPLE_SIZE)
+        self._avg_hold = 5.0  # EWMA of seconds a slot is held, for Retry-After
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.max_queue_seen = 0
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is likely drained (1-60)"""
+        estimate = self._avg_hold * (len(self._queue) + 1) / max(1, self.max_in_flight)
+        return int(min(60, max(1, math.ceil(estimate))))
+
+    def saturated(self) -> bool:
+        """True if a new request would be shed right now"""
+        return self._in_flight >= self.max_in_flight and len(self._queue) >= self.max_queue
+
+    def check(self):
+        """Raise OverloadedError now if a new request would be shed (used before starting a stream)"""
+        with self._lock:
+            if self.saturated():
+                self.shed += 1
+                raise OverloadedError(self.name, self.retry_after())
+
+    def _enter(self, priority: int, notify: Callable[[], None]) -> Optional[_Waiter]:
+        """Under the lock: take a free slot (None) or join the queue; shed when the queue is full"""
+        if self._in_flight < self.max_in_flight and not self._queue:
+            self._in_flight += 1
+            self.admitted += 1
+            self._waits.append(0.0)
+            return None
+        if len(self._queue) >= self.max_queue:
+            self.shed += 1
+            raise OverloadedError(self.name, self.retry_after())
+        waiter = _Waiter(priority, next(self._seq), notify)
+        heapq.heappush(self._queue, waiter)
+        self.max_queue_seen = max(self.max_queue_seen, len(self._queue))
+        return waiter
+
+    def _grant_next(self):
+        """Under the lock: hand free slots to the highest-priority waiters"""
+        while self._queue and self._in_flight < self.max_in_flight:
+            waiter = heapq.heappop(self._queue)
+            self._in_flight += 1
+            self.admitted += 1
+            waiter.granted = True
+            waiter.notify()
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Under the lock: leave the queue; False if the slot was granted meanwhile"""
+        if waiter.granted:
+            return False
+        self._queue.remove(waiter)
+        heapq.heapify(self._queue)
+        return True
+
+    def _release(self, held_seconds: float):
+        with self._lock:
+            self._in_flight -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held_seconds
+            self._grant_next()
+
+    def acquire(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """Block until a slot is free; raises OverloadedError when shed or after timeout"""
+        start = time.perf_counter()
+        granted = threading.Event()
+        with self._lock:
+            waiter = self._enter(priority, granted.set)
+        if waiter is None:
+            return
+        if not granted.wait(self.queue_timeout if timeout is None else timeout):
+            with self._lock:
+                if self._abandon(waiter):
+                    self.timed_out += 1
+                    raise OverloadedError(self.name, self.retry_after())
+        self._waits.append(time.perf_counter() - start)
+
+    async def aacquire(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """asyncio acquire; the event loop keeps running while queued"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            # May run on another thread (a sync caller releasing its slot)
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        with self._lock:
+            waiter = self._enter(priority, notify)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._abandon(waiter):
+                    self.timed_out += 1
+                    raise OverloadedError(self.name, self.retry_after())
+        except asyncio.CancelledError:
+            # Client went away while queued: give back a slot granted in the meantime
+            with self._lock:
+                abandoned = self._abandon(waiter)
+            if not abandoned:
+                self._release(time.perf_counter() - start)
+            raise
+        self._waits.append(time.perf_counter() - start)
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """Hold a slot for the duration of the block"""
+        self.acquire(priority, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """async with variant of slot"""
+        await self.aacquire(priority, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """Slots in use, queue depth, shed counts and queue wait percentiles"""
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': len(self._queue),
+                'max_queue': self.max_queue,
+                'max_queue_depth_seen': self.max_queue_seen,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'timed_out': self.timed_out,
+                'wait_p50_ms': round(waits[len(waits) // 2] * 1000, 2) if waits else None,
+                'wait_p95_ms': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else None,
+                'avg_hold_seconds': round(self._avg_hold, 2)
+            }
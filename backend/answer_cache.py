@@ -0,0 +1,134 @@
+"""
+Answer Cache Module
+Two-tier response cache in front of the LLM provider:
+exact (normalized question + model + retrieved chunk ids + chat history) and semantic (query embedding cosine)
+"""
+
+import re
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return ' '.join(re.findall(r'\w+', question.lower()))
+
+
+def key_terms(question: str) -> frozenset:
+    """Tokens containing a digit (unit numbers, codes like 208HV, years).
+
+    Questions differing only in such a token embed almost identically but need different answers.
+    """
+    return frozenset(token for token in re.findall(r'\w+', question.lower()) if any(c.isdigit() for c in token))
+
+
+class AnswerCache:
+    """LRU + TTL cache of generated answers with source-based invalidation"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, similarity_threshold: float = 0.99):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        # exact key -> entry, in LRU order (most recently used last)
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self.hits = {'exact': 0, 'semantic': 0}
+        self.misses = 0
+
+    @staticmethod
+    def exact_key(question: str, model: str, chunk_ids: Iterable[str], history: str = '') -> Tuple:
+        return (normalize_question(question), model, frozenset(chunk_id for chunk_id in chunk_ids if chunk_id), history)
+
+    def get_exact(self, question: str, model: str, chunk_ids: Iterable[str],
+                  history: str = '') -> Optional[Dict[str, Any]]:
+        """Answer for the same normalized question, model, retrieved chunk set and history digest"""
+        key = self.exact_key(question, model, chunk_ids, history)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits['exact'] += 1
+            return entry
+
+    def get_semantic(self, query_embedding: List[float], model: str, question: Optional[str] = None,
+                     history: str = '') -> Optional[Dict[str, Any]]:
+        """Answer for a previous question of the same model and history whose embedding is within the cosine
+        threshold (and, given the question, with the same key_terms)"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        query /= norm
+        with self._lock:
+            self._evict_expired()
+            terms = key_terms(question) if question is not None else None
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if entry['model'] == model and entry['history'] == history and entry['embedding'] is not None
+                          and (terms is None or entry['terms'] == terms)]
+            if not candidates:
+                return None
+            matrix = np.stack([entry['embedding'] for _, entry in candidates])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self.hits['semantic'] += 1
+            return entry
+
+    def put(self, question: str, model: str, chunk_ids: Iterable[str], sources: List[str],
+            answer: str, query_embedding: Optional[List[float]] = None, history: str = ''):
+        """Store an answer; sources are used for invalidation, history is the digest of the prompt's chat turns"""
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            embedding = embedding / norm if norm else None
+        key = self.exact_key(question, model, chunk_ids, history)
+        with self._lock:
+            self._entries[key] = {
+                'answer': answer,
+                'sources': list(sources),
+                'model': model,
+                'history': history,
+                'terms': key_terms(question),
+                'embedding': embedding,
+                'created_at': time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_sources(self, sources: Optional[Iterable[str]] = None):
+        """Drop entries built from any of the given sources (None drops everything)"""
+        with self._lock:
+            if sources is None:
+                self._entries.clear()
+                return
+            sources = set(sources)
+            stale = [key for key, entry in self._entries.items() if sources.intersection(entry['sources'])]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                print(f"Answer cache: invalidated {len(stale)} entries for {sorted(sources)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count and hit/miss counters"""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': dict(self.hits), 'misses': self.misses}
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry['created_at'] > self.ttl_seconds
+
+    def _evict_expired(self):
+        stale = [key for key, entry in self._entries.items() if self._expired(entry)]
+        for key in stale:
+            del self._entries[key]
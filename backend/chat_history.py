@@ -0,0 +1,124 @@
+"""
+Chat History Module
+Server-side conversation store (SQLite, WAL) keyed by conversation id; the session only holds the id
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+
+class ChatHistoryStore:
+    """Append-only turns per conversation, trimmed to max_turns and expired after retention_days"""
+
+    # Expired conversations are pruned once every PRUNE_EVERY appends
+    PRUNE_EVERY = 1000
+
+    def __init__(self, db_path: str, max_turns: int = 50, retention_days: float = 30):
+        """Open (or create) the history database"""
+        self.db_path = db_path
+        self.max_turns = max_turns
+        self.retention_days = retention_days
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " conversation_id TEXT NOT NULL,"
+            " user TEXT NOT NULL,"
+            " assistant TEXT NOT NULL DEFAULT '',"
+            " timestamp TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_created ON turns (created)")
+        self._conn.commit()
+        self._appends = 0
+        self.prune()
+
+    @staticmethod
+    def new_conversation_id() -> str:
+        return uuid.uuid4().hex
+
+    def append(self, conversation_id: str, user: str, assistant: str = '') -> int:
+        """Add a turn and return its id; older turns beyond max_turns are dropped"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (conversation_id, user, assistant, timestamp, created) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, user, assistant, datetime.now().isoformat(), time.time())
+            )
+            turn_id = cursor.lastrowid
+            if self.max_turns > 0:
+                # Index range delete: only this conversation's oldest turns are touched
+                self._conn.execute(
+                    "DELETE FROM turns WHERE conversation_id = ? AND id <= ("
+                    " SELECT id FROM turns WHERE conversation_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (conversation_id, conversation_id, self.max_turns)
+                )
+            self._conn.commit()
+            self._appends += 1
+            prune_due = self._appends % self.PRUNE_EVERY == 0
+        if prune_due:
+            self.prune()
+        return turn_id
+
+    def set_assistant(self, turn_id: int, assistant: str):
+        """Fill in the answer of a turn (streaming answers are stored once complete)"""
+        with self._lock:
+            self._conn.execute("UPDATE turns SET assistant = ? WHERE id = ?", (assistant, turn_id))
+            self._conn.commit()
+
+    def recent(self, conversation_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Last limit turns of a conversation, oldest first"""
+        return list(reversed(self.page(conversation_id, limit=limit)['history']))
+
+    def page(self, conversation_id: str, limit: int = 20, before: Optional[int] = None) -> Dict[str, Any]:
+        """Newest-first page of turns older than turn id `before`; next_before is the cursor of the next page"""
+        query = "SELECT id, user, assistant, timestamp FROM turns WHERE conversation_id = ?"
+        params: List[Any] = [conversation_id]
+        if before is not None:
+            query += " AND id < ?"
+            params.append(before)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        history = [
+            {'id': turn_id, 'user': user, 'assistant': assistant, 'timestamp': timestamp}
+            for turn_id, user, assistant, timestamp in rows[:limit]
+        ]
+        return {
+            'history': history,
+            'next_before': history[-1]['id'] if len(rows) > limit else None
+        }
+
+    def clear(self, conversation_id: str):
+        """Delete all turns of a conversation"""
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+            self._conn.commit()
+
+    def prune(self) -> int:
+        """Delete turns older than retention_days; returns the number removed"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM turns WHERE created < ?", (cutoff,)).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Stored turns and conversations"""
+        with self._lock:
+            turns, conversations = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT conversation_id) FROM turns"
+            ).fetchone()
+        return {'turns': turns, 'conversations': conversations, 'max_turns': self.max_turns, 'retention_days': self.retention_days}
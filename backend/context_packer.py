@@ -0,0 +1,142 @@
+"""
+Context Packer Module
+Token-budgeted assembly of retrieved chunks into the prompt context
+"""
+
+import math
+from typing import Dict, Any, List, Optional, Tuple
+from langchain.schema import Document
+
+# Context windows (tokens) of known models; matched by name prefix, longest first
+MODEL_CONTEXT_WINDOWS = {
+    'gemini-1.5-pro': 1048576,
+    'gemini-1.5-flash': 1048576,
+    'gemini-1.0-pro': 30720,
+    'gemini-pro': 30720,
+}
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.0) -> int:
+    """Rough token count from the character length (Vietnamese averages ~3 chars/token)"""
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def context_window(model_name: Optional[str], default: int) -> int:
+    """Context window of a model name such as 'models/gemini-pro' (default when unknown)"""
+    name = (model_name or '').split('/')[-1]
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return default
+
+
+def merge_overlap(first: str, second: str, max_overlap: int = 1000, min_overlap: int = 20) -> str:
+    """Join two consecutive chunks, dropping the text the splitter repeated at their boundary"""
+    tail = first[-max_overlap:]
+    probe = second[:min_overlap]
+    if len(probe) == min_overlap:
+        start = tail.find(probe)
+        while start != -1:
+            # Earliest match in the tail = longest overlap
+            if second.startswith(tail[start:]):
+                return first + second[len(tail) - start:]
+            start = tail.find(probe, start + 1)
+    return first + "\n" + second
+
+
+class ContextPacker:
+    """Ranks chunks by retrieval score, merges adjacent chunks of a source and fills a token budget greedily"""
+
+    def __init__(self, token_budget: int = 3000, chars_per_token: float = 3.0, default_window: int = 4096,
+                 reserve_tokens: int = 1000, max_overlap: int = 1000):
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.default_window = default_window
+        self.reserve_tokens = reserve_tokens  # room left for the answer
+        self.max_overlap = max_overlap
+
+    def budget(self, model_name: Optional[str], fixed_tokens: int = 0) -> int:
+        """Tokens available for context: the configured budget, capped by what the model window leaves"""
+        window = context_window(model_name, self.default_window)
+        return max(0, min(self.token_budget, window - self.reserve_tokens - fixed_tokens))
+
+    def pack(self, docs: List[Document], model_name: Optional[str] = None, fixed_text: str = '') -> Tuple[str, Dict[str, Any]]:
+        """Return (context text, stats); fixed_text is the rest of the prompt (history, question, instructions)"""
+        budget = self.budget(model_name, estimate_tokens(fixed_text, self.chars_per_token))
+        segments = self._segments(docs)
+        parts: List[Tuple[int, str]] = []
+        used = 0
+        for rank, (score, source, pages, text) in enumerate(segments):
+            header = f"(Source: {source}{pages}):\n"
+            cost = estimate_tokens(header + text, self.chars_per_token)
+            if used + cost > budget:
+                remaining_chars = int((budget - used) * self.chars_per_token) - len(header) - 3
+                # Truncate only when a meaningful piece still fits
+                if remaining_chars < 200:
+                    continue
+                text = text[:remaining_chars] + "..."
+                cost = estimate_tokens(header + text, self.chars_per_token)
+            parts.append((rank, header + text))
+            used += cost
+        context = "\n".join(
+            f"Document {i} {body}\n" for i, (_, body) in enumerate(sorted(parts), 1)
+        ) if parts else "No relevant documents found."
+        stats = {
+            'model': model_name,
+            'tokens_used': used,
+            'token_budget': budget,
+            'chunks_retrieved': len(docs),
+            'segments': len(segments),
+            'segments_used': len(parts)
+        }
+        return context, stats
+
+    def _segments(self, docs: List[Document]) -> List[Tuple[float, str, str, str]]:
+        """(score, source, page label, text) spans, highest score first.
+
+        Chunks are ranked by metadata 'score' (falling back to retrieval order); consecutive
+        chunk_index values of one source are merged, and duplicate texts are dropped.
+        """
+        seen_texts = set()
+        ranked = []
+        for position, doc in enumerate(docs):
+            text = doc.page_content.strip()
+            if not text or text in seen_texts:
+                continue
+            seen_texts.add(text)
+            score = doc.metadata.get('score')
+            ranked.append((score if score is not None else -position, position, doc))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+
+        # Group by source, then merge runs of consecutive chunk indexes
+        by_source: Dict[str, List[Tuple[float, Document]]] = {}
+        for score, _, doc in ranked:
+            by_source.setdefault(doc.metadata.get('source', 'Unknown'), []).append((score, doc))
+        segments = []
+        for source, items in by_source.items():
+            items.sort(key=lambda item: (item[1].metadata.get('chunk_index') is None, item[1].metadata.get('chunk_index') or 0))
+            run: List[Tuple[float, Document]] = []
+            for score, doc in items:
+                index = doc.metadata.get('chunk_index')
+                if run and index is not None and run[-1][1].metadata.get('chunk_index') == index - 1:
+                    run.append((score, doc))
+                    continue
+                if run:
+                    segments.append(self._merge(source, run))
+                run = [(score, doc)]
+            if run:
+                segments.append(self._merge(source, run))
+        segments.sort(key=lambda segment: -segment[0])
+        return segments
+
+    def _merge(self, source: str, run: List[Tuple[float, Document]]) -> Tuple[float, str, str, str]:
+        text = run[0][1].page_content.strip()
+        for _, doc in run[1:]:
+            text = merge_overlap(text, doc.page_content.strip(), self.max_overlap)
+        pages = [doc.metadata.get(key) for _, doc in run for key in ('page', 'page_end') if doc.metadata.get(key)]
+        if pages:
+            first, last = min(pages), max(pages)
+            label = f", page {first}" if first == last else f", pages {first}-{last}"
+        else:
+            label = ''
+        return max(score for score, _ in run), source, label, text
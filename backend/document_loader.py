@@ -4,12 +4,33 @@ Handles loading and parsing different document types (PDF, DOCX, TXT)
 """
 
 import os
+import bisect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import fitz  # PyMuPDF
 from docx import Document as DocxDocument
-from typing import List, Optional
+from typing import List, Optional, Callable, Iterable, Iterator, Tuple
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+# progress_callback(stage, done, total), e.g. ('parsed', pages_parsed, pages_total)
+ProgressCallback = Callable[[str, int, int], None]
+
+# Per-process loader used by load_many worker processes
+_worker_loader = None
+
+def _parse_task(file_path: str, page_start: Optional[int], page_end: Optional[int]) -> List[Document]:
+    """Parse a whole file, or a page range of a PDF, in a worker process"""
+    global _worker_loader
+    if _worker_loader is None:
+        _worker_loader = DocumentLoader()
+    if page_start is None:
+        documents = _worker_loader.load_document(file_path)
+        if documents is None:
+            raise ValueError(f"Could not parse {os.path.basename(file_path)}")
+        return documents
+    return list(_worker_loader._iter_pdf(file_path, start=page_start, end=page_end))
+
 class DocumentLoader:
     """Handles loading and processing different document types"""
     
@@ -22,58 +43,186 @@ class DocumentLoader:
             separators=["\n\n", "\n", " ", ""]
         )
     
-    def load_document(self, file_path: str) -> Optional[List[Document]]:
+    def load_document(self, file_path: str, progress_callback: Optional[ProgressCallback] = None) -> Optional[List[Document]]:
         """Load document based on file extension"""
         try:
-            file_extension = file_path.lower().split('.')[-1]
-            
-            if file_extension == 'pdf':
-                return self._load_pdf(file_path)
-            elif file_extension == 'docx':
-                return self._load_docx(file_path)
-            elif file_extension == 'txt':
-                return self._load_txt(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_extension}")
-                
+            return list(self.iter_document(file_path, progress_callback))
         except Exception as e:
             print(f"Error loading document {file_path}: {str(e)}")
             return None
     
-    def _load_pdf(self, file_path: str) -> List[Document]:
+    def iter_document(self, file_path: str, progress_callback: Optional[ProgressCallback] = None) -> Iterator[Document]:
+        """Yield document chunks lazily; PDFs are parsed page by page so chunks
+        are available (e.g. for embedding) before the whole file is parsed"""
+        file_extension = file_path.lower().split('.')[-1]
+        
+        if file_extension == 'pdf':
+            yield from self._iter_pdf(file_path, progress_callback)
+            return
+        elif file_extension == 'docx':
+            documents = self._load_docx(file_path)
+        elif file_extension == 'txt':
+            documents = self._load_txt(file_path)
+        else:
+            raise ValueError(f"Unsupported file type: {file_extension}")
+        
+        if progress_callback:
+            progress_callback('parsed', 1, 1)
+        yield from documents
+    
+    def load_many(self, file_paths: List[str], max_workers: Optional[int] = None,
+                  pages_per_task: int = 50) -> Iterator[Tuple[str, Optional[List[Document]], Optional[str]]]:
+        """Parse many files in a process pool, yielding (file_path, documents, error) per file.
+        
+        PDFs longer than pages_per_task are split into page ranges parsed in parallel
+        (chunks do not overlap across range boundaries). Results are yielded as files
+        complete; at most 2 * max_workers tasks are in flight, so a slow consumer (e.g.
+        the vector store) applies backpressure to parsing. A failing file yields an
+        error and does not abort the batch.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        tasks = []  # (file_path, page_start, page_end)
+        remaining = {}
+        for file_path in file_paths:
+            ranges = [(None, None)]
+            try:
+                if file_path.lower().endswith('.pdf'):
+                    with fitz.open(file_path) as doc:
+                        total_pages = len(doc)
+                    if total_pages > pages_per_task:
+                        ranges = [(start, min(start + pages_per_task, total_pages))
+                                  for start in range(0, total_pages, pages_per_task)]
+            except Exception as e:
+                yield file_path, None, str(e)
+                continue
+            remaining[file_path] = len(ranges)
+            tasks.extend((file_path, start, end) for start, end in ranges)
+        
+        results = {file_path: {} for file_path in remaining}
+        errors = {}
+        # spawn: forking a process that runs server and ingestion threads can copy held locks
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = {}
+            next_task = 0
+            while next_task < len(tasks) or pending:
+                while next_task < len(tasks) and len(pending) < max_workers * 2:
+                    file_path, start, end = tasks[next_task]
+                    pending[pool.submit(_parse_task, file_path, start, end)] = tasks[next_task]
+                    next_task += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, start, end = pending.pop(future)
+                    try:
+                        results[file_path][start or 0] = future.result()
+                    except Exception as e:
+                        errors.setdefault(file_path, str(e))
+                    remaining[file_path] -= 1
+                    if remaining[file_path] > 0:
+                        continue
+                    parts = results.pop(file_path)
+                    if file_path in errors:
+                        print(f"Error loading document {file_path}: {errors[file_path]}")
+                        yield file_path, None, errors.pop(file_path)
+                        continue
+                    documents = [doc for key in sorted(parts) for doc in parts[key]]
+                    for i, doc in enumerate(documents):
+                        doc.metadata['chunk_index'] = i + 1
+                    yield file_path, documents, None
+    
+    def _load_pdf(self, file_path: str, progress_callback: Optional[ProgressCallback] = None) -> List[Document]:
         """Load and parse PDF document"""
         try:
-            doc = fitz.open(file_path)
-            text_content = ""
-            
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text_content += page.get_text()
-            
-            doc.close()
-            
-            # Split text into chunks
-            text_chunks = self.text_splitter.split_text(text_content)
-            
-            # Create Document objects
-            documents = []
-            for i, chunk in enumerate(text_chunks):
-                doc = Document(
-                    page_content=chunk,
-                    metadata={
-                        'source': os.path.basename(file_path),
-                        'page': i + 1,
-                        'file_type': 'pdf'
-                    }
-                )
-                documents.append(doc)
-            
-            return documents
-            
+            return list(self._iter_pdf(file_path, progress_callback))
         except Exception as e:
             print(f"Error loading PDF {file_path}: {str(e)}")
             return []
     
+    def _iter_pdf(self, file_path: str, progress_callback: Optional[ProgressCallback] = None,
+                  start: int = 0, end: Optional[int] = None) -> Iterator[Document]:
+        """Yield PDF chunks with the page range each chunk was taken from"""
+        source = os.path.basename(file_path)
+        pages = self.iter_pdf_pages(file_path, progress_callback, start=start, end=end)
+        for i, (chunk, page_start, page_end) in enumerate(self.iter_chunks(pages)):
+            yield Document(
+                page_content=chunk,
+                metadata={
+                    'source': source,
+                    'page': page_start,
+                    'page_end': page_end,
+                    'chunk_index': i + 1,
+                    'file_type': 'pdf'
+                }
+            )
+    
+    def iter_pdf_pages(self, file_path: str, progress_callback: Optional[ProgressCallback] = None,
+                       start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page_number, text) one page at a time (page numbers are 1-based)"""
+        doc = fitz.open(file_path)
+        try:
+            total = len(doc)
+            end = total if end is None else min(end, total)
+            for page_num in range(start, end):
+                text = doc.load_page(page_num).get_text()
+                if progress_callback:
+                    progress_callback('parsed', page_num + 1, total)
+                yield page_num + 1, text
+        finally:
+            doc.close()
+    
+    def iter_chunks(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int, int]]:
+        """Split a stream of (page_number, text) into (chunk, page_start, page_end).
+        
+        Text is buffered only until a few chunks are available; everything but the
+        last chunk is emitted and the last chunk is carried forward, so overlap
+        across page boundaries is preserved while memory stays O(page).
+        """
+        flush_size = self.text_splitter._chunk_size * 4
+        buffer = ""
+        page_offsets: List[int] = []  # buffer offset where each page starts
+        page_numbers: List[int] = []
+        
+        def page_at(offset: int) -> int:
+            return page_numbers[max(0, bisect.bisect_right(page_offsets, offset) - 1)]
+        
+        for page_number, text in pages:
+            if not text:
+                continue
+            page_offsets.append(len(buffer))
+            page_numbers.append(page_number)
+            buffer += text
+            if len(buffer) < flush_size:
+                continue
+            chunks = self.text_splitter.split_text(buffer)
+            if len(chunks) < 2:
+                continue
+            starts = self._chunk_starts(buffer, chunks)
+            for chunk, start in zip(chunks[:-1], starts[:-1]):
+                yield chunk, page_at(start), page_at(start + len(chunk) - 1)
+            # Carry the last (possibly unfinished) chunk forward and rebase page offsets onto it
+            carry = starts[-1]
+            keep = max(0, bisect.bisect_right(page_offsets, carry) - 1)
+            page_numbers = page_numbers[keep:]
+            page_offsets = [max(0, offset - carry) for offset in page_offsets[keep:]]
+            buffer = buffer[carry:]
+        
+        if buffer.strip():
+            chunks = self.text_splitter.split_text(buffer)
+            for chunk, start in zip(chunks, self._chunk_starts(buffer, chunks)):
+                yield chunk, page_at(start), page_at(start + len(chunk) - 1)
+    
+    @staticmethod
+    def _chunk_starts(text: str, chunks: List[str]) -> List[int]:
+        """Offsets of consecutive (overlapping) chunks within the text they were split from"""
+        starts = []
+        cursor = 0
+        for chunk in chunks:
+            start = text.find(chunk, cursor)
+            if start < 0:
+                start = cursor
+            starts.append(start)
+            cursor = start + 1
+        return starts
+    
     def _load_docx(self, file_path: str) -> List[Document]:
         """Load and parse DOCX document"""
         try:
@@ -94,6 +243,7 @@ class DocumentLoader:
                     metadata={
                         'source': os.path.basename(file_path),
                         'section': i + 1,
+                        'chunk_index': i + 1,
                         'file_type': 'docx'
                     }
                 )
@@ -122,6 +272,7 @@ class DocumentLoader:
                     metadata={
                         'source': os.path.basename(file_path),
                         'section': i + 1,
+                        'chunk_index': i + 1,
                         'file_type': 'txt'
                     }
                 )
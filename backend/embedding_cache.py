@@ -0,0 +1,144 @@
+"""
+Embedding Cache Module
+Persistent on-disk cache of embeddings keyed by (model name, sha256 of text)
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain.schema.embeddings import Embeddings
+
+
+def content_hash(text: str) -> str:
+    """sha256 hex digest of a chunk text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite store of float32 embedding vectors keyed by (model, sha256(text))"""
+
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_BATCH = 500
+
+    def __init__(self, db_path: str):
+        """Open (or create) the cache database"""
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up embeddings for texts; misses are returned as None"""
+        hashes = [content_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique = list(set(hashes))
+            for start in range(0, len(unique), self.LOOKUP_BATCH):
+                batch = unique[start:start + self.LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model] + batch
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = blob
+        results = []
+        for digest in hashes:
+            blob = found.get(digest)
+            if blob is None:
+                results.append(None)
+            else:
+                vector = array('f')
+                vector.frombytes(blob)
+                results.append(vector.tolist())
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Store embeddings for texts"""
+        rows = [
+            (model, content_hash(text), array('f', vector).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def count(self, model: Optional[str] = None) -> int:
+        """Number of cached vectors (optionally for one model)"""
+        with self._lock:
+            if model:
+                row = self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return row[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that consults an EmbeddingCache before running the model"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str, query_cache_size: int = 1024):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        # In-process LRU of query vectors; queries are never written to the SQLite cache,
+        # which only holds chunk vectors and would otherwise grow with every distinct question
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, only running the model for texts not in the cache"""
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Identical chunks within one call are embedded once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            new_vectors = self.embeddings.embed_documents(missing_texts)
+            self.cache.put_many(self.model_name, missing_texts, new_vectors)
+            by_text = {text: list(vector) for text, vector in zip(missing_texts, new_vectors)}
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        print(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query string, reusing a vector from the in-process LRU when available"""
+        with self._query_lock:
+            vector = self._query_cache.get(text)
+            if vector is not None:
+                self._query_cache.move_to_end(text)
+                self.query_hits += 1
+                return list(vector)
+            self.query_misses += 1
+        vector = list(self.embeddings.embed_query(text))
+        if self.query_cache_size > 0:
+            with self._query_lock:
+                self._query_cache[text] = vector
+                self._query_cache.move_to_end(text)
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+        return list(vector)
+
+    def query_cache_stats(self) -> Dict[str, int]:
+        """Size and hit/miss counters of the in-process query LRU"""
+        with self._query_lock:
+            return {'entries': len(self._query_cache), 'hits': self.query_hits, 'misses': self.query_misses}
@@ -0,0 +1,84 @@
+"""
+Gemini Registry Module
+Configures google.generativeai once and caches model handles and the model list
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from config import Config
+
+
+class GeminiModelRegistry:
+    """Per-model GenerativeModel handles (with generation config, LRU-bounded) and a TTL-cached model list"""
+
+    def __init__(self, api_key: Optional[str], list_ttl: float = 300, max_handles: int = 8):
+        self.api_key = api_key
+        self.list_ttl = list_ttl
+        # model_name comes from the request, so only the most recently used handles are kept
+        self.max_handles = max_handles
+        self._genai = None
+        self._lock = threading.Lock()
+        self._models: "OrderedDict[str, Any]" = OrderedDict()
+        self._generation_configs: Dict[str, Dict[str, Any]] = {}
+        self._model_list: Optional[List[str]] = None
+        self._model_list_at = 0.0
+
+    def _client(self):
+        """Import and configure google.generativeai on first use"""
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._genai = genai
+        return self._genai
+
+    def generation_config(self, model_name: str) -> Dict[str, Any]:
+        """Generation settings used for a model (defaults from Config)"""
+        config = {'temperature': Config.TEMPERATURE, 'max_output_tokens': Config.MAX_TOKENS}
+        config.update(self._generation_configs.get(model_name, {}))
+        return config
+
+    def set_generation_config(self, model_name: str, **overrides):
+        """Override generation settings for one model (its cached handle is rebuilt)"""
+        with self._lock:
+            self._generation_configs.setdefault(model_name, {}).update(overrides)
+            self._models.pop(model_name, None)
+
+    def model(self, model_name: str):
+        """Cached GenerativeModel handle for model_name"""
+        with self._lock:
+            handle = self._models.get(model_name)
+            if handle is not None:
+                self._models.move_to_end(model_name)
+                return handle
+        genai = self._client()
+        with self._lock:
+            handle = self._models.get(model_name)
+            if handle is None:
+                handle = genai.GenerativeModel(model_name, generation_config=self.generation_config(model_name))
+                self._models[model_name] = handle
+                while len(self._models) > self.max_handles:
+                    self._models.popitem(last=False)
+        return handle
+
+    def list_models(self, force: bool = False) -> List[str]:
+        """Text model names from the API, refreshed at most every list_ttl seconds"""
+        if not force and self._model_list is not None and time.time() - self._model_list_at < self.list_ttl:
+            return self._model_list
+        genai = self._client()
+        # Lọc các model text (không phải vision)
+        names = [m.name for m in genai.list_models() if 'vision' not in m.name]
+        with self._lock:
+            self._model_list = names
+            self._model_list_at = time.time()
+        return names
+
+    def stats(self) -> Dict[str, Any]:
+        """Cached handles and model list age"""
+        return {
+            'handles': list(self._models),
+            'model_list_age_seconds': round(time.time() - self._model_list_at, 1) if self._model_list is not None else None
+        }
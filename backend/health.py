@@ -0,0 +1,86 @@
+"""
+Health Monitor Module
+Background thread that runs status checks (store counts, provider probes) on an interval
+and keeps the latest results as a snapshot, so status endpoints never block on them
+"""
+
+import time
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+class HealthMonitor:
+    """Runs every check each `interval` seconds; refresh(name) re-runs one early (e.g. after a store write)"""
+
+    def __init__(self, checks: Dict[str, Callable[[], Dict[str, Any]]], interval: float = 10):
+        self.checks = checks
+        self.interval = interval
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> threading.Thread:
+        """Start the background thread (once); the first round of checks runs immediately"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def refresh(self, name: Optional[str] = None):
+        """Ask the thread to re-run one check (or all) now; never blocks"""
+        with self._lock:
+            self._pending.update([name] if name else self.checks)
+        self._wake.set()
+
+    def run_checks(self, names: Optional[Iterable[str]] = None):
+        """Run checks synchronously and store their results"""
+        for name in list(names or self.checks):
+            start = time.perf_counter()
+            try:
+                result = dict(self.checks[name]())
+                result.setdefault('ok', True)
+                result['error'] = None
+            except Exception as e:
+                with self._lock:
+                    already_failing = self._results.get(name, {}).get('error') is not None
+                # Log transitions only, not every interval while a backend stays down
+                if not already_failing:
+                    print(f"Health check {name} failed: {str(e)}")
+                result = {'ok': False, 'error': str(e)}
+            result['checked_at'] = datetime.now().isoformat()
+            result['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            result['_checked'] = time.time()
+            with self._lock:
+                self._results[name] = result
+
+    def _run(self):
+        next_full = time.monotonic()
+        while not self._stopped.is_set():
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            # Early refreshes must not postpone the periodic probes
+            if time.monotonic() >= next_full:
+                self.run_checks()
+                next_full = time.monotonic() + self.interval
+            elif pending:
+                self.run_checks(pending)
+            self._wake.wait(max(0.0, next_full - time.monotonic()))
+            self._wake.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Latest result of every check with its timestamp and age (checks not run yet are missing)"""
+        now = time.time()
+        with self._lock:
+            results = {name: dict(result) for name, result in self._results.items()}
+        for result in results.values():
+            result['age_seconds'] = round(now - result.pop('_checked'), 2)
+        return {'generated_at': datetime.now().isoformat(), 'interval_seconds': self.interval, 'checks': results}
@@ -0,0 +1,238 @@
+"""
+HTTP Client Module
+Shared pooled HTTP session for the local LLM server: keep-alive, timeouts, jittered retries and latency metrics
+"""
+
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from typing import Dict, Any, Optional, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from config import Config
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class _RetryingClient:
+    """Retry policy and per-endpoint latency metrics shared by the sync and async clients"""
+
+    # Responses worth retrying (server busy / restarting)
+    RETRY_STATUSES = {429, 502, 503, 504}
+    # Methods that are safe to resend after the request may have reached the server
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+    # Latency samples kept per endpoint for percentiles
+    SAMPLE_SIZE = 512
+
+    def __init__(self, connect_timeout: float = 3.05, read_timeout: float = 30,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._metrics_lock = threading.Lock()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, honouring a numeric Retry-After up to backoff_max"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        return delay
+
+    def _record(self, key: str, seconds: float, error: bool, retry: bool):
+        with self._metrics_lock:
+            entry = self._metrics.setdefault(key, {
+                'requests': 0, 'errors': 0, 'retries': 0, 'max_ms': 0.0,
+                'samples': deque(maxlen=self.SAMPLE_SIZE)
+            })
+            ms = seconds * 1000
+            entry['requests'] += 1
+            entry['errors'] += int(error)
+            entry['retries'] += int(retry)
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['samples'].append(ms)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-endpoint request/error/retry counts and latency (time to response headers) percentiles"""
+        with self._metrics_lock:
+            result = {}
+            for key, entry in self._metrics.items():
+                samples = sorted(entry['samples'])
+                result[key] = {
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'retries': entry['retries'],
+                    'p50_ms': round(samples[len(samples) // 2], 2) if samples else None,
+                    'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2) if samples else None,
+                    'max_ms': round(entry['max_ms'], 2)
+                }
+            return result
+
+
+class HTTPClient(_RetryingClient):
+    """requests.Session with a sized connection pool, (connect, read) timeouts and retry with full-jitter backoff"""
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 3.05, read_timeout: float = 30,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0):
+        super().__init__(connect_timeout, read_timeout, max_retries, backoff_base, backoff_max)
+        self.session = requests.Session()
+        # Retries are done here (not by urllib3) so they can be jittered and counted
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None,
+                retries: Optional[int] = None, **kwargs) -> requests.Response:
+        """Send a request, retrying failed connects (see _retryable) and RETRY_STATUSES responses.
+
+        Read timeouts and dropped connections of non-idempotent requests are not retried.
+        The last response (even a failing status) is returned; the last exception is raised.
+        """
+        timeout = timeout if timeout is not None else (self.connect_timeout, self.read_timeout)
+        retries = self.max_retries if retries is None else retries
+        key = f"{method.upper()} {urlsplit(url).path or '/'}"
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(key, time.perf_counter() - start, error=True, retry=attempt > 0)
+                # Only failures before the request reached the server are retried: a completion POST that
+                # timed out or lost its connection may still be generating, and resending would run it twice
+                if attempt == retries or not self._retryable(method, e):
+                    raise
+                self._sleep(attempt)
+                continue
+            failed = response.status_code in self.RETRY_STATUSES
+            self._record(key, time.perf_counter() - start, error=failed, retry=attempt > 0)
+            if not failed or attempt == retries:
+                return response
+            response.close()
+            self._sleep(attempt, response.headers.get('Retry-After'))
+
+    def _retryable(self, method: str, error: requests.exceptions.RequestException) -> bool:
+        """True if the request never reached the server (connect failure / connect timeout),
+        or failed on the connection and is idempotent"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(error, requests.exceptions.ConnectionError):
+            return False  # read timeouts and the rest
+        cause = error.args[0] if error.args else None
+        if isinstance(cause, MaxRetryError) and isinstance(cause.reason, NewConnectionError):
+            return True
+        # "Connection aborted" / RemoteDisconnected can happen after the body was sent
+        return method.upper() in self.IDEMPOTENT_METHODS
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def _sleep(self, attempt: int, retry_after: Optional[str] = None):
+        time.sleep(self._backoff(attempt, retry_after))
+
+
+class AsyncHTTPClient(_RetryingClient):
+    """httpx.AsyncClient counterpart of HTTPClient for the async serving mode (same retries and metrics)"""
+
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 3.05, read_timeout: float = 30,
+                 max_retries: int = 2, backoff_base: float = 0.25, backoff_max: float = 4.0):
+        super().__init__(connect_timeout, read_timeout, max_retries, backoff_base, backoff_max)
+        # httpx is only needed when serving through asgi.py
+        import httpx
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=self._timeout(None)
+        )
+
+    def _timeout(self, timeout: Optional[Timeout]):
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            return self._httpx.Timeout(timeout[1], connect=timeout[0])
+        return self._httpx.Timeout(timeout)
+
+    async def request(self, method: str, url: str, timeout: Optional[Timeout] = None,
+                      retries: Optional[int] = None, stream: bool = False, **kwargs):
+        """Async HTTPClient.request; with stream=True the caller must `await response.aclose()`"""
+        retries = self.max_retries if retries is None else retries
+        key = f"{method.upper()} {urlsplit(url).path or '/'}"
+        request = self.client.build_request(method, url, timeout=self._timeout(timeout), **kwargs)
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = await self.client.send(request, stream=stream)
+            except self._httpx.TransportError as e:
+                self._record(key, time.perf_counter() - start, error=True, retry=attempt > 0)
+                retryable = (self._httpx.ConnectError, self._httpx.ConnectTimeout, self._httpx.PoolTimeout)
+                if attempt == retries or not isinstance(e, retryable):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            failed = response.status_code in self.RETRY_STATUSES
+            self._record(key, time.perf_counter() - start, error=failed, retry=attempt > 0)
+            if not failed or attempt == retries:
+                return response
+            await response.aclose()
+            await asyncio.sleep(self._backoff(attempt, response.headers.get('Retry-After')))
+
+    async def get(self, url: str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_shared_client: Optional[HTTPClient] = None
+_shared_lock = threading.Lock()
+
+
+def local_llm_client() -> HTTPClient:
+    """Process-wide client for LM Studio traffic, configured from Config"""
+    global _shared_client
+    if _shared_client is None:
+        with _shared_lock:
+            if _shared_client is None:
+                _shared_client = HTTPClient(
+                    pool_size=Config.LOCAL_LLM_POOL_SIZE,
+                    connect_timeout=Config.LOCAL_LLM_CONNECT_TIMEOUT,
+                    read_timeout=Config.LOCAL_LLM_READ_TIMEOUT,
+                    max_retries=Config.LOCAL_LLM_MAX_RETRIES,
+                    backoff_base=Config.LOCAL_LLM_BACKOFF
+                )
+    return _shared_client
+
+
+_shared_async_client: Optional[AsyncHTTPClient] = None
+
+
+def local_llm_async_client() -> AsyncHTTPClient:
+    """Process-wide async client for LM Studio traffic (asgi.py), configured from Config"""
+    global _shared_async_client
+    if _shared_async_client is None:
+        with _shared_lock:
+            if _shared_async_client is None:
+                _shared_async_client = AsyncHTTPClient(
+                    pool_size=Config.LOCAL_LLM_POOL_SIZE,
+                    connect_timeout=Config.LOCAL_LLM_CONNECT_TIMEOUT,
+                    read_timeout=Config.LOCAL_LLM_READ_TIMEOUT,
+                    max_retries=Config.LOCAL_LLM_MAX_RETRIES,
+                    backoff_base=Config.LOCAL_LLM_BACKOFF
+                )
+    return _shared_async_client
+
+
+def async_client_started() -> bool:
+    """True once the async client exists (for /metrics)"""
+    return _shared_async_client is not None
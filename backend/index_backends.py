@@ -0,0 +1,700 @@
+"""
+Index Backends Module
+Storage/search engines under VectorStore: Chroma (default) and in-process FAISS
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from langchain_community.vectorstores import Chroma
+
+# (chunk_id, text, metadata) as returned by get / iter_all
+Record = Tuple[str, str, Dict[str, Any]]
+
+
+class IndexBackend(ABC):
+    """Interface of a vector index with a chunk text/metadata side store.
+
+    Vectors are L2-normalized embeddings; query() returns (chunk_id, text, metadata, distance)
+    with smaller distance meaning more similar.
+    """
+
+    name = 'base'
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Insert chunks, replacing any chunk with the same id"""
+
+    @abstractmethod
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """Replace the metadata of existing chunks (vectors are untouched)"""
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """Remove chunks by id"""
+
+    @abstractmethod
+    def get(self, ids: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        """chunk_id -> (text, metadata) for the ids that exist"""
+
+    @abstractmethod
+    def ids_for_source(self, source: str) -> List[str]:
+        """Chunk ids whose metadata source equals source"""
+
+    @abstractmethod
+    def iter_all(self, include_documents: bool = True, page_size: int = 1000) -> Iterator[Record]:
+        """Every stored chunk, read in pages (text is '' when include_documents is False)"""
+
+    @abstractmethod
+    def query(self, embedding: List[float], k: int) -> List[Tuple[str, str, Dict[str, Any], float]]:
+        """Nearest chunks to a query embedding"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored chunks"""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every chunk; the backend stays usable"""
+
+    def persist(self):
+        """Flush pending changes to disk"""
+
+    def close(self):
+        """Release files and connections"""
+
+    def describe(self) -> Dict[str, Any]:
+        """Backend name and index parameters for stats"""
+        return {'backend': self.name}
+
+
+class ChromaBackend(IndexBackend):
+    """LangChain Chroma collection (the original storage layout)"""
+
+    name = 'chroma'
+
+    def __init__(self, persist_directory: str, embedding_function, collection_name: str = "rag_documents"):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self._open()
+
+    def _open(self):
+        self.store = Chroma(
+            persist_directory=self.persist_directory,
+            embedding_function=self.embedding_function,
+            collection_name=self.collection_name
+        )
+
+    @property
+    def collection(self):
+        return self.store._collection
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadata(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def get(self, ids):
+        results = self.collection.get(ids=list(ids), include=['documents', 'metadatas'])
+        return {
+            chunk_id: (results['documents'][i], dict(results['metadatas'][i] or {}))
+            for i, chunk_id in enumerate(results['ids'])
+        }
+
+    def ids_for_source(self, source):
+        # Metadata-filtered get that loads no documents or embeddings
+        return self.collection.get(where={'source': source}, include=[])['ids']
+
+    def iter_all(self, include_documents=True, page_size=1000):
+        include = ['documents', 'metadatas'] if include_documents else ['metadatas']
+        offset = 0
+        while True:
+            results = self.collection.get(include=include, limit=page_size, offset=offset)
+            if not results['ids']:
+                return
+            for i, chunk_id in enumerate(results['ids']):
+                text = results['documents'][i] if include_documents else ''
+                yield chunk_id, text, dict(results['metadatas'][i] or {})
+            offset += len(results['ids'])
+
+    def query(self, embedding, k):
+        total = self.collection.count()
+        if total == 0:
+            return []
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=min(k, total),
+            include=['documents', 'metadatas', 'distances']
+        )
+        return [
+            (chunk_id, results['documents'][0][i], dict(results['metadatas'][0][i] or {}), results['distances'][0][i])
+            for i, chunk_id in enumerate(results['ids'][0])
+        ]
+
+    def count(self):
+        return self.collection.count()
+
+    def clear(self):
+        self.store._client.delete_collection(self.collection_name)
+        self._open()
+
+    def persist(self):
+        self.store.persist()
+
+
+class _ReadWriteLock:
+    """Many concurrent readers or one writer (FAISS searches may run in parallel, mutations may not);
+    waiting writers go first so a steady stream of searches cannot starve them"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class FaissBackend(IndexBackend):
+    """In-process FAISS index over inner product, with an SQLite side table for ids, texts and metadata.
+
+    index_type:
+      - 'flat':  exact search (IndexFlatIP)
+      - 'sq8':   int8 scalar-quantized codes (4x smaller than float32)
+      - 'pq':    product-quantized codes, pq_m bytes per vector
+      - 'ivfpq': IVF + product quantization
+      - 'hnsw':  graph search (IndexHNSWFlat); deletes are tombstones, compacted on persist
+    Quantized types stay flat until train_size vectors exist, then train. Their full-precision
+    vectors are also appended to a float32 file (faiss_vectors.f32, row-addressed) that is
+    memory-mapped at query time: the top k * rerank_factor candidates from the codes are
+    re-ranked by exact cosine.
+    Every chunk gets a sequential integer row that is its FAISS id. Rows of deleted chunks are
+    not reused; once they make up COMPACT_RATIO of the vectors file, persist() rewrites the file
+    with the live rows only and renumbers them (re-keying the index).
+    IVF inverted lists are memory-mapped on load and read fully before the first write;
+    other index types are read into RAM.
+    """
+
+    name = 'faiss'
+    INDEX_TYPES = ('flat', 'sq8', 'pq', 'ivfpq', 'hnsw')
+    QUANTIZED_TYPES = ('sq8', 'pq', 'ivfpq')
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_BATCH = 500
+    # Rebuild an HNSW index (or rewrite the vectors file) when this share of its vectors are dead
+    COMPACT_RATIO = 0.2
+
+    def __init__(self, persist_directory: str, index_type: str = 'flat', nlist: int = 1024, pq_m: int = 64,
+                 nprobe: int = 16, hnsw_m: int = 32, ef_search: int = 64, train_size: Optional[int] = None,
+                 rerank_factor: int = 10):
+        """Open (or create) the index file and side table in persist_directory"""
+        try:
+            import faiss
+        except ImportError:
+            raise ImportError("VECTOR_BACKEND=faiss requires the faiss-cpu package")
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS index type: {index_type} (expected one of {self.INDEX_TYPES})")
+        self.faiss = faiss
+        self.persist_directory = persist_directory
+        self.index_path = os.path.join(persist_directory, "faiss.index")
+        self.vectors_path = os.path.join(persist_directory, "faiss_vectors.f32")
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.rerank_factor = rerank_factor
+        self._train_size = train_size
+        self._vectors_map = None  # cached np.memmap of vectors_path
+        # _lock guards SQLite and bookkeeping; _index_lock lets searches share the index while writes mutate it alone
+        self._lock = threading.RLock()
+        self._index_lock = _ReadWriteLock()
+        self._dirty = False
+        self._mmapped = False
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(persist_directory, "faiss_meta.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT NOT NULL,"
+            " source TEXT,"
+            " document TEXT NOT NULL,"
+            " metadata TEXT NOT NULL,"
+            " deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Tombstoned HNSW rows keep their id, so uniqueness only holds for live rows
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS chunks_id ON chunks (id) WHERE deleted = 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        self.configured_type = index_type
+        stored_type = self._setting('index_type')
+        if stored_type and stored_type != index_type:
+            print(f"FAISS index on disk is '{stored_type}', ignoring FAISS_INDEX_TYPE={index_type} until it is cleared")
+            index_type = stored_type
+        self.index_type = index_type
+        self.dim = int(self._setting('dim') or 0) or None
+        self._load_counts()
+        self.index = None
+        self._load()
+
+    @property
+    def train_size(self) -> int:
+        """Vectors needed before a quantized index is trained"""
+        if self._train_size:
+            return self._train_size
+        # k-means wants ~39 points per centroid (nlist IVF centroids, 256 per PQ sub-quantizer)
+        if self.index_type == 'ivfpq':
+            return self.nlist * 39
+        if self.index_type == 'pq':
+            return 256 * 39
+        return 1000  # sq8 only learns per-dimension value ranges
+
+    # -- settings / persistence -------------------------------------------------
+
+    def _setting(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value: Any):
+        self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load_counts(self):
+        """Live / tombstoned chunk counters (kept in settings; counted once for stores created before them)"""
+        live, tombstones = self._setting('live_count'), self._setting('tombstone_count')
+        if live is None or tombstones is None:
+            live, tombstones = self._conn.execute(
+                "SELECT COALESCE(SUM(deleted = 0), 0), COALESCE(SUM(deleted = 1), 0) FROM chunks"
+            ).fetchone()
+            self._live, self._tombstone_count = int(live), int(tombstones)
+            self._save_counts()
+            self._conn.commit()
+        else:
+            self._live, self._tombstone_count = int(live), int(tombstones)
+
+    def _save_counts(self):
+        """Write the counters in the transaction of the rows they describe"""
+        self._set_setting('live_count', self._live)
+        self._set_setting('tombstone_count', self._tombstone_count)
+
+    def _load(self):
+        """Load the index file if present; the inverted lists of IVF indexes stay memory-mapped"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            self.index = self.faiss.read_index(self.index_path, self.faiss.IO_FLAG_MMAP)
+            # FAISS only maps IVF inverted lists; flat, HNSW, sq8 and pq indexes are read into RAM (and stay writable)
+            self._mmapped = self.faiss.try_extract_index_ivf(self.index) is not None
+        except Exception:
+            self.index = self.faiss.read_index(self.index_path)
+            self._mmapped = False
+        self._apply_search_params()
+        print(f"Loaded FAISS {self.index_type} index with {self.index.ntotal} vectors")
+
+    def _writable(self):
+        """Replace a memory-mapped (read-only) index by an in-memory copy before mutating it"""
+        if self._mmapped:
+            self.index = self.faiss.read_index(self.index_path)
+            self._mmapped = False
+            self._apply_search_params()
+
+    def persist(self):
+        """Train/compact if due, then write the index atomically"""
+        with self._index_lock.write(), self._lock:
+            if not self._dirty:
+                return
+            self._maybe_train()
+            self._maybe_compact()
+            self._maybe_compact_vectors()
+            if self.index is not None:
+                tmp_path = self.index_path + '.tmp'
+                self.faiss.write_index(self.index, tmp_path)
+                os.replace(tmp_path, self.index_path)
+            self._conn.commit()
+            self._dirty = False
+
+    def close(self):
+        with self._lock:
+            self.persist()
+            self._conn.close()
+
+    # -- index construction ------------------------------------------------------
+
+    def _flat_index(self):
+        return self.faiss.IndexIDMap2(self.faiss.IndexFlatIP(self.dim))
+
+    def _new_index(self):
+        """Empty index for the configured type (IVF-PQ starts flat until trained)"""
+        if self.index_type == 'hnsw':
+            return self.faiss.IndexIDMap2(self.faiss.IndexHNSWFlat(self.dim, self.hnsw_m, self.faiss.METRIC_INNER_PRODUCT))
+        return self._flat_index()
+
+    def _apply_search_params(self):
+        inner = self.faiss.downcast_index(self.index.index) if hasattr(self.index, 'id_map') else self.index
+        if isinstance(inner, self.faiss.IndexIVF):
+            inner.nprobe = self.nprobe
+        elif isinstance(inner, self.faiss.IndexHNSW):
+            inner.hnsw.efSearch = self.ef_search
+
+    def _is_staging(self) -> bool:
+        """True while the index is the flat one a quantized type starts with"""
+        inner = self.faiss.downcast_index(self.index.index) if hasattr(self.index, 'id_map') else self.index
+        return isinstance(inner, self.faiss.IndexFlat)
+
+    def _quantized_index(self):
+        """Untrained index for a quantized type"""
+        metric = self.faiss.METRIC_INNER_PRODUCT
+        if self.index_type == 'sq8':
+            return self.faiss.IndexIDMap2(self.faiss.IndexScalarQuantizer(self.dim, self.faiss.ScalarQuantizer.QT_8bit, metric))
+        if self.index_type == 'pq':
+            return self.faiss.IndexIDMap2(self.faiss.IndexPQ(self.dim, self.pq_m, 8, metric))
+        quantizer = self.faiss.IndexFlatIP(self.dim)
+        return self.faiss.IndexIVFPQ(quantizer, self.dim, self.nlist, self.pq_m, 8, metric)
+
+    def _all_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(vectors, ids) stored in an IndexIDMap2 over a flat or HNSW index"""
+        ids = self.faiss.vector_to_array(self.index.id_map).astype('int64')
+        inner = self.faiss.downcast_index(self.index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal else np.zeros((0, self.dim), dtype='float32')
+        return vectors, ids
+
+    def _maybe_train(self):
+        """Switch a quantized store from its flat staging index to a trained index"""
+        if self.index_type not in self.QUANTIZED_TYPES or self.index is None or not self._is_staging():
+            return
+        if self.index.ntotal < self.train_size:
+            return
+        if self.index_type != 'sq8' and self.dim % self.pq_m != 0:
+            print(f"FAISS_PQ_M={self.pq_m} does not divide dimension {self.dim}; keeping flat index")
+            return
+        vectors, ids = self._all_vectors()
+        print(f"Training FAISS {self.index_type} index on {len(ids)} vectors...")
+        index = self._quantized_index()
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        self._apply_search_params()
+
+    def _tombstones(self) -> int:
+        return self._tombstone_count
+
+    def _maybe_compact(self):
+        """Rebuild an HNSW index without its tombstoned vectors"""
+        if self.index_type != 'hnsw' or self.index is None:
+            return
+        tombstones = self._tombstones()
+        if tombstones == 0 or tombstones < self.COMPACT_RATIO * self.index.ntotal:
+            return
+        vectors, ids = self._all_vectors()
+        live = {row for (row,) in self._conn.execute("SELECT row FROM chunks WHERE deleted = 0")}
+        keep = np.array([row in live for row in ids], dtype=bool)
+        index = self._new_index()
+        if keep.any():
+            index.add_with_ids(np.ascontiguousarray(vectors[keep]), ids[keep])
+        self.index = index
+        self._apply_search_params()
+        self._conn.execute("DELETE FROM chunks WHERE deleted = 1")
+        self._tombstone_count = 0
+        self._save_counts()
+        print(f"Compacted FAISS HNSW index: dropped {tombstones} deleted vectors")
+
+    def _maybe_compact_vectors(self):
+        """Rewrite faiss_vectors.f32 without the rows of deleted chunks; live chunks get rows 1..n"""
+        if self.index_type not in self.QUANTIZED_TYPES or self.index is None or not os.path.exists(self.vectors_path):
+            return
+        file_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        dead = file_rows - self._live
+        if dead <= 0 or dead < self.COMPACT_RATIO * file_rows:
+            return
+        old_rows = [row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")]
+        vectors = self._read_vectors(old_rows) if old_rows else np.zeros((0, self.dim), dtype='float32')
+        if vectors is None:
+            return  # some rows were never stored (re-ranking already skips them); keep the file as it is
+        vectors = np.ascontiguousarray(vectors)
+        new_rows = np.arange(1, len(old_rows) + 1, dtype='int64')
+        tmp_path = self.vectors_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(vectors.tobytes())
+        # Ascending order: each new row is <= its old row, so no update hits a row still in use
+        self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                               [(new, old) for new, old in zip(new_rows.tolist(), old_rows) if new != old])
+        self._conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'chunks'", (len(old_rows),))
+        # Same codes under the new ids (the trained quantizer is kept)
+        self._writable()
+        self.index.reset()
+        if len(old_rows):
+            self.index.add_with_ids(vectors, new_rows)
+        os.replace(tmp_path, self.vectors_path)
+        self._vectors_map = None
+        print(f"Compacted FAISS vectors file: dropped {dead} deleted rows")
+
+    # -- full-precision vectors for re-ranking --------------------------------------
+
+    def _write_vectors(self, rows: List[int], vectors: np.ndarray):
+        """Store float32 vectors at their row offsets (row 1 is the first record)"""
+        row_bytes = self.dim * 4
+        with open(self.vectors_path, 'r+b' if os.path.exists(self.vectors_path) else 'wb') as f:
+            if rows[-1] - rows[0] == len(rows) - 1:
+                # Rows of one upsert are consecutive: a single write
+                f.seek((rows[0] - 1) * row_bytes)
+                f.write(vectors.tobytes())
+            else:
+                for row, vector in zip(rows, vectors):
+                    f.seek((row - 1) * row_bytes)
+                    f.write(vector.tobytes())
+        self._vectors_map = None
+
+    def _read_vectors(self, rows: List[int]) -> Optional[np.ndarray]:
+        """Full-precision vectors of rows from the memory-mapped file (None if not all are stored)"""
+        if not os.path.exists(self.vectors_path):
+            return None
+        n_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        if max(rows) > n_rows:
+            return None
+        if self._vectors_map is None or len(self._vectors_map) != n_rows:
+            self._vectors_map = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(n_rows, self.dim))
+        return self._vectors_map[np.asarray(rows, dtype='int64') - 1]
+
+    # -- writes --------------------------------------------------------------------
+
+    def _remove_rows(self, rows: List[int]):
+        """Drop vectors from the index (HNSW cannot remove: rows become tombstones)"""
+        if not rows:
+            return
+        if self.index_type == 'hnsw':
+            self._conn.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?",
+                                   [(row,) for row in rows])
+            self._tombstone_count += len(rows)
+        else:
+            if self.index is not None:
+                self._writable()
+                self.index.remove_ids(np.array(rows, dtype='int64'))
+            self._conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in rows])
+        self._live -= len(rows)
+
+    def _rows_for_ids(self, ids: List[str]) -> Dict[str, int]:
+        found = {}
+        for start in range(0, len(ids), self.LOOKUP_BATCH):
+            batch = ids[start:start + self.LOOKUP_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            for chunk_id, row in self._conn.execute(
+                    f"SELECT id, row FROM chunks WHERE deleted = 0 AND id IN ({placeholders})", batch):
+                found[chunk_id] = row
+        return found
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(np.asarray(embeddings, dtype='float32'))
+        self.faiss.normalize_L2(vectors)
+        with self._index_lock.write(), self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_setting('dim', self.dim)
+                self._set_setting('index_type', self.index_type)
+            if self.index is None:
+                self.index = self._new_index()
+                self._apply_search_params()
+            self._writable()
+            # Replacing a chunk = delete + insert under a new row
+            self._remove_rows(list(self._rows_for_ids(list(ids)).values()))
+            rows = []
+            for chunk_id, text, metadata in zip(ids, documents, metadatas):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (id, source, document, metadata) VALUES (?, ?, ?, ?)",
+                    (chunk_id, metadata.get('source'), text, json.dumps(metadata, ensure_ascii=False))
+                )
+                rows.append(cursor.lastrowid)
+            if self.index_type in self.QUANTIZED_TYPES:
+                self._write_vectors(rows, vectors)
+            self.index.add_with_ids(vectors, np.array(rows, dtype='int64'))
+            self._live += len(rows)
+            self._save_counts()
+            self._conn.commit()
+            self._dirty = True
+
+    def update_metadata(self, ids, metadatas):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET metadata = ?, source = ? WHERE id = ? AND deleted = 0",
+                [(json.dumps(metadata, ensure_ascii=False), metadata.get('source'), chunk_id)
+                 for chunk_id, metadata in zip(ids, metadatas)]
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._index_lock.write(), self._lock:
+            self._remove_rows(list(self._rows_for_ids(list(ids)).values()))
+            self._save_counts()
+            self._conn.commit()
+            self._dirty = True
+
+    # -- reads ---------------------------------------------------------------------
+
+    def get(self, ids):
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), self.LOOKUP_BATCH):
+                batch = ids[start:start + self.LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                for chunk_id, text, metadata in self._conn.execute(
+                        f"SELECT id, document, metadata FROM chunks WHERE deleted = 0 AND id IN ({placeholders})", batch):
+                    found[chunk_id] = (text, json.loads(metadata))
+        return found
+
+    def ids_for_source(self, source):
+        with self._lock:
+            return [chunk_id for (chunk_id,) in self._conn.execute(
+                "SELECT id FROM chunks WHERE source = ? AND deleted = 0 ORDER BY row", (source,))]
+
+    def iter_all(self, include_documents=True, page_size=1000):
+        text_column = 'document' if include_documents else "''"
+        last_row = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT row, id, {text_column}, metadata FROM chunks"
+                    " WHERE deleted = 0 AND row > ? ORDER BY row LIMIT ?",
+                    (last_row, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row, chunk_id, text, metadata in rows:
+                yield chunk_id, text, json.loads(metadata)
+            last_row = rows[-1][0]
+
+    def query(self, embedding, k):
+        vector = np.asarray([embedding], dtype='float32')
+        self.faiss.normalize_L2(vector)
+        # Shared lock: concurrent searches run in parallel, only index mutations wait
+        with self._index_lock.read():
+            index = self.index
+            if index is None or index.ntotal == 0:
+                return []
+            # Approximate scores from codes are re-ranked, so fetch k * rerank_factor candidates
+            rerank = self.index_type in self.QUANTIZED_TYPES and not self._is_staging()
+            fetch = k * self.rerank_factor if rerank else k
+            if self.index_type == 'hnsw':
+                # Over-fetch so tombstoned neighbours can be dropped; at most 2x, since compaction
+                # keeps tombstones under COMPACT_RATIO of the index
+                fetch += min(self._tombstone_count, fetch)
+            scores, rows = index.search(vector, min(index.ntotal, fetch))
+        hits = [(int(row), float(score)) for row, score in zip(rows[0], scores[0]) if row >= 0]
+        if not hits:
+            return []
+        with self._lock:
+            if rerank:
+                exact = self._read_vectors([row for row, _ in hits])
+                if exact is not None:
+                    # Exact cosine (vectors are normalized) from the full-precision file
+                    hits = sorted(zip([row for row, _ in hits], (exact @ vector[0]).tolist()),
+                                  key=lambda hit: hit[1], reverse=True)
+            placeholders = ','.join('?' * len(hits))
+            by_row = {
+                row: (chunk_id, text, json.loads(metadata))
+                for row, chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE deleted = 0 AND row IN ({placeholders})",
+                    [row for row, _ in hits])
+            }
+        results = []
+        for row, score in hits:
+            if row in by_row:
+                chunk_id, text, metadata = by_row[row]
+                # Cosine distance, like Chroma: smaller is closer
+                results.append((chunk_id, text, metadata, 1.0 - score))
+                if len(results) >= k:
+                    break
+        return results
+
+    def count(self):
+        return self._live
+
+    def clear(self):
+        with self._index_lock.write(), self._lock:
+            self.index = None
+            self._mmapped = False
+            self.dim = None
+            self._live = self._tombstone_count = 0
+            self.index_type = self.configured_type
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM settings")
+            # Restart rows at 1 so the vectors file does not keep a hole for old rows
+            self._conn.execute("DELETE FROM sqlite_sequence WHERE name = 'chunks'")
+            self._save_counts()
+            self._conn.commit()
+            self._vectors_map = None
+            for path in (self.index_path, self.vectors_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._dirty = False
+
+    def _code_size(self) -> Optional[int]:
+        """Bytes per vector held by the index (float32 until a quantized type is trained)"""
+        if self.dim is None:
+            return None
+        if self.index is None or self.index_type not in self.QUANTIZED_TYPES or self._is_staging():
+            return self.dim * 4
+        return self.dim if self.index_type == 'sq8' else self.pq_m
+
+    def describe(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'index_type': self.index_type,
+                'trained': (self.index is not None and not self._is_staging()) if self.index_type in self.QUANTIZED_TYPES else None,
+                'bytes_per_vector': self._code_size(),
+                'dimension': self.dim,
+                'vectors': self.index.ntotal if self.index is not None else 0,
+                'tombstones': self._tombstones(),
+                'memory_mapped': self._mmapped
+            }
+
+
+def create_index_backend(kind: str, persist_directory: str, embedding_function, **faiss_options) -> IndexBackend:
+    """Backend selected by VECTOR_BACKEND ('chroma' or 'faiss')"""
+    if kind == 'faiss':
+        return FaissBackend(persist_directory, **faiss_options)
+    if kind != 'chroma':
+        raise ValueError(f"Unknown vector backend: {kind}")
+    return ChromaBackend(persist_directory, embedding_function)
@@ -0,0 +1,269 @@
+"""
+Ingestion Module
+Background ingestion pipeline: bounded job queue, worker pool and real stage progress
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue cannot accept more jobs"""
+
+
+class IngestionJob:
+    """State and stage progress of one document ingestion"""
+
+    # Weight of each stage in the overall progress value
+    STAGE_WEIGHTS = {'parsed': 0.2, 'embedded': 0.5, 'persisted': 0.3}
+
+    def __init__(self, filename: str, file_path: str):
+        self.doc_id = str(uuid.uuid4())
+        self.filename = filename
+        self.file_path = file_path
+        self.status = 'queued'  # queued | processing | done | error
+        self.stage = 'queued'   # queued | parsing | embedding | done
+        self.error: Optional[str] = None
+        self.pages_total = 0
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_persisted = 0
+        self.result: Optional[Dict[str, int]] = None  # {'added', 'removed', 'unchanged'} chunk counts
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str, done: int, total: int):
+        """Progress callback used by DocumentLoader ('parsed') and VectorStore ('embedded', 'persisted')"""
+        with self._lock:
+            if stage == 'parsed':
+                self.stage = 'parsing'
+                self.pages_parsed, self.pages_total = done, total
+            elif stage == 'embedded':
+                self.stage = 'embedding'
+                self.chunks_embedded, self.chunks_total = done, total
+            elif stage == 'persisted':
+                self.chunks_persisted, self.chunks_total = done, total
+
+    @property
+    def progress(self) -> float:
+        """Overall progress in [0, 1] weighted across stages"""
+        if self.status == 'done':
+            return 1.0
+        fractions = {
+            'parsed': self.pages_parsed / self.pages_total if self.pages_total else 0.0,
+            'embedded': self.chunks_embedded / self.chunks_total if self.chunks_total else 0.0,
+            'persisted': self.chunks_persisted / self.chunks_total if self.chunks_total else 0.0,
+        }
+        return round(sum(self.STAGE_WEIGHTS[k] * v for k, v in fractions.items()), 4)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable status for /processing-status"""
+        with self._lock:
+            return {
+                'doc_id': self.doc_id,
+                'filename': self.filename,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': self.progress,
+                'error': self.error,
+                'pages_parsed': self.pages_parsed,
+                'pages_total': self.pages_total,
+                'chunks_embedded': self.chunks_embedded,
+                'chunks_persisted': self.chunks_persisted,
+                'chunks_total': self.chunks_total,
+                'result': self.result,
+                'queued_seconds': round((self.started_at or time.time()) - self.created_at, 3),
+                'elapsed_seconds': round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else 0.0
+            }
+
+
+class BatchIngestionJob:
+    """A group of files parsed together with DocumentLoader.load_many"""
+
+    def __init__(self, children: List[IngestionJob]):
+        self.doc_id = str(uuid.uuid4())
+        self.children = children
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def progress(self) -> float:
+        """Mean progress of the files in the batch"""
+        if not self.children:
+            return 1.0
+        return round(sum(child.progress for child in self.children) / len(self.children), 4)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable status for /processing-status"""
+        files = [child.to_dict() for child in self.children]
+        return {
+            'doc_id': self.doc_id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'files_total': len(files),
+            'files_done': sum(1 for f in files if f['status'] == 'done'),
+            'files_failed': sum(1 for f in files if f['status'] == 'error'),
+            'files': files,
+            'elapsed_seconds': round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else 0.0
+        }
+
+
+class IngestionQueue:
+    """Bounded job queue drained by a pool of worker threads"""
+
+    def __init__(self, document_loader, vector_store, num_workers: int = 2, max_queued: int = 32,
+                 max_finished: int = 500, parse_workers: Optional[int] = None, pages_per_task: int = 50):
+        """Start worker threads that parse, embed and persist queued documents"""
+        self.document_loader = document_loader
+        self.vector_store = vector_store
+        self.max_finished = max_finished
+        self.parse_workers = parse_workers
+        self.pages_per_task = pages_per_task
+        self._queue: "queue.Queue[Union[IngestionJob, BatchIngestionJob]]" = queue.Queue(maxsize=max_queued)
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, filename: str, file_path: str) -> IngestionJob:
+        """Queue a saved file for ingestion; raises QueueFullError when the queue is full"""
+        job = IngestionJob(filename, file_path)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError("Ingestion queue is full, please retry later")
+        with self._jobs_lock:
+            self._jobs[job.doc_id] = job
+            self._prune()
+        return job
+
+    def submit_batch(self, files: List[Tuple[str, str]]) -> BatchIngestionJob:
+        """Queue (filename, file_path) pairs to be parsed in parallel as one batch"""
+        batch = BatchIngestionJob([IngestionJob(filename, file_path) for filename, file_path in files])
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            raise QueueFullError("Ingestion queue is full, please retry later")
+        with self._jobs_lock:
+            self._jobs[batch.doc_id] = batch
+            for child in batch.children:
+                self._jobs[child.doc_id] = child
+            self._prune()
+        return batch
+
+    def get(self, doc_id: str) -> Optional[IngestionJob]:
+        """Look up a job by doc_id"""
+        with self._jobs_lock:
+            return self._jobs.get(doc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and job counts by status"""
+        with self._jobs_lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {'queued': self._queue.qsize(), 'workers': len(self._workers), 'jobs': counts}
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_finished"""
+        finished = [doc_id for doc_id, job in self._jobs.items() if job.status in ('done', 'error')]
+        for doc_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[doc_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if isinstance(job, BatchIngestionJob):
+                    self._run_batch(job)
+                else:
+                    self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: IngestionJob):
+        """Parse, embed and persist one document, recording progress on the job"""
+        job.status = 'processing'
+        job.started_at = time.time()
+        try:
+            # Chunks stream from the loader into the store, so embedding starts
+            # while later pages are still being parsed. File trùng tên được cập nhật
+            # theo chunk: chỉ embed chunk mới, xóa chunk không còn tồn tại
+            documents = self.document_loader.iter_document(job.file_path, progress_callback=job.update)
+            self._upsert(job, documents)
+            print(f"Ingested {job.filename}: {job.result}")
+        except Exception as e:
+            job.status = 'error'
+            job.error = str(e)
+            print(f"Error ingesting {job.filename}: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+
+    def _upsert(self, job: IngestionJob, documents):
+        """Incrementally write a file's chunks and record added/removed/unchanged counts"""
+        result = self.vector_store.upsert_document(job.filename, documents, progress_callback=job.update)
+        if result is None:
+            raise RuntimeError("Failed to add documents to vector store")
+        if result['added'] + result['unchanged'] == 0:
+            raise ValueError("Failed to process document - no content extracted")
+        job.result = result
+        job.stage = 'done'
+        job.status = 'done'
+
+    def _run_batch(self, batch: BatchIngestionJob):
+        """Parse the batch in a process pool and stream each file into the vector store"""
+        batch.status = 'processing'
+        batch.started_at = time.time()
+        jobs_by_path = {child.file_path: child for child in batch.children}
+        for child in batch.children:
+            child.status = 'processing'
+            child.stage = 'parsing'
+            child.started_at = batch.started_at
+        try:
+            results = self.document_loader.load_many(
+                list(jobs_by_path),
+                max_workers=self.parse_workers,
+                pages_per_task=self.pages_per_task
+            )
+            # load_many only parses ahead by a bounded number of tasks, so slow
+            # embedding here throttles parsing
+            for file_path, documents, error in results:
+                job = jobs_by_path[file_path]
+                try:
+                    if error:
+                        raise ValueError(error)
+                    if not documents:
+                        raise ValueError("Failed to process document - no content extracted")
+                    job.update('parsed', 1, 1)
+                    self._upsert(job, documents)
+                except Exception as e:
+                    job.status = 'error'
+                    job.error = str(e)
+                    print(f"Error ingesting {job.filename}: {str(e)}")
+                finally:
+                    job.finished_at = time.time()
+            batch.status = 'done'
+        except Exception as e:
+            batch.status = 'error'
+            batch.error = str(e)
+            for child in batch.children:
+                if child.status == 'processing':
+                    child.status = 'error'
+                    child.error = str(e)
+            print(f"Error ingesting batch {batch.doc_id}: {str(e)}")
+        finally:
+            batch.finished_at = time.time()
@@ -0,0 +1,183 @@
+"""
+Keyword Index Module
+Persistent inverted index (term -> chunk ids) with BM25 scoring for keyword retrieval
+(chunk statistics are stored in SQLite, one row per chunk, so saves only write what changed)
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+TOKEN_PATTERN = re.compile(r'\w{2,}')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens (unicode aware, so Vietnamese works)"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """Inverted index over chunk texts with BM25 statistics"""
+
+    def __init__(self, index_path: str, k1: float = 1.5, b: float = 0.75):
+        """Open the index database and build postings in memory; a legacy keyword_index.json is imported once"""
+        self.index_path = index_path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+
+        # chunk_id -> {'source': str, 'len': int, 'tf': {term: count}}
+        self.docs: Dict[str, Dict] = {}
+        # term -> {chunk_id: term frequency}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self._dirty = set()  # chunk ids added or removed since the last save
+
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " chunk_id TEXT PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " len INTEGER NOT NULL,"
+            " tf TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, chunks: Iterable[Tuple[str, str, str]], persist: bool = True):
+        """Index (chunk_id, text, source) tuples; re-adding an id replaces it"""
+        with self._lock:
+            for chunk_id, text, source in chunks:
+                if chunk_id in self.docs:
+                    self._remove_one(chunk_id)
+                tf: Dict[str, int] = {}
+                tokens = tokenize(text)
+                for token in tokens:
+                    tf[token] = tf.get(token, 0) + 1
+                self.docs[chunk_id] = {'source': source, 'len': len(tokens), 'tf': tf}
+                self._add_postings(chunk_id, tf)
+                self.total_length += len(tokens)
+                self._dirty.add(chunk_id)
+            if persist:
+                self.save()
+
+    def remove(self, chunk_ids: Iterable[str], persist: bool = True):
+        """Remove chunks from the index"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self.docs:
+                    self._remove_one(chunk_id)
+                    self._dirty.add(chunk_id)
+            if persist:
+                self.save()
+
+    def clear(self):
+        """Remove everything from the index (in memory and on disk)"""
+        with self._lock:
+            self.docs.clear()
+            self.postings.clear()
+            self.total_length = 0
+            self._dirty.clear()
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM chunks")
+            except Exception as e:
+                print(f"Error clearing keyword index: {str(e)}")
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Return the top-k (chunk_id, bm25_score) pairs for a query"""
+        with self._lock:
+            n_docs = len(self.docs)
+            if n_docs == 0:
+                return []
+            avgdl = self.total_length / n_docs if self.total_length else 1.0
+            k1, b = self.k1, self.b
+            norm = k1 * (1 - b)
+            scale = k1 * b / avgdl
+            docs = self.docs
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, freq in postings.items():
+                    denom = freq + norm + scale * docs[chunk_id]['len']
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (k1 + 1) / denom
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self):
+        """Write the chunks added or removed since the last save (one transaction)"""
+        try:
+            with self._lock, self._conn:
+                for chunk_id in self._dirty:
+                    entry = self.docs.get(chunk_id)
+                    if entry is None:
+                        self._conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (chunk_id,))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO chunks (chunk_id, source, len, tf) VALUES (?, ?, ?, ?)",
+                            (chunk_id, entry['source'], entry['len'], json.dumps(entry['tf'], ensure_ascii=False))
+                        )
+                self._dirty.clear()
+        except Exception as e:
+            print(f"Error saving keyword index: {str(e)}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _load(self):
+        """Load persisted chunk statistics and rebuild postings"""
+        try:
+            for chunk_id, source, length, tf in self._conn.execute("SELECT chunk_id, source, len, tf FROM chunks"):
+                self.docs[chunk_id] = {'source': source, 'len': length, 'tf': json.loads(tf)}
+            legacy_path = os.path.splitext(self.index_path)[0] + '.json'
+            if not self.docs and legacy_path != self.index_path and os.path.exists(legacy_path):
+                self._import_json(legacy_path)
+            for chunk_id, entry in self.docs.items():
+                self._add_postings(chunk_id, entry['tf'])
+                self.total_length += entry['len']
+            if self.docs:
+                print(f"Loaded keyword index with {len(self.docs)} chunks")
+        except Exception as e:
+            print(f"Error loading keyword index: {str(e)}")
+            self.docs = {}
+            self.postings = {}
+            self.total_length = 0
+
+    def _import_json(self, json_path: str):
+        """Import the index of older stores (a single JSON file) into the database"""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            self.docs = json.load(f).get('docs', {})
+        self._dirty.update(self.docs)
+        self.save()
+        if not self._dirty:
+            os.remove(json_path)
+            print(f"Imported keyword index for {len(self.docs)} chunks from {json_path}")
+
+    def _add_postings(self, chunk_id: str, tf: Dict[str, int]):
+        for term, freq in tf.items():
+            self.postings.setdefault(term, {})[chunk_id] = freq
+
+    def _remove_one(self, chunk_id: str):
+        entry = self.docs.pop(chunk_id)
+        for term in entry['tf']:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= entry['len']
@@ -0,0 +1,66 @@
+"""
+Lazy Component Module
+Thread-safe lazily constructed singletons and background preloading for fast startup
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class LazyComponent:
+    """Proxy that builds its instance on first attribute access (once, under a lock)"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self.load_error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def is_ready(self) -> bool:
+        """True once the instance has been built (never blocks)"""
+        return self._instance is not None
+
+    def resolve(self) -> Any:
+        """Return the instance, building it if needed; concurrent callers wait for one build"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                    self.load_error = None
+                except Exception as e:
+                    self.load_error = str(e)
+                    raise
+                finally:
+                    self.load_seconds = round(time.perf_counter() - start, 3)
+                print(f"Loaded {self.name} in {self.load_seconds}s")
+            return self._instance
+
+    def describe(self) -> Dict[str, Any]:
+        """Readiness of the component for /readyz"""
+        return {'ready': self.is_ready, 'load_seconds': self.load_seconds, 'error': self.load_error}
+
+    def __getattr__(self, attr: str) -> Any:
+        # Only called for attributes not defined on the proxy itself
+        return getattr(self.resolve(), attr)
+
+
+def preload(components: List[LazyComponent]) -> threading.Thread:
+    """Build components one after another in a background thread"""
+    def run():
+        for component in components:
+            try:
+                component.resolve()
+            except Exception as e:
+                print(f"Error preloading {component.name}: {str(e)}")
+
+    thread = threading.Thread(target=run, name="component-preload", daemon=True)
+    thread.start()
+    return thread
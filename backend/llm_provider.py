@@ -4,136 +4,415 @@ Handles different LLM providers including Google Gemini and Local models via LM
 """
 
 import os
+import json
+import contextvars
 import requests
-import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional
 from langchain.schema import Document
+from backend.http_client import local_llm_client, local_llm_async_client
+from backend.gemini_registry import GeminiModelRegistry
+from backend.admission import AdmissionController, OverloadedError, INTERACTIVE, BACKGROUND
+from backend.context_packer import ContextPacker
+from config import Config
 from dotenv import load_dotenv
 import re
 
 load_dotenv()
 
+SYSTEM_PROMPT = "Bạn là một trợ lý AI hữu ích, trả lời bằng tiếng Việt."
+
+BOLD_LABEL_PATTERN = re.compile(r'\*\*(.+?):\*\*')
+BULLET_PATTERN = re.compile(r'^\s*[-\*]\s+')
+NUMBERED_PATTERN = re.compile(r'^\s*\d+\.\s+')
+
+
+class LLMProviderError(Exception):
+    """Raised when an LLM backend returns an unusable response"""
+
+
+class StreamingHTMLFormatter:
+    """Incremental markdown-like -> HTML formatter for chatbot output.
+    
+    Text is fed in arbitrary pieces; only complete lines are committed, because
+    list structure depends on whole lines. pending() renders the unfinished
+    line tentatively so the UI can show tokens as soon as they arrive.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._list_tag: Optional[str] = None  # 'ul', 'ol' or None
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        """Add text and return the HTML for any newly completed lines"""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        html = []
+        for line in lines:
+            html_lines, self._list_tag = self._format_line(line, self._list_tag)
+            html.append(self._join(html_lines))
+        return ''.join(html)
+
+    def pending(self) -> str:
+        """Tentative HTML for the current (incomplete) line; does not change state"""
+        if not self._buffer:
+            return ''
+        html_lines, list_tag = self._format_line(self._buffer, self._list_tag)
+        if list_tag:
+            html_lines.append(f'</{list_tag}>')
+        return ('<br>' if self._started else '') + '<br>'.join(html_lines)
+
+    def flush(self) -> str:
+        """Format the last line and close any open list"""
+        html_lines, self._list_tag = self._format_line(self._buffer, self._list_tag)
+        self._buffer = ""
+        if self._list_tag:
+            html_lines.append(f'</{self._list_tag}>')
+            self._list_tag = None
+        return self._join(html_lines)
+
+    def _join(self, html_lines: List[str]) -> str:
+        """Join html lines with <br>, continuing from what was already emitted"""
+        if not html_lines:
+            return ''
+        html = ('<br>' if self._started else '') + '<br>'.join(html_lines)
+        self._started = True
+        return html
+
+    @staticmethod
+    def _format_line(line: str, list_tag: Optional[str]):
+        """Format one line given the current list state; returns (html_lines, new_list_tag)"""
+        # Đổi **Tiêu đề:** thành <b>Tiêu đề:</b>
+        line = BOLD_LABEL_PATTERN.sub(r'<b>\1:</b>', line)
+        html_lines = []
+        # Đổi các dòng bắt đầu bằng - hoặc * thành <ul><li>...</li></ul>,
+        # số thứ tự 1. 2. ... thành <ol><li>...</li></ol>
+        if BULLET_PATTERN.match(line):
+            tag, item = 'ul', BULLET_PATTERN.sub('', line)
+        elif NUMBERED_PATTERN.match(line):
+            tag, item = 'ol', NUMBERED_PATTERN.sub('', line)
+        else:
+            tag, item = None, line
+        if list_tag and list_tag != tag:
+            html_lines.append(f'</{list_tag}>')
+        if tag:
+            if list_tag != tag:
+                html_lines.append(f'<{tag}>')
+            html_lines.append('<li>' + item + '</li>')
+        else:
+            html_lines.append(item)
+        return html_lines, tag
+
+
 class LLMProvider:
     """Manages different LLM providers for the RAG chatbot"""
     
     def __init__(self):
         """Initialize LLM providers"""
         # Google Gemini configuration
+        # google.generativeai is imported on first Gemini use (slow import, not needed for local-only setups)
         self.gemini_api_key = os.getenv('GOOGLE_API_KEY')
-        if self.gemini_api_key:
-            genai.configure(api_key=self.gemini_api_key)
-            self.gemini_model = genai.GenerativeModel('gemini-pro')
+        # Configured once; model handles and the model list are cached
+        self.gemini = GeminiModelRegistry(self.gemini_api_key, list_ttl=Config.GEMINI_MODELS_TTL)
         
         # Local LLM configuration (LM Studio)
         self.local_endpoint = os.getenv('LOCAL_LLM_ENDPOINT', 'http://localhost:1234/v1/chat/completions')
         self.local_model = os.getenv('LOCAL_MODEL_NAME', 'phi-2')
+        # Pooled keep-alive session with timeouts and retries, shared with the status routes
+        self.http = local_llm_client()
+        # Token-budgeted context assembly; stats of the last prompt are kept per thread / asyncio task (= per request)
+        self.context_packer = ContextPacker(
+            token_budget=Config.CONTEXT_TOKEN_BUDGET,
+            chars_per_token=Config.CHARS_PER_TOKEN,
+            default_window=Config.LOCAL_CONTEXT_WINDOW,
+            reserve_tokens=Config.MAX_TOKENS
+        )
+        self._context_stats = contextvars.ContextVar('context_stats', default=None)
+        # Per-provider concurrency limit + priority wait queue; excess requests fail fast with OverloadedError
+        self.admission = {
+            'local': AdmissionController('local', Config.LOCAL_LLM_MAX_CONCURRENCY, Config.LOCAL_LLM_QUEUE_SIZE, Config.LLM_QUEUE_TIMEOUT),
+            'gemini': AdmissionController('gemini', Config.GEMINI_MAX_CONCURRENCY, Config.GEMINI_QUEUE_SIZE, Config.LLM_QUEUE_TIMEOUT)
+        }
     
-    def _format_html(self, text: str) -> str:
+    def format_html(self, text: str) -> str:
         """Format markdown-like text to HTML for chatbot output"""
-        # Đổi **Tiêu đề:** thành <b>Tiêu đề:</b>
-        text = re.sub(r'\*\*(.+?):\*\*', r'<b>\1:</b>', text)
-        # Đổi các dòng bắt đầu bằng - hoặc * thành <ul><li>...</li></ul>
-        lines = text.split('\n')
-        in_list = False
-        html_lines = []
-        for line in lines:
-            if re.match(r'^\s*[-\*]\s+', line):
-                if not in_list:
-                    html_lines.append('<ul>')
-                    in_list = True
-                html_lines.append('<li>' + re.sub(r'^\s*[-\*]\s+', '', line) + '</li>')
-            else:
-                if in_list:
-                    html_lines.append('</ul>')
-                    in_list = False
-                # Đổi số thứ tự 1. 2. ... thành <ol>
-                m = re.match(r'^\s*\d+\.\s+', line)
-                if m:
-                    if not html_lines or not html_lines[-1].endswith('<ol>'):
-                        html_lines.append('<ol>')
-                    html_lines.append('<li>' + re.sub(r'^\s*\d+\.\s+', '', line) + '</li>')
-                else:
-                    if html_lines and html_lines[-1] == '<ol>':
-                        html_lines.append('</ol>')
-                    html_lines.append(line)
-        if in_list:
-            html_lines.append('</ul>')
-        if html_lines and html_lines[-1] == '<ol>':
-            html_lines.append('</ol>')
-        # Đổi \n thành <br> cho các đoạn còn lại
-        html = '\n'.join(html_lines)
-        html = html.replace('\n', '<br>')
-        return html
+        formatter = StreamingHTMLFormatter()
+        return formatter.feed(text) + formatter.flush()
+
+    def build_prompt(self, user_message: str, relevant_docs: List[Document], chat_history=None, model_name=None) -> str:
+        """Build the RAG prompt (history + document context + question), default to Vietnamese"""
+        # Format history: chỉ truyền câu hỏi của user
+        history_str = ""
+        if chat_history:
+            for turn in chat_history:
+                history_str += f"Người dùng: {turn['user']}\n---\n"
+        head = f"""Bạn là một trợ lý AI hữu ích, trả lời bằng tiếng Việt.\n\nDưới đây là lịch sử hội thoại gần nhất giữa bạn và người dùng (nếu có), tiếp theo là ngữ cảnh tài liệu.\n\nLưu ý: KHÔNG lặp lại nội dung trả lời trước, chỉ trả lời cho câu hỏi hiện tại. Nếu thông tin nằm rải rác ở nhiều đoạn, hãy tổng hợp lại. Nếu có thể, hãy trình bày dạng danh sách rõ ràng, dễ đọc.\n\nLịch sử hội thoại (chỉ dùng để tham khảo, KHÔNG lặp lại nội dung trả lời trước):\n{history_str}\n==============================\nNgữ cảnh tài liệu:\n"""
+        tail = f"""\n==============================\nCâu hỏi của người dùng: {user_message}\n\nTrả lời:"""
+        # The context gets whatever the model window leaves after the rest of the prompt
+        context = self._prepare_context(relevant_docs, model_name, fixed_text=head + tail)
+        return head + context + tail
+
+    def _gemini_model(self, model_name: str):
+        """Get a cached Gemini model handle"""
+        return self.gemini.model(model_name)
+
+    @property
+    def gemini_model(self):
+        """Default Gemini model handle"""
+        return self._gemini_model('gemini-pro')
+
+    def admission_for(self, model_type: str) -> AdmissionController:
+        """Admission controller of the provider serving model_type ('local' or 'gemini')"""
+        return self.admission['local' if model_type == 'local' else 'gemini']
+
+    def admission_stats(self) -> Dict[str, Any]:
+        return {name: controller.stats() for name, controller in self.admission.items()}
+
+    def _gemini_complete(self, prompt: str, model_name: str, priority: int = INTERACTIVE) -> str:
+        """Run a blocking Gemini completion and return the raw text (raises on failure)"""
+        with self.admission['gemini'].slot(priority):
+            response = self._gemini_model(model_name).generate_content(prompt)
+            return response.text
+
+    def _gemini_stream(self, prompt: str, model_name: str, priority: int = INTERACTIVE) -> Iterator[str]:
+        """Yield raw text deltas from Gemini with stream=True (raises on failure)"""
+        with self.admission['gemini'].slot(priority):
+            response = self._gemini_model(model_name).generate_content(prompt, stream=True)
+            for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    def _local_payload(self, prompt: str, model_name=None, stream: bool = False) -> Dict[str, Any]:
+        """Build an OpenAI-compatible chat completion payload for LM Studio"""
+        payload = {
+            "model": model_name if model_name else self.local_model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": Config.TEMPERATURE,
+            "max_tokens": Config.MAX_TOKENS
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _local_complete(self, prompt: str, model_name=None, priority: int = INTERACTIVE) -> str:
+        """Run a blocking LM Studio completion and return the raw text (raises on failure)"""
+        with self.admission['local'].slot(priority):
+            response = self.http.post(
+                self.local_endpoint,
+                json=self._local_payload(prompt, model_name),
+                headers={"Content-Type": "application/json"}
+            )
+        if response.status_code != 200:
+            raise LLMProviderError(f"Local LLM server returned status {response.status_code}")
+        result = response.json()
+        return result['choices'][0]['message']['content']
+
+    def _local_stream(self, prompt: str, model_name=None, priority: int = INTERACTIVE) -> Iterator[str]:
+        """Yield raw text deltas from LM Studio using OpenAI-style SSE streaming (raises on failure)"""
+        with self.admission['local'].slot(priority), self.http.post(
+            self.local_endpoint,
+            json=self._local_payload(prompt, model_name, stream=True),
+            headers={"Content-Type": "application/json"},
+            stream=True
+        ) as response:
+            if response.status_code != 200:
+                raise LLMProviderError(f"Local LLM server returned status {response.status_code}")
+            # SSE is UTF-8; requests would otherwise assume ISO-8859-1 for text/event-stream
+            response.encoding = 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+
+    async def _gemini_complete_async(self, prompt: str, model_name: str, priority: int = INTERACTIVE) -> str:
+        """Async _gemini_complete (generate_content_async)"""
+        async with self.admission['gemini'].aslot(priority):
+            response = await self._gemini_model(model_name).generate_content_async(prompt)
+            return response.text
+
+    async def _gemini_stream_async(self, prompt: str, model_name: str, priority: int = INTERACTIVE) -> AsyncIterator[str]:
+        """Async _gemini_stream"""
+        async with self.admission['gemini'].aslot(priority):
+            response = await self._gemini_model(model_name).generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+
+    async def _local_complete_async(self, prompt: str, model_name=None, priority: int = INTERACTIVE) -> str:
+        """Async _local_complete over the pooled httpx client"""
+        async with self.admission['local'].aslot(priority):
+            response = await local_llm_async_client().post(
+                self.local_endpoint,
+                json=self._local_payload(prompt, model_name),
+                headers={"Content-Type": "application/json"}
+            )
+        if response.status_code != 200:
+            raise LLMProviderError(f"Local LLM server returned status {response.status_code}")
+        result = response.json()
+        return result['choices'][0]['message']['content']
+
+    async def _local_stream_async(self, prompt: str, model_name=None, priority: int = INTERACTIVE) -> AsyncIterator[str]:
+        """Async _local_stream (OpenAI-style SSE)"""
+        async with self.admission['local'].aslot(priority):
+            response = await local_llm_async_client().post(
+                self.local_endpoint,
+                json=self._local_payload(prompt, model_name, stream=True),
+                headers={"Content-Type": "application/json"},
+                stream=True
+            )
+            try:
+                if response.status_code != 200:
+                    raise LLMProviderError(f"Local LLM server returned status {response.status_code}")
+                async for line in response.aiter_lines():
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+            finally:
+                await response.aclose()
+
+    def complete(self, provider: str, prompt: str, model_name=None, priority: int = INTERACTIVE) -> str:
+        """Raw completion text from one provider ('local' or 'gemini'); raises on failure"""
+        if provider == 'local':
+            return self._local_complete(prompt, model_name, priority)
+        return self._gemini_complete(prompt, model_name or 'gemini-pro', priority)
+
+    def stream(self, provider: str, prompt: str, model_name=None, priority: int = INTERACTIVE) -> Iterator[str]:
+        """Raw text deltas from one provider; raises on failure"""
+        if provider == 'local':
+            return self._local_stream(prompt, model_name, priority)
+        return self._gemini_stream(prompt, model_name or 'gemini-pro', priority)
+
+    async def acomplete(self, provider: str, prompt: str, model_name=None, priority: int = INTERACTIVE) -> str:
+        """Async complete"""
+        if provider == 'local':
+            return await self._local_complete_async(prompt, model_name, priority)
+        return await self._gemini_complete_async(prompt, model_name or 'gemini-pro', priority)
+
+    def astream(self, provider: str, prompt: str, model_name=None, priority: int = INTERACTIVE) -> AsyncIterator[str]:
+        """Async stream"""
+        if provider == 'local':
+            return self._local_stream_async(prompt, model_name, priority)
+        return self._gemini_stream_async(prompt, model_name or 'gemini-pro', priority)
 
     def generate_gemini_response(self, user_message: str, relevant_docs: List[Document], model_name: str = 'gemini-pro', chat_history=None) -> str:
         """Generate response using Google Gemini, with selectable model_name, default to Vietnamese"""
         try:
             if not self.gemini_api_key:
                 return "Error: Google API key not configured"
-            genai.configure(api_key=self.gemini_api_key)
-            gemini_model = genai.GenerativeModel(model_name)
-            context = self._prepare_context(relevant_docs)
-            # Format history: chỉ truyền câu hỏi của user
-            history_str = ""
-            if chat_history:
-                for turn in chat_history:
-                    history_str += f"Người dùng: {turn['user']}\n---\n"
-            prompt = f"""Bạn là một trợ lý AI hữu ích, trả lời bằng tiếng Việt.\n\nDưới đây là lịch sử hội thoại gần nhất giữa bạn và người dùng (nếu có), tiếp theo là ngữ cảnh tài liệu.\n\nLưu ý: KHÔNG lặp lại nội dung trả lời trước, chỉ trả lời cho câu hỏi hiện tại. Nếu thông tin nằm rải rác ở nhiều đoạn, hãy tổng hợp lại. Nếu có thể, hãy trình bày dạng danh sách rõ ràng, dễ đọc.\n\nLịch sử hội thoại (chỉ dùng để tham khảo, KHÔNG lặp lại nội dung trả lời trước):\n{history_str}\n==============================\nNgữ cảnh tài liệu:\n{context}\n==============================\nCâu hỏi của người dùng: {user_message}\n\nTrả lời:"""
+            prompt = self.build_prompt(user_message, relevant_docs, chat_history, model_name)
             print("\n===== PROMPT GỬI ĐẾN GEMINI =====\n" + prompt + "\n===============================\n")
-            response = gemini_model.generate_content(prompt)
-            return self._format_html(response.text)
+            return self.format_html(self._gemini_complete(prompt, model_name))
+        except OverloadedError:
+            # Surfaced as HTTP 503 + Retry-After by the routes
+            raise
         except Exception as e:
             return f"Error generating Gemini response: {str(e)}"
     
     def generate_local_response(self, user_message: str, relevant_docs: List[Document], chat_history=None, model_name=None) -> str:
         """Generate response using local LLM via LM Studio, default to Vietnamese"""
         try:
-            context = self._prepare_context(relevant_docs)
-            # Format history: chỉ truyền câu hỏi của user
-            history_str = ""
-            if chat_history:
-                for turn in chat_history:
-                    history_str += f"Người dùng: {turn['user']}\n---\n"
-            prompt = f"""Bạn là một trợ lý AI hữu ích, trả lời bằng tiếng Việt.\n\nDưới đây là lịch sử hội thoại gần nhất giữa bạn và người dùng (nếu có), tiếp theo là ngữ cảnh tài liệu.\n\nLưu ý: KHÔNG lặp lại nội dung trả lời trước, chỉ trả lời cho câu hỏi hiện tại. Nếu thông tin nằm rải rác ở nhiều đoạn, hãy tổng hợp lại. Nếu có thể, hãy trình bày dạng danh sách rõ ràng, dễ đọc.\n\nLịch sử hội thoại (chỉ dùng để tham khảo, KHÔNG lặp lại nội dung trả lời trước):\n{history_str}\n==============================\nNgữ cảnh tài liệu:\n{context}\n==============================\nCâu hỏi của người dùng: {user_message}\n\nTrả lời:"""
+            prompt = self.build_prompt(user_message, relevant_docs, chat_history, model_name or self.local_model)
             print("\n===== PROMPT GỬI ĐẾN LOCAL LLM =====\n" + prompt + "\n===============================\n")
-            model_to_use = model_name if model_name else self.local_model
-            payload = {
-                "model": model_to_use,
-                "messages": [
-                    {"role": "system", "content": "Bạn là một trợ lý AI hữu ích, trả lời bằng tiếng Việt."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000
-            }
-            response = requests.post(
-                self.local_endpoint,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
-            if response.status_code == 200:
-                result = response.json()
-                return self._format_html(result['choices'][0]['message']['content'])
-            else:
-                return f"Error: Local LLM server returned status {response.status_code}"
+            return self.format_html(self._local_complete(prompt, model_name))
+        except OverloadedError:
+            # Surfaced as HTTP 503 + Retry-After by the routes
+            raise
         except requests.exceptions.ConnectionError:
             return "Error: Cannot connect to local LLM server. Please ensure LM Studio is running."
         except Exception as e:
             return f"Error generating local response: {str(e)}"
+
+    def stream_gemini_response(self, user_message: str, relevant_docs: List[Document], model_name: str = 'gemini-pro', chat_history=None) -> Iterator[Dict[str, str]]:
+        """Streaming variant of generate_gemini_response.
+        
+        Yields {'html': committed_html_delta, 'pending': tentative_html_for_current_line};
+        concatenating every 'html' gives the same output as generate_gemini_response.
+        The final event carries 'error': True when generation failed.
+        """
+        if not self.gemini_api_key:
+            yield {'html': "Error: Google API key not configured", 'pending': '', 'error': True}
+            return
+        prompt = self.build_prompt(user_message, relevant_docs, chat_history, model_name)
+        print("\n===== PROMPT GỬI ĐẾN GEMINI (STREAM) =====\n" + prompt + "\n===============================\n")
+        yield from self.format_stream(
+            lambda: self._gemini_stream(prompt, model_name),
+            "Error generating Gemini response: {}"
+        )
+
+    def stream_local_response(self, user_message: str, relevant_docs: List[Document], chat_history=None, model_name=None) -> Iterator[Dict[str, str]]:
+        """Streaming variant of generate_local_response (same event format as stream_gemini_response)"""
+        prompt = self.build_prompt(user_message, relevant_docs, chat_history, model_name or self.local_model)
+        print("\n===== PROMPT GỬI ĐẾN LOCAL LLM (STREAM) =====\n" + prompt + "\n===============================\n")
+        yield from self.format_stream(
+            lambda: self._local_stream(prompt, model_name),
+            "Error generating local response: {}"
+        )
+
+    async def aformat_stream(self, stream: AsyncIterator[str], error_template: str) -> AsyncIterator[Dict[str, str]]:
+        """Async format_stream"""
+        formatter = StreamingHTMLFormatter()
+        try:
+            async for delta in stream:
+                html = formatter.feed(delta)
+                yield {'html': html, 'pending': formatter.pending()}
+            yield {'html': formatter.flush(), 'pending': ''}
+        except OverloadedError as e:
+            yield {'html': formatter.flush() + f"Error: {str(e)}", 'pending': '', 'error': True, 'retry_after': e.retry_after}
+        except Exception as e:
+            if self.is_connect_error(e):
+                yield {'html': formatter.flush() + "Error: Cannot connect to local LLM server. Please ensure LM Studio is running.", 'pending': '', 'error': True}
+            else:
+                yield {'html': formatter.flush() + error_template.format(str(e)), 'pending': '', 'error': True}
+
+    @staticmethod
+    def is_connect_error(error: Exception) -> bool:
+        """requests or httpx connection failure"""
+        return isinstance(error, requests.exceptions.ConnectionError) or type(error).__name__ == 'ConnectError'
+
+    def format_stream(self, open_stream, error_template: str) -> Iterator[Dict[str, str]]:
+        """Run a raw token stream through the incremental HTML formatter"""
+        formatter = StreamingHTMLFormatter()
+        try:
+            for delta in open_stream():
+                html = formatter.feed(delta)
+                yield {'html': html, 'pending': formatter.pending()}
+            yield {'html': formatter.flush(), 'pending': ''}
+        except OverloadedError as e:
+            # Headers are already sent: report the shed request in-band
+            yield {'html': formatter.flush() + f"Error: {str(e)}", 'pending': '', 'error': True, 'retry_after': e.retry_after}
+        except requests.exceptions.ConnectionError:
+            yield {'html': formatter.flush() + "Error: Cannot connect to local LLM server. Please ensure LM Studio is running.", 'pending': '', 'error': True}
+        except Exception as e:
+            yield {'html': formatter.flush() + error_template.format(str(e)), 'pending': '', 'error': True}
     
-    def _prepare_context(self, relevant_docs: List[Document]) -> str:
-        """Prepare context string from relevant documents"""
-        if not relevant_docs:
-            return "No relevant documents found."
-        context_parts = []
-        for i, doc in enumerate(relevant_docs, 1):
-            source = doc.metadata.get('source', 'Unknown')
-            content = doc.page_content
-            if len(content) > 2000:
-                content = content[:2000] + "..."
-            context_parts.append(f"Document {i} (Source: {source}):\n{content}\n")
-        return "\n".join(context_parts)
+    def _prepare_context(self, relevant_docs: List[Document], model_name=None, fixed_text: str = '') -> str:
+        """Prepare context string from relevant documents within the model's token budget"""
+        context, stats = self.context_packer.pack(relevant_docs, model_name, fixed_text)
+        self._context_stats.set(stats)
+        print(f"Context: {stats['tokens_used']}/{stats['token_budget']} tokens, "
+              f"{stats['segments_used']}/{stats['segments']} segments from {stats['chunks_retrieved']} chunks")
+        return context
+
+    def context_stats(self) -> Optional[Dict[str, Any]]:
+        """Token usage of the last prompt built in this thread or task (i.e. for the current request)"""
+        return self._context_stats.get()
+
+    def set_context_stats(self, stats: Optional[Dict[str, Any]]):
+        """Report stats of a prompt other than the last one built (the router may build one per provider)"""
+        self._context_stats.set(stats)
     
     def test_connection(self, model_type: str = 'gemini') -> Dict[str, Any]:
         """Test connection to LLM providers"""
@@ -142,7 +421,9 @@ class LLMProvider:
                 if not self.gemini_api_key:
                     return {'success': False, 'error': 'Google API key not configured'}
                 
-                response = self.gemini_model.generate_content("Hello, this is a test.")
+                # Probes queue behind interactive chat
+                with self.admission['gemini'].slot(BACKGROUND):
+                    response = self.gemini_model.generate_content("Hello, this is a test.")
                 return {'success': True, 'response': response.text}
             
             elif model_type == 'local':
@@ -154,12 +435,13 @@ class LLMProvider:
                     "max_tokens": 50
                 }
                 
-                response = requests.post(
-                    self.local_endpoint,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=10
-                )
+                with self.admission['local'].slot(BACKGROUND):
+                    response = self.http.post(
+                        self.local_endpoint,
+                        json=payload,
+                        headers={"Content-Type": "application/json"},
+                        retries=0
+                    )
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -0,0 +1,553 @@
+"""
+LLM Router Module
+Routes generations across Gemini and the local LLM: per-provider latency EWMA and circuit breaker,
+automatic fallback to the other provider, and optional hedging when the first provider is slow
+"""
+
+import time
+import queue
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional
+from langchain.schema import Document
+
+from backend.admission import OverloadedError
+from backend.llm_provider import LLMProvider
+
+ERROR_TEMPLATES = {
+    'gemini': "Error generating Gemini response: {}",
+    'local': "Error generating local response: {}"
+}
+
+
+def requested_provider(model_type: str) -> str:
+    """Provider asked for by the chat request's model_type"""
+    return 'local' if model_type == 'local' else 'gemini'
+
+
+class LatencyTracker:
+    """EWMA and p95 of recent latencies (seconds)"""
+
+    def __init__(self, alpha: float = 0.2, sample_size: int = 200):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self._samples = deque(maxlen=sample_size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.ewma = seconds if self.ewma is None else (1 - self.alpha) * self.ewma + self.alpha * seconds
+            self._samples.append(seconds)
+
+    def count(self) -> int:
+        return len(self._samples)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            'samples': self.count(),
+            'ewma_ms': round(self.ewma * 1000, 2) if self.ewma is not None else None,
+            'p95_ms': round(p95 * 1000, 2) if p95 is not None else None
+        }
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; while open, one trial call gets through every reset_seconds"""
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.trips = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self._opened_at >= self.reset_seconds else 'open'
+
+    def allow(self) -> bool:
+        """True if a call may be attempted (closed, or open long enough for a trial)"""
+        return self.state != 'open'
+
+    def on_attempt(self):
+        """A call is starting: while open it is the trial, and the next one waits another reset period"""
+        with self._lock:
+            if self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """Latency and failure tracking of one provider"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        # Whole completions and time to first streamed token are tracked separately
+        self.latency = {'complete': LatencyTracker(), 'first_token': LatencyTracker()}
+        self.requests = 0
+        self.failures = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def record_start(self):
+        self.breaker.on_attempt()
+        with self._lock:
+            self.requests += 1
+
+    def record_success(self, kind: Optional[str] = None, seconds: Optional[float] = None):
+        self.breaker.record_success()
+        if kind is not None:
+            self.latency[kind].observe(seconds)
+
+    def record_failure(self, error: Exception):
+        if isinstance(error, OverloadedError):
+            # Our own queue is full: the backend itself is not failing
+            with self._lock:
+                self.shed += 1
+            return
+        self.breaker.record_failure()
+        with self._lock:
+            self.failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'circuit_trips': self.breaker.trips,
+            'requests': self.requests,
+            'failures': self.failures,
+            'shed': self.shed,
+            'complete': self.latency['complete'].stats(),
+            'first_token': self.latency['first_token'].stats()
+        }
+
+
+class Route(NamedTuple):
+    provider: str  # 'gemini' or 'local'
+    model_name: Optional[str]
+
+
+class _Attempt:
+    """One provider call of a routed request"""
+
+    def __init__(self, route: Route, prompt: str, context_stats: Optional[Dict[str, Any]], hedge: bool):
+        self.route = route
+        self.prompt = prompt
+        self.context_stats = context_stats
+        self.hedge = hedge
+        self.started = time.perf_counter()
+        self.error: Optional[Exception] = None
+        self.cancelled = threading.Event()
+        self.task: Optional[asyncio.Future] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class LLMRouter:
+    """Sends each generation to the requested provider, falling back to (or hedging with) the other one.
+
+    Same return values and stream events as LLMProvider's generate_* / stream_* methods.
+    """
+
+    def __init__(self, provider: LLMProvider, fallback_to_local: bool = True, fallback_to_gemini: bool = False, hedging: bool = False,
+                 fallback_gemini_model: str = 'gemini-pro', hedge_initial_delay: float = 5.0,
+                 hedge_min_delay: float = 0.5, hedge_min_samples: int = 20,
+                 failure_threshold: int = 3, reset_seconds: float = 30):
+        self.provider = provider
+        # Per direction: local -> Gemini sends prompts built from local documents to the cloud, so it is opt-in
+        self.fallback_to = {'local': fallback_to_local, 'gemini': fallback_to_gemini}
+        self.hedging = hedging
+        self.fallback_gemini_model = fallback_gemini_model
+        self.hedge_initial_delay = hedge_initial_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.health = {name: ProviderHealth(name, failure_threshold, reset_seconds) for name in ('gemini', 'local')}
+        # Route of the last answer in this thread or asyncio task (= per request)
+        self._last_route = contextvars.ContextVar('last_route', default=None)
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def plan(self, model_type: str, model_name: Optional[str] = None) -> List[Route]:
+        """Providers to try in order: the requested one first, then the other if fallback in that direction is on;
+        providers with an open circuit are skipped"""
+        if requested_provider(model_type) == 'local':
+            routes = [Route('local', model_name), Route('gemini', self.fallback_gemini_model)]
+        else:
+            routes = [Route('gemini', model_name or 'gemini-pro'), Route('local', None)]
+        routes = routes[:1] + [route for route in routes[1:] if self.fallback_to[route.provider]]
+        routes = [route for route in routes if route.provider != 'gemini' or self.provider.gemini_api_key]
+        # Nothing available: trying the requested provider beats failing without a call
+        return [route for route in routes if self.health[route.provider].breaker.allow()] or routes[:1]
+
+    def check(self, model_type: str):
+        """Raise OverloadedError if every provider of the plan would shed a new request"""
+        plan = self.plan(model_type)
+        if plan and all(self.provider.admission_for(route.provider).saturated() for route in plan):
+            self.provider.admission_for(plan[0].provider).check()
+
+    def hedge_delay(self, provider: str, kind: str) -> float:
+        """Seconds to wait for the first provider before hedging: its p95 latency once enough samples exist"""
+        tracker = self.health[provider].latency[kind]
+        if tracker.count() < self.hedge_min_samples:
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, tracker.p95())
+
+    def last_route(self) -> Optional[Dict[str, Any]]:
+        """Provider that produced the last answer in this thread or task"""
+        return self._last_route.get()
+
+    def _start(self, route: Route, user_message: str, relevant_docs: List[Document], chat_history, hedge: bool) -> _Attempt:
+        """Build the prompt for route (context budget depends on the model) and count the attempt"""
+        model_name = route.model_name or (self.provider.local_model if route.provider == 'local' else None)
+        prompt = self.provider.build_prompt(user_message, relevant_docs, chat_history, model_name)
+        self.health[route.provider].record_start()
+        if hedge:
+            with self._lock:
+                self.hedges += 1
+        return _Attempt(route, prompt, self.provider.context_stats(), hedge)
+
+    def _hedge_timeout(self, first: _Attempt, kind: str, pending: List[Route]) -> Optional[float]:
+        """Time left before the next provider is hedged in (None: just wait)"""
+        if not (self.hedging and pending):
+            return None
+        return max(0.0, self.hedge_delay(first.route.provider, kind) - first.elapsed())
+
+    def _failed(self, attempt: _Attempt, error: Exception):
+        attempt.error = error
+        self.health[attempt.route.provider].record_failure(error)
+        print(f"LLM {attempt.route.provider} failed: {str(error)}")
+
+    def _won(self, winner: _Attempt, attempts: List[_Attempt], requested: str):
+        """Report the winner's prompt stats and route for this request"""
+        with self._lock:
+            if winner.route.provider != requested:
+                self.fallbacks += 1
+            if winner.hedge:
+                self.hedge_wins += 1
+        self.provider.set_context_stats(winner.context_stats)
+        self._last_route.set({
+            'provider': winner.route.provider,
+            'model': winner.route.model_name or (self.provider.local_model if winner.route.provider == 'local' else None),
+            'fallback': winner.route.provider != requested,
+            'hedged': len(attempts) > 1 and any(attempt.hedge for attempt in attempts)
+        })
+
+    def _final_error(self, attempts: List[_Attempt]) -> Exception:
+        """Error to report when every provider failed: the requested provider's, unless it was only shed"""
+        errors = [attempt.error for attempt in attempts if attempt.error is not None]
+        # Attempts are in plan order, so this prefers the requested provider
+        real = [error for error in errors if not isinstance(error, OverloadedError)]
+        return real[0] if real else errors[0]
+
+    def _error_text(self, provider: str, error: Exception) -> str:
+        """Same error strings as LLMProvider.generate_*_response"""
+        if self.provider.is_connect_error(error):
+            return "Error: Cannot connect to local LLM server. Please ensure LM Studio is running."
+        return ERROR_TEMPLATES[provider].format(str(error))
+
+    def complete(self, user_message: str, relevant_docs: List[Document], chat_history=None,
+                 model_type: str = 'gemini', model_name: Optional[str] = None) -> str:
+        """Routed generate_*_response; raises OverloadedError only when every provider shed the request"""
+        plan = self.plan(model_type, model_name)
+        if not plan:
+            return "Error: Google API key not configured"
+        attempts: List[_Attempt] = []
+        if not self.hedging:
+            # Nothing to race: call each provider in turn on the request thread
+            while plan:
+                attempt = self._start(plan.pop(0), user_message, relevant_docs, chat_history, False)
+                attempts.append(attempt)
+                text = self._call(attempt)
+                if attempt.error is None:
+                    self._won(attempt, attempts, requested_provider(model_type))
+                    return self.provider.format_html(text)
+            return self._give_up(attempts)
+        results = queue.Queue()
+
+        def launch(hedge: bool = False):
+            attempt = self._start(plan.pop(0), user_message, relevant_docs, chat_history, hedge)
+            attempts.append(attempt)
+            threading.Thread(target=self._run_complete, args=(attempt, results), name="llm-route", daemon=True).start()
+
+        launch()
+        running = 1
+        while running:
+            try:
+                attempt, text = results.get(timeout=self._hedge_timeout(attempts[0], 'complete', plan))
+            except queue.Empty:
+                launch(hedge=True)
+                running += 1
+                continue
+            running -= 1
+            if attempt.error is None:
+                # A slower loser keeps running in its thread; its result only feeds the latency stats
+                self._won(attempt, attempts, requested_provider(model_type))
+                return self.provider.format_html(text)
+            if plan:
+                launch()
+                running += 1
+        return self._give_up(attempts)
+
+    def _give_up(self, attempts: List[_Attempt]) -> str:
+        """Error answer once every provider failed (OverloadedError is raised instead)"""
+        error = self._final_error(attempts)
+        if isinstance(error, OverloadedError):
+            raise error
+        return self._error_text(attempts[0].route.provider, error)
+
+    def _call(self, attempt: _Attempt) -> Optional[str]:
+        """Blocking completion of one attempt; None when it failed"""
+        try:
+            text = self.provider.complete(attempt.route.provider, attempt.prompt, attempt.route.model_name)
+        except Exception as e:
+            self._failed(attempt, e)
+            return None
+        self.health[attempt.route.provider].record_success('complete', attempt.elapsed())
+        return text
+
+    def _run_complete(self, attempt: _Attempt, results: queue.Queue):
+        results.put((attempt, self._call(attempt)))
+
+    def stream(self, user_message: str, relevant_docs: List[Document], chat_history=None,
+               model_type: str = 'gemini', model_name: Optional[str] = None) -> Iterator[Dict[str, str]]:
+        """Routed stream_*_response; providers are switched only before the first token"""
+        plan = self.plan(model_type, model_name)
+        if not plan:
+            yield {'html': "Error: Google API key not configured", 'pending': '', 'error': True}
+            return
+        yield from self.provider.format_stream(
+            lambda: self._race_stream(plan, requested_provider(model_type), user_message, relevant_docs, chat_history),
+            ERROR_TEMPLATES[plan[0].provider]
+        )
+
+    def _race_stream(self, plan: List[Route], requested: str, user_message: str, relevant_docs: List[Document], chat_history) -> Iterator[str]:
+        """Raw deltas of the first provider to produce a token; the others are cancelled"""
+        events = queue.Queue()
+        attempts: List[_Attempt] = []
+
+        def launch(hedge: bool = False):
+            attempt = self._start(plan.pop(0), user_message, relevant_docs, chat_history, hedge)
+            attempts.append(attempt)
+            threading.Thread(target=self._pump_stream, args=(attempt, events), name="llm-route-stream", daemon=True).start()
+
+        launch()
+        running = 1
+        winner = None
+        try:
+            while True:
+                timeout = self._hedge_timeout(attempts[0], 'first_token', plan) if winner is None else None
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    launch(hedge=True)
+                    running += 1
+                    continue
+                if winner is None and kind != 'error':
+                    # First token (or an empty answer) decides the race
+                    winner = attempt
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancelled.set()
+                    self._won(winner, attempts, requested)
+                if attempt is not winner:
+                    if winner is None:
+                        running -= 1
+                        if plan:
+                            launch()
+                            running += 1
+                        elif running == 0:
+                            raise self._final_error(attempts)
+                    continue
+                if kind == 'delta':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+        finally:
+            # Done, failed or the client went away: stop every upstream
+            for attempt in attempts:
+                attempt.cancelled.set()
+
+    def _pump_stream(self, attempt: _Attempt, events: queue.Queue):
+        health = self.health[attempt.route.provider]
+        stream = self.provider.stream(attempt.route.provider, attempt.prompt, attempt.route.model_name)
+        first = True
+        try:
+            for delta in stream:
+                if first:
+                    health.record_success('first_token', attempt.elapsed())
+                    first = False
+                if attempt.cancelled.is_set():
+                    break
+                events.put((attempt, 'delta', delta))
+            if first:
+                health.record_success()
+            events.put((attempt, 'end', None))
+        except Exception as e:
+            if not attempt.cancelled.is_set():
+                self._failed(attempt, e)
+            events.put((attempt, 'error', e))
+        finally:
+            # Releases the admission slot and the HTTP connection of a cancelled loser
+            stream.close()
+
+    async def acomplete(self, user_message: str, relevant_docs: List[Document], chat_history=None,
+                        model_type: str = 'gemini', model_name: Optional[str] = None) -> str:
+        """Async complete (asgi.py); losing calls are cancelled"""
+        plan = self.plan(model_type, model_name)
+        if not plan:
+            return "Error: Google API key not configured"
+        attempts: List[_Attempt] = []
+        tasks: Dict[asyncio.Future, _Attempt] = {}
+
+        def launch(hedge: bool = False):
+            attempt = self._start(plan.pop(0), user_message, relevant_docs, chat_history, hedge)
+            attempts.append(attempt)
+            tasks[asyncio.ensure_future(self._acall(attempt))] = attempt
+
+        launch()
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=self._hedge_timeout(attempts[0], 'complete', plan), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch(hedge=True)
+                    continue
+                for task in done:
+                    attempt = tasks.pop(task)
+                    if attempt.error is None:
+                        self._won(attempt, attempts, requested_provider(model_type))
+                        return self.provider.format_html(task.result())
+                if plan:
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self._give_up(attempts)
+
+    async def _acall(self, attempt: _Attempt) -> Optional[str]:
+        try:
+            text = await self.provider.acomplete(attempt.route.provider, attempt.prompt, attempt.route.model_name)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed(attempt, e)
+            return None
+        self.health[attempt.route.provider].record_success('complete', attempt.elapsed())
+        return text
+
+    async def astream(self, user_message: str, relevant_docs: List[Document], chat_history=None,
+                      model_type: str = 'gemini', model_name: Optional[str] = None) -> AsyncIterator[Dict[str, str]]:
+        """Async stream (same events)"""
+        plan = self.plan(model_type, model_name)
+        if not plan:
+            yield {'html': "Error: Google API key not configured", 'pending': '', 'error': True}
+            return
+        stream = self._arace_stream(plan, requested_provider(model_type), user_message, relevant_docs, chat_history)
+        async for event in self.provider.aformat_stream(stream, ERROR_TEMPLATES[plan[0].provider]):
+            yield event
+
+    async def _arace_stream(self, plan: List[Route], requested: str, user_message: str, relevant_docs: List[Document], chat_history) -> AsyncIterator[str]:
+        """Async _race_stream"""
+        events = asyncio.Queue()
+        attempts: List[_Attempt] = []
+
+        def launch(hedge: bool = False):
+            attempt = self._start(plan.pop(0), user_message, relevant_docs, chat_history, hedge)
+            attempt.task = asyncio.ensure_future(self._apump_stream(attempt, events))
+            attempts.append(attempt)
+
+        launch()
+        running = 1
+        winner = None
+        try:
+            while True:
+                timeout = self._hedge_timeout(attempts[0], 'first_token', plan) if winner is None else None
+                try:
+                    attempt, kind, value = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    launch(hedge=True)
+                    running += 1
+                    continue
+                if winner is None and kind != 'error':
+                    winner = attempt
+                    for other in attempts:
+                        if other is not winner:
+                            other.task.cancel()
+                    self._won(winner, attempts, requested)
+                if attempt is not winner:
+                    if winner is None:
+                        running -= 1
+                        if plan:
+                            launch()
+                            running += 1
+                        elif running == 0:
+                            raise self._final_error(attempts)
+                    continue
+                if kind == 'delta':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+        finally:
+            for attempt in attempts:
+                attempt.task.cancel()
+
+    async def _apump_stream(self, attempt: _Attempt, events: asyncio.Queue):
+        health = self.health[attempt.route.provider]
+        first = True
+        try:
+            async for delta in self.provider.astream(attempt.route.provider, attempt.prompt, attempt.route.model_name):
+                if first:
+                    health.record_success('first_token', attempt.elapsed())
+                    first = False
+                events.put_nowait((attempt, 'delta', delta))
+            if first:
+                health.record_success()
+            events.put_nowait((attempt, 'end', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed(attempt, e)
+            events.put_nowait((attempt, 'error', e))
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-provider circuit state and latency, plus fallback and hedging counts"""
+        return {
+            'fallback_to_local': self.fallback_to['local'],
+            'fallback_to_gemini': self.fallback_to['gemini'],
+            'hedging_enabled': self.hedging,
+            'fallbacks': self.fallbacks,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'providers': {name: health.stats() for name, health in self.health.items()}
+        }
@@ -0,0 +1,99 @@
+"""
+Reranker Module
+Optional cross-encoder re-ranking of retrieved chunks (CPU, one batched forward pass per query)
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+from langchain.schema import Document
+from backend.answer_cache import normalize_question
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a sentence-transformers CrossEncoder and keeps the top_n chunks"""
+
+    def __init__(self, model_name: str, top_n: int = 4, batch_size: int = 32, cache_size: int = 4096,
+                 max_length: int = 512):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+        # (query hash, chunk id) -> score; chunk ids are content hashes, so scores never go stale
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches = 0
+        self.predict_seconds = 0.0
+
+    @property
+    def model(self):
+        """CrossEncoder loaded on first use"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length, device='cpu')
+        return self._model
+
+    def warm_up(self):
+        """Load the model and run one dummy pair"""
+        self.model.predict([("warm up", "warm up")], batch_size=1, show_progress_bar=False)
+
+    @staticmethod
+    def _query_hash(query: str) -> str:
+        return hashlib.sha1(normalize_question(query).encode('utf-8')).hexdigest()
+
+    def score(self, query: str, docs: List[Document]) -> List[float]:
+        """Relevance score of each document; uncached pairs are scored in a single predict call"""
+        query_hash = self._query_hash(query)
+        keys = [(query_hash, doc.metadata.get('id') or hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()) for doc in docs]
+        scores: Dict[Tuple[str, str], float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[key] = self._scores[key]
+            missing = [i for i, key in enumerate(keys) if key not in scores]
+            self.cache_hits += len(keys) - len(missing)
+            self.cache_misses += len(missing)
+        if missing:
+            start = time.perf_counter()
+            predicted = self.model.predict(
+                [(query, docs[i].page_content) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False
+            )
+            with self._lock:
+                self.predict_seconds += time.perf_counter() - start
+                self.batches += 1
+                for i, value in zip(missing, predicted):
+                    scores[keys[i]] = float(value)
+                    self._scores[keys[i]] = float(value)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        return [scores[key] for key in keys]
+
+    def rerank(self, query: str, docs: List[Document], top_n: int = None) -> List[Tuple[Document, float]]:
+        """(Document, score) pairs of the top_n most relevant documents, best first"""
+        if not docs:
+            return []
+        ranked = sorted(zip(docs, self.score(query, docs)), key=lambda pair: pair[1], reverse=True)
+        return ranked[:top_n or self.top_n]
+
+    def stats(self) -> Dict[str, Any]:
+        """Score cache counters and model time"""
+        return {
+            'model': self.model_name,
+            'loaded': self._model is not None,
+            'cached_scores': len(self._scores),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'batches': self.batches,
+            'predict_seconds': round(self.predict_seconds, 3)
+        }
@@ -0,0 +1,266 @@
+"""
+Single-Flight Module
+Coalesces identical concurrent work (retrieval, generation, token streams) into one execution;
+waiters share the result, and streamed events fan out to every subscriber
+"""
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional
+
+
+class _FlightCounters(ABC):
+    """Leader / coalesced counts per key kind (first element of tuple keys)"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, key: Hashable, leader: bool):
+        kind = str(key[0]) if isinstance(key, tuple) and key else 'default'
+        with self._counts_lock:
+            entry = self._counts.setdefault(kind, {'leaders': 0, 'coalesced': 0})
+            entry['leaders' if leader else 'coalesced'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Executions started vs. requests that joined one already in flight"""
+        with self._counts_lock:
+            counts = {kind: dict(entry) for kind, entry in self._counts.items()}
+        return {'in_flight': self._in_flight(), 'by_kind': counts}
+
+    @abstractmethod
+    def _in_flight(self) -> int:
+        """Executions and streams currently running"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Broadcast:
+    """Events of one upstream stream; subscribers replay the buffer, then follow live events"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.cond = threading.Condition()
+        # Subscribers still reading; at zero the upstream is abandoned (see SingleFlight._subscribe)
+        self.subscribers = 0
+        self.abandoned = False
+
+    def publish(self, event: Any):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    def subscribe(self) -> Iterator[Any]:
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.events) and not self.finished:
+                    self.cond.wait()
+                pending = self.events[index:]
+                index = len(self.events)
+                done, error = self.finished, self.error
+            yield from pending
+            if done and index >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight(_FlightCounters):
+    """Thread-based single-flight: concurrent calls with the same key wait for one execution"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers of key; its result (or exception) is shared"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        self._count(key, leader)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key: Hashable, open_stream: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """Iterate open_stream() once per key; every concurrent caller receives all of its events.
+
+        The upstream runs in its own thread, so a disconnecting client does not cut the others off;
+        once every caller has gone, the upstream is closed at its next event.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+            broadcast.subscribers += 1
+        self._count(key, leader)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, broadcast, open_stream), name="single-flight-stream", daemon=True).start()
+        return self._subscribe(key, broadcast)
+
+    def _subscribe(self, key: Hashable, broadcast: _Broadcast) -> Iterator[Any]:
+        try:
+            yield from broadcast.subscribe()
+        finally:
+            with self._lock:
+                broadcast.subscribers -= 1
+                if broadcast.subscribers == 0 and not broadcast.finished:
+                    # Nobody reads the rest: stop the upstream and let later requests start a new one
+                    broadcast.abandoned = True
+                    if self._streams.get(key) is broadcast:
+                        del self._streams[key]
+
+    def _pump(self, key: Hashable, broadcast: _Broadcast, open_stream: Callable[[], Iterator[Any]]):
+        error = None
+        upstream = None
+        try:
+            upstream = open_stream()
+            for event in upstream:
+                if broadcast.abandoned:
+                    break
+                broadcast.publish(event)
+        except BaseException as e:
+            error = e
+        finally:
+            # Closing the generator runs the provider's cleanup (admission slot, HTTP connection)
+            if broadcast.abandoned and hasattr(upstream, 'close'):
+                upstream.close()
+            # Later requests start a new stream instead of joining a finished one
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            broadcast.finish(error)
+
+    def _in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams)
+
+
+class _AsyncBroadcast:
+    """asyncio counterpart of _Broadcast"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.cond = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Future] = None
+
+    async def publish(self, event: Any):
+        async with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None):
+        async with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: index < len(self.events) or self.finished)
+                pending = self.events[index:]
+                index = len(self.events)
+                done, error = self.finished, self.error
+            for event in pending:
+                yield event
+            if done and index >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class AsyncSingleFlight(_FlightCounters):
+    """asyncio single-flight for the async serving mode (one event loop)"""
+
+    def __init__(self):
+        super().__init__()
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._streams: Dict[Hashable, _AsyncBroadcast] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() once for all concurrent callers of key"""
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        self._count(key, leader)
+        # A cancelled (disconnected) waiter must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def stream(self, key: Hashable, open_stream: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Iterate open_stream() once per key in a background task; all concurrent callers get every event.
+
+        The task is cancelled once every caller has gone.
+        """
+        broadcast = self._streams.get(key)
+        leader = broadcast is None
+        if leader:
+            broadcast = self._streams[key] = _AsyncBroadcast()
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, open_stream))
+        broadcast.subscribers += 1
+        self._count(key, leader)
+        return self._subscribe(key, broadcast)
+
+    async def _subscribe(self, key: Hashable, broadcast: _AsyncBroadcast) -> AsyncIterator[Any]:
+        try:
+            async for event in broadcast.subscribe():
+                yield event
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.finished:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.task.cancel()
+
+    async def _pump(self, key: Hashable, broadcast: _AsyncBroadcast, open_stream: Callable[[], AsyncIterator[Any]]):
+        error = None
+        try:
+            async for event in open_stream():
+                await broadcast.publish(event)
+        except Exception as e:
+            error = e
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            await broadcast.finish(error)
+
+    def _in_flight(self) -> int:
+        return len(self._calls) + len(self._streams)
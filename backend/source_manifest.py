@@ -0,0 +1,183 @@
+"""
+Source Manifest Module
+Per-source record of chunk ids, chunk counts and ingest time, persisted next to the vector store
+(SQLite, one row per source, so a save only writes the sources that changed)
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Any
+
+
+class SourceManifest:
+    """Maintained index of source -> {'ids', 'chunks', 'ingested_at'}"""
+
+    def __init__(self, db_path: str):
+        """Open the manifest database; a legacy source_manifest.json next to it is imported once"""
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self._id_sets: Dict[str, set] = {}  # lazily built membership sets for add_chunks
+        self._dirty = set()  # sources changed (or removed) since the last save
+        self._total = 0  # chunks over all sources, kept up to date so counts never scan
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " source TEXT PRIMARY KEY,"
+            " ids TEXT NOT NULL,"
+            " chunks INTEGER NOT NULL,"
+            " ingested_at TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def __contains__(self, source: str) -> bool:
+        return source in self.sources
+
+    def add_chunks(self, source: str, chunk_ids: Iterable[str]):
+        """Record chunk ids written for a source"""
+        with self._lock:
+            entry = self.sources.setdefault(source, {'ids': [], 'chunks': 0, 'ingested_at': None})
+            known = self._known_ids(source)
+            for chunk_id in chunk_ids:
+                if chunk_id not in known:
+                    known.add(chunk_id)
+                    entry['ids'].append(chunk_id)
+            self._total += len(entry['ids']) - entry['chunks']
+            entry['chunks'] = len(entry['ids'])
+            entry['ingested_at'] = datetime.now().isoformat()
+            self._dirty.add(source)
+
+    def remove_chunks(self, source: str, chunk_ids: Iterable[str]):
+        """Forget chunk ids deleted from a source"""
+        with self._lock:
+            entry = self.sources.get(source)
+            if entry is None:
+                return
+            removed = set(chunk_ids)
+            entry['ids'] = [chunk_id for chunk_id in entry['ids'] if chunk_id not in removed]
+            self._total -= entry['chunks'] - len(entry['ids'])
+            entry['chunks'] = len(entry['ids'])
+            self._id_sets.pop(source, None)
+            if not entry['ids']:
+                del self.sources[source]
+            self._dirty.add(source)
+
+    def remove_source(self, source: str):
+        """Forget a source entirely"""
+        with self._lock:
+            entry = self.sources.pop(source, None)
+            if entry is not None:
+                self._total -= entry['chunks']
+            self._id_sets.pop(source, None)
+            self._dirty.add(source)
+
+    def has_chunk(self, source: str, chunk_id: str) -> bool:
+        """True if chunk_id is recorded for source"""
+        with self._lock:
+            return source in self.sources and chunk_id in self._known_ids(source)
+
+    def ids(self, source: str) -> List[str]:
+        """Chunk ids recorded for a source"""
+        with self._lock:
+            entry = self.sources.get(source)
+            return list(entry['ids']) if entry else []
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Per-source chunk counts and ingest time (without the id lists)"""
+        with self._lock:
+            return [
+                {'source': source, 'chunks': entry['chunks'], 'ingested_at': entry['ingested_at']}
+                for source, entry in sorted(self.sources.items())
+            ]
+
+    def source_counts(self) -> Dict[str, int]:
+        """Chunk count per source"""
+        with self._lock:
+            return {source: entry['chunks'] for source, entry in self.sources.items()}
+
+    def total_chunks(self) -> int:
+        """Chunks over all sources (O(1))"""
+        return self._total
+
+    def clear(self):
+        """Remove every source"""
+        with self._lock:
+            self.sources.clear()
+            self._total = 0
+            self._id_sets.clear()
+            self._dirty.clear()
+            try:
+                with self._conn:
+                    self._conn.execute("DELETE FROM sources")
+            except Exception as e:
+                print(f"Error clearing source manifest: {str(e)}")
+            self.save()
+
+    def save(self):
+        """Write the rows of the sources changed since the last save (one transaction)"""
+        try:
+            with self._lock, self._conn:
+                for source in self._dirty:
+                    entry = self.sources.get(source)
+                    if entry is None:
+                        self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO sources (source, ids, chunks, ingested_at) VALUES (?, ?, ?, ?)",
+                            (source, json.dumps(entry['ids']), entry['chunks'], entry['ingested_at'])
+                        )
+                # Marks the manifest as built (an empty store still has a valid, empty manifest)
+                self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('version', '2')")
+                self._dirty.clear()
+                self.exists = True
+        except Exception as e:
+            print(f"Error saving source manifest: {str(e)}")
+
+    def _known_ids(self, source: str) -> set:
+        known = self._id_sets.get(source)
+        if known is None:
+            known = self._id_sets[source] = set(self.sources[source]['ids'])
+        return known
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _load(self):
+        try:
+            self.exists = self._conn.execute("SELECT 1 FROM settings WHERE key = 'version'").fetchone() is not None
+            if not self.exists:
+                self._import_json(os.path.splitext(self.db_path)[0] + '.json')
+                return
+            for source, ids, chunks, ingested_at in self._conn.execute("SELECT source, ids, chunks, ingested_at FROM sources"):
+                self.sources[source] = {'ids': json.loads(ids), 'chunks': chunks, 'ingested_at': ingested_at}
+            self._total = sum(entry['chunks'] for entry in self.sources.values())
+        except Exception as e:
+            print(f"Error loading source manifest: {str(e)}")
+            self.sources = {}
+            self._total = 0
+            self.exists = False
+
+    def _import_json(self, json_path: str):
+        """Import the manifest of older stores (a single JSON file) into the database"""
+        if not os.path.exists(json_path):
+            return
+        with open(json_path, 'r', encoding='utf-8') as f:
+            self.sources = json.load(f).get('sources', {})
+        self._total = sum(entry['chunks'] for entry in self.sources.values())
+        self._dirty.update(self.sources)
+        self.save()
+        if self.exists:
+            os.remove(json_path)
+            print(f"Imported source manifest for {len(self.sources)} sources from {json_path}")
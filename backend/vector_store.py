@@ -1,70 +1,436 @@
 """
 Vector Store Module
-Manages document embeddings and similarity search using Chroma
+Manages document embeddings and similarity search (Chroma or FAISS index backends)
 """
 
 import os
-import chromadb
-from typing import List, Dict, Any
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 from langchain.schema import Document
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+from backend.keyword_index import KeywordIndex
+from backend.embedding_cache import EmbeddingCache, CachedEmbeddings
+from backend.source_manifest import SourceManifest
+from backend.index_backends import IndexBackend, create_index_backend
+from config import Config
+
+EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-large"
+
+# Reciprocal-rank fusion constant (Cormack et al.); dampens the weight of top ranks
+RRF_K = 60
+
+def chunk_id_for(source: str, text: str) -> str:
+    """Content-addressed chunk id: hash of the source plus the whitespace-normalized text"""
+    normalized = ' '.join(text.split())
+    return hashlib.sha256(f"{source}\x00{normalized}".encode('utf-8')).hexdigest()
+
+# Per-process model used by IngestionEmbedder worker processes
+_worker_model = None
+
+def _init_embedding_worker(model_name: str, num_threads: int):
+    """Load the embedding model once in each worker process"""
+    global _worker_model
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name, device='cpu')
+
+def _encode_in_worker(texts: List[str]) -> List[List[float]]:
+    """Encode one batch in a worker process"""
+    return _worker_model.encode(texts, batch_size=len(texts), normalize_embeddings=True).tolist()
+
+
+class IngestionEmbedder:
+    """Batched embedding pipeline for ingestion.
+    
+    Cache hits are served first; the remaining chunks are sorted by length (so
+    each batch pads to similar lengths), embedded in batches of batch_size, and
+    yielded as (indices, vectors) as soon as each batch finishes. Batches run
+    either in-process using torch intra-op threads, or on a pool of worker
+    processes with at most max_pending batches in flight, which keeps memory
+    bounded for very large documents.
+    """
+
+    def __init__(self, embeddings: CachedEmbeddings, model_name: str, batch_size: int = 32,
+                 num_threads: int = 0, num_processes: int = 0, max_pending: int = 0):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads
+        self.num_processes = num_processes
+        self.max_pending = max_pending or max(2, num_processes * 2)
+        self._pool = None
+        if num_threads and not num_processes:
+            try:
+                import torch
+                torch.set_num_threads(num_threads)
+            except Exception as e:
+                print(f"Error setting torch threads: {str(e)}")
+
+    def embed(self, texts: List[str]) -> Iterator[Tuple[List[int], List[List[float]]]]:
+        """Yield (indices into texts, vectors) batches in completion order"""
+        cached = self.embeddings.cache.get_many(self.model_name, texts)
+        hits = [i for i, vector in enumerate(cached) if vector is not None]
+        for start in range(0, len(hits), self.batch_size):
+            indices = hits[start:start + self.batch_size]
+            yield indices, [cached[i] for i in indices]
+        hit_set = set(hits)
+        del cached
+        
+        missing = sorted((i for i in range(len(texts)) if i not in hit_set), key=lambda i: len(texts[i]))
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        if not batches:
+            return
+        if self.num_processes > 1:
+            results = self._embed_in_processes(texts, batches)
+        else:
+            results = ((indices, self.embeddings.embeddings.embed_documents([texts[i] for i in indices])) for indices in batches)
+        for indices, vectors in results:
+            vectors = [list(vector) for vector in vectors]
+            self.embeddings.cache.put_many(self.model_name, [texts[i] for i in indices], vectors)
+            yield indices, vectors
+
+    def _embed_in_processes(self, texts: List[str], batches: List[List[int]]) -> Iterator[Tuple[List[int], List[List[float]]]]:
+        """Run batches on the worker process pool with bounded in-flight work"""
+        if self._pool is None:
+            threads_per_process = self.num_threads or max(1, (os.cpu_count() or 1) // self.num_processes)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_processes,
+                initializer=_init_embedding_worker,
+                initargs=(self.model_name, threads_per_process)
+            )
+        pending = {}
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < self.max_pending:
+                indices = batches[next_batch]
+                future = self._pool.submit(_encode_in_worker, [texts[i] for i in indices])
+                pending[future] = indices
+                next_batch += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+
 
 class VectorStore:
     """Manages document embeddings and similarity search"""
     
     def __init__(self, persist_directory: str = "data/vectorstore"):
-        """Initialize vector store with Chroma"""
+        """Initialize vector store with the configured index backend"""
         self.persist_directory = persist_directory
         os.makedirs(persist_directory, exist_ok=True)
         
-        # Initialize embeddings model
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="intfloat/multilingual-e5-large",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
+        # Initialize embeddings model, behind a persistent cache keyed by
+        # (model name, sha256 of text) so unchanged chunks are never re-embedded
+        self.embedding_cache = EmbeddingCache(os.path.join(persist_directory, "embedding_cache.sqlite3"))
+        self.embeddings = CachedEmbeddings(
+            HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL_NAME,
+                model_kwargs={'device': 'cpu'},
+                encode_kwargs={'normalize_embeddings': True}
+            ),
+            self.embedding_cache,
+            EMBEDDING_MODEL_NAME,
+            query_cache_size=Config.QUERY_CACHE_SIZE
         )
         
-        # Initialize Chroma vector store
-        self.vectorstore = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=self.embeddings,
-            collection_name="rag_documents"
+        # Batched, multi-core embedder used when ingesting documents
+        self.embedder = IngestionEmbedder(
+            self.embeddings,
+            EMBEDDING_MODEL_NAME,
+            batch_size=Config.EMBED_BATCH_SIZE,
+            num_threads=Config.EMBED_THREADS,
+            num_processes=Config.EMBED_PROCESSES
         )
         
-        # Keep track of added documents
+        # Vector index + chunk store (Chroma or FAISS, see VECTOR_BACKEND)
+        self.index = self._open_index()
+        
+        # Keep track of added documents (per-source manifest of chunk ids, counts, ingest time)
+        self.manifest = SourceManifest(os.path.join(persist_directory, "source_manifest.sqlite3"))
         self.document_sources = set()
         self._load_existing_sources()
+        
+        # Inverted keyword index (BM25) persisted next to the vector index
+        self.keyword_index = KeywordIndex(os.path.join(persist_directory, "keyword_index.sqlite3"))
+        self._ensure_keyword_index()
+        
+        # Worker pool so dense and lexical retrieval of hybrid_search run concurrently
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+        
+        # Callbacks notified with the set of sources touched by a write (None = everything)
+        self._change_listeners = []
+        
+        # Writes to one source are serialized (ingest workers run concurrently); different sources still overlap
+        self._source_locks: Dict[str, threading.Lock] = {}
+        self._source_locks_guard = threading.Lock()
     
-    def add_documents(self, documents: List[Document]) -> bool:
-        """Add documents to the vector store"""
-        try:
-            if not documents:
+    def _open_index(self) -> IndexBackend:
+        """Create the index backend selected in Config (FAISS options are ignored for Chroma)"""
+        return create_index_backend(
+            Config.VECTOR_BACKEND,
+            self.persist_directory,
+            self.embeddings,
+            index_type=Config.FAISS_INDEX_TYPE,
+            nlist=Config.FAISS_NLIST,
+            pq_m=Config.FAISS_PQ_M,
+            nprobe=Config.FAISS_NPROBE,
+            hnsw_m=Config.FAISS_HNSW_M,
+            ef_search=Config.FAISS_EF_SEARCH,
+            rerank_factor=Config.FAISS_RERANK_FACTOR
+        )
+    
+    def _source_lock(self, source: str) -> threading.Lock:
+        """Lock serializing upserts/deletes of one source"""
+        with self._source_locks_guard:
+            return self._source_locks.setdefault(source, threading.Lock())
+    
+    @contextmanager
+    def _all_sources_locked(self):
+        """Hold every source lock, and block new ones, for writes spanning sources (add_documents, clear_all)"""
+        with self._source_locks_guard:
+            locks = list(self._source_locks.values())
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in locks:
+                    lock.release()
+    
+    def add_change_listener(self, callback):
+        """Register callback(sources) called after documents of those sources change"""
+        self._change_listeners.append(callback)
+    
+    def _notify_change(self, sources=None):
+        for callback in self._change_listeners:
+            try:
+                callback(None if sources is None else set(sources))
+            except Exception as e:
+                print(f"Error in vector store change listener: {str(e)}")
+    
+    def add_documents(self, documents: Iterable[Document], progress_callback=None) -> bool:
+        """Add documents to the vector store.
+        
+        documents may be a list or a lazy iterator (e.g. DocumentLoader.iter_document),
+        which is consumed in windows so embedding starts before parsing finishes.
+        Chunks go through the batched IngestionEmbedder and each batch is written
+        to the collection as soon as it is embedded; progress_callback(stage, done, total)
+        is called with 'embedded' and 'persisted' after each batch (for iterators,
+        total is the number of chunks seen so far).
+        """
+        with self._all_sources_locked():
+            written: List[Tuple[str, str]] = []
+            try:
+                counts, seen_ids = self._write_documents(documents, progress_callback, written=written)
+                if not seen_ids:
+                    return False
+                
+                # Persist changes
+                self.keyword_index.save()
+                self.manifest.save()
+                self.index.persist()
+                
+                self._notify_change(counts['sources'])
+                print(f"Added {counts['added']} documents to vector store")
+                return True
+            
+            except Exception as e:
+                print(f"Error adding documents to vector store: {str(e)}")
+                self._rollback(written)
                 return False
+    
+    def upsert_document(self, source: str, documents: Iterable[Document], progress_callback=None) -> Optional[Dict[str, int]]:
+        """Re-ingest a source incrementally using content-addressed chunk ids.
+        
+        Only chunks whose (source, normalized text) hash is new are embedded;
+        chunks that disappeared are deleted and unchanged chunks only get their
+        metadata refreshed. Returns {'added', 'removed', 'unchanged'} or None on error,
+        in which case the chunks added so far are removed again.
+        """
+        with self._source_lock(source):
+            written: List[Tuple[str, str]] = []
+            try:
+                existing_ids = set(self._source_ids(source))
+                counts, seen_ids = self._write_documents(documents, progress_callback, existing_ids, written)
+                
+                # Nothing parsed: keep the current chunks rather than deleting everything
+                removed_ids = list(existing_ids - seen_ids) if seen_ids else []
+                if removed_ids:
+                    self.index.delete(removed_ids)
+                    self.keyword_index.remove(removed_ids, persist=False)
+                    self.manifest.remove_chunks(source, removed_ids)
+                counts['removed'] = len(removed_ids)
+                if source not in self.manifest:
+                    self.document_sources.discard(source)
+                
+                self.keyword_index.save()
+                self.manifest.save()
+                self.index.persist()
+                touched = counts.pop('sources')
+                if counts['added'] or counts['removed']:
+                    self._notify_change(touched | {source})
+                print(f"Upserted {source}: {counts['added']} added, {counts['removed']} removed, {counts['unchanged']} unchanged")
+                return counts
+            except Exception as e:
+                print(f"Error upserting document {source}: {str(e)}")
+                self._rollback(written)
+                return None
+    
+    def _rollback(self, written: List[Tuple[str, str]]):
+        """Remove the (chunk_id, source) pairs written by a failed add/upsert from the index,
+        keyword index and manifest, so a failed upload leaves the store as it was"""
+        if not written:
+            return
+        try:
+            chunk_ids = [chunk_id for chunk_id, _ in written]
+            self.index.delete(chunk_ids)
+            self.keyword_index.remove(chunk_ids)
+            by_source: Dict[str, List[str]] = {}
+            for chunk_id, source in written:
+                by_source.setdefault(source, []).append(chunk_id)
+            for source, ids in by_source.items():
+                self.manifest.remove_chunks(source, ids)
+                if source not in self.manifest:
+                    self.document_sources.discard(source)
+            self.manifest.save()
+            self.index.persist()
+            print(f"Rolled back {len(chunk_ids)} chunks of a failed write")
+        except Exception as e:
+            print(f"Error rolling back failed write: {str(e)}")
+    
+    def _write_documents(self, documents: Iterable[Document], progress_callback=None,
+                         existing_ids: Optional[Set[str]] = None,
+                         written: Optional[List[Tuple[str, str]]] = None) -> Tuple[Dict[str, Any], Set[str]]:
+        """Embed and write chunks not in existing_ids; returns (counts + touched sources, ids of all chunks seen).
+        
+        (chunk_id, source) of every chunk that was not stored before is appended to written
+        before it is written, so a failure midway can be rolled back.
+        """
+        existing_ids = existing_ids or set()
+        known_total = len(documents) if hasattr(documents, '__len__') else None
+        counts = {'added': 0, 'removed': 0, 'unchanged': 0, 'sources': set()}
+        seen_ids: Set[str] = set()
+        done = 0
+        for window in self._windows(documents, self.embedder.batch_size * 8):
+            new_docs = []
+            unchanged = []
+            for doc in window:
+                chunk_id = chunk_id_for(doc.metadata.get('source', 'Unknown'), doc.page_content)
+                if chunk_id in seen_ids:
+                    continue  # identical chunk repeated within the source
+                seen_ids.add(chunk_id)
+                if chunk_id in existing_ids:
+                    unchanged.append((chunk_id, doc))
+                else:
+                    new_docs.append((chunk_id, doc))
+            total = known_total or len(seen_ids)
+            
+            if unchanged:
+                # Same text, so no re-embedding; refresh metadata (e.g. page numbers) only
+                self.index.update_metadata(
+                    [chunk_id for chunk_id, _ in unchanged],
+                    [doc.metadata for _, doc in unchanged]
+                )
+                counts['unchanged'] += len(unchanged)
+                done += len(unchanged)
+            
+            for indices, embeddings in self.embedder.embed([doc.page_content for _, doc in new_docs]):
+                batch = [new_docs[i] for i in indices]
+                done += len(batch)
+                if progress_callback:
+                    progress_callback('embedded', done, total)
+                
+                if written is not None:
+                    for chunk_id, doc in batch:
+                        source = doc.metadata.get('source', 'Unknown')
+                        if not self.manifest.has_chunk(source, chunk_id):
+                            written.append((chunk_id, source))
+                
+                # Add documents to vector store
+                self.index.upsert(
+                    [chunk_id for chunk_id, _ in batch],
+                    embeddings,
+                    [doc.page_content for _, doc in batch],
+                    [doc.metadata for _, doc in batch]
+                )
+                self.keyword_index.add(
+                    ((chunk_id, doc.page_content, doc.metadata.get('source', 'Unknown')) for chunk_id, doc in batch),
+                    persist=False
+                )
+                self._record_sources(batch)
+                counts['added'] += len(batch)
+                if progress_callback:
+                    progress_callback('persisted', done, total)
             
-            # Add documents to vector store
-            self.vectorstore.add_documents(documents)
+            if progress_callback and not new_docs and unchanged:
+                progress_callback('embedded', done, total)
+                progress_callback('persisted', done, total)
             
             # Update document sources tracking
-            for doc in documents:
+            for doc in window:
                 source = doc.metadata.get('source', 'Unknown')
                 self.document_sources.add(source)
-            
-            # Persist changes
-            self.vectorstore.persist()
-            
-            print(f"Added {len(documents)} documents to vector store")
-            return True
-            
+                counts['sources'].add(source)
+        
+        return counts, seen_ids
+    
+    def _record_sources(self, chunks: Iterable[Tuple[str, Document]]):
+        """Add (chunk_id, Document) pairs to the per-source manifest"""
+        by_source: Dict[str, List[str]] = {}
+        for chunk_id, doc in chunks:
+            by_source.setdefault(doc.metadata.get('source', 'Unknown'), []).append(chunk_id)
+        for source, chunk_ids in by_source.items():
+            self.manifest.add_chunks(source, chunk_ids)
+    
+    def _source_ids(self, source: str) -> List[str]:
+        """Chunk ids stored for a source: from the manifest, else a metadata-filtered lookup
+        that loads no documents or embeddings"""
+        if source in self.manifest:
+            return self.manifest.ids(source)
+        return self.index.ids_for_source(source)
+    
+    @staticmethod
+    def _windows(documents: Iterable[Document], size: int) -> Iterator[List[Document]]:
+        """Group an iterable of documents into lists of at most size"""
+        window = []
+        for doc in documents:
+            window.append(doc)
+            if len(window) >= size:
+                yield window
+                window = []
+        if window:
+            yield window
+    
+    def warm_up(self) -> float:
+        """Run a dummy encode and query so the first user request avoids lazy-init latency; returns seconds taken"""
+        start = time.perf_counter()
+        try:
+            # Bypass the caches so the model forward pass really runs
+            vector = self.embeddings.embeddings.embed_query("warm up")
+            if self.index.count() > 0:
+                # First query loads the index (Chroma HNSW segment / FAISS pages) from disk
+                self.index.query(list(vector), 1)
+            elapsed = time.perf_counter() - start
+            print(f"Vector store warmed up in {elapsed:.2f}s")
+            return elapsed
         except Exception as e:
-            print(f"Error adding documents to vector store: {str(e)}")
-            return False
+            print(f"Error warming up vector store: {str(e)}")
+            return time.perf_counter() - start
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embedding of a query string (served from the embedding cache when possible)"""
+        return self.embeddings.embed_query(query)
     
     def search(self, query: str, k: int = 3) -> List[Document]:
         """Search for similar documents"""
         try:
-            results = self.vectorstore.similarity_search(query, k=k)
-            return results
+            return [doc for doc, _distance in self._query_index(query, k)]
         except Exception as e:
             print(f"Error searching vector store: {str(e)}")
             return []
@@ -72,29 +438,87 @@ class VectorStore:
     def search_with_scores(self, query: str, k: int = 3) -> List[tuple]:
         """Search for similar documents with similarity scores"""
         try:
-            results = self.vectorstore.similarity_search_with_score(query, k=k)
-            return results
+            return self._query_index(query, k)
         except Exception as e:
             print(f"Error searching vector store with scores: {str(e)}")
             return []
     
+    def keyword_search(self, query: str, k: int = 10) -> List[tuple]:
+        """Search the inverted keyword index, returning (Document, bm25_score) pairs"""
+        try:
+            scored = self.keyword_index.search(query, k=k)
+            if not scored:
+                return []
+            records = self.index.get([chunk_id for chunk_id, _ in scored])
+            return [
+                (Document(page_content=records[chunk_id][0], metadata={**records[chunk_id][1], 'id': chunk_id}), score)
+                for chunk_id, score in scored if chunk_id in records
+            ]
+        except Exception as e:
+            print(f"Error searching keyword index: {str(e)}")
+            return []
+    
+    def hybrid_search(self, query: str, k: int = 10, alpha: float = 0.5, extra_keywords: List[str] = None) -> List[tuple]:
+        """Dense + BM25 retrieval fused with reciprocal-rank fusion.
+        
+        alpha weights the dense ranking (1.0 = dense only, 0.0 = keyword only);
+        extra_keywords are appended to the lexical query only.
+        Returns at most k deduplicated (Document, fused_score) pairs; each
+        Document carries its chunk id in metadata['id'].
+        """
+        try:
+            fetch_k = max(k * 2, 20)
+            dense_future = self._search_pool.submit(self._dense_search, query, fetch_k)
+            keyword_query = ' '.join([query] + list(extra_keywords or []))
+            keyword_future = self._search_pool.submit(self.keyword_search, keyword_query, fetch_k)
+            dense_hits = dense_future.result()
+            keyword_hits = keyword_future.result()
+            
+            fused: Dict[str, float] = {}
+            docs_by_id: Dict[str, Document] = {}
+            for weight, hits in ((alpha, dense_hits), (1.0 - alpha, keyword_hits)):
+                if weight <= 0:
+                    continue
+                for rank, (doc, _score) in enumerate(hits, 1):
+                    chunk_id = doc.metadata['id']
+                    docs_by_id.setdefault(chunk_id, doc)
+                    fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (RRF_K + rank)
+            
+            ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(docs_by_id[chunk_id], score) for chunk_id, score in ranked]
+        except Exception as e:
+            print(f"Error in hybrid search: {str(e)}")
+            return []
+    
+    def _query_index(self, query: str, k: int) -> List[tuple]:
+        """Embedding search returning (Document, distance) pairs with chunk ids in metadata"""
+        query_embedding = self.embeddings.embed_query(query)
+        return [
+            (Document(page_content=text, metadata={**metadata, 'id': chunk_id}), distance)
+            for chunk_id, text, metadata, distance in self.index.query(query_embedding, k)
+        ]
+    
+    def _dense_search(self, query: str, k: int) -> List[tuple]:
+        """_query_index for hybrid_search: errors give no dense hits instead of failing the search"""
+        try:
+            return self._query_index(query, k)
+        except Exception as e:
+            print(f"Error in dense search: {str(e)}")
+            return []
+    
     def get_document_list(self) -> List[Dict[str, Any]]:
         """Get list of all documents in the vector store"""
         try:
-            # Get all documents from the collection
-            collection = self.vectorstore._collection
-            results = collection.get()
+            # Get all documents from the index, page by page
             documents = []
-            if results['documents']:
-                for i, doc in enumerate(results['documents']):
-                    metadata = results['metadatas'][i] if results['metadatas'] else {}
-                    documents.append({
-                        'id': results['ids'][i],
-                        'content': doc,
-                        'content_preview': doc[:200] + "..." if len(doc) > 200 else doc,
-                        'metadata': metadata,
-                        'source': metadata.get('source', 'Unknown')
-                    })
+            for chunk_id, doc, metadata in self.index.iter_all():
+                documents.append({
+                    'id': chunk_id,
+                    'content': doc,
+                    'content_preview': doc[:200] + "..." if len(doc) > 200 else doc,
+                    'metadata': metadata,
+                    'source': metadata.get('source', 'Unknown')
+                })
             return documents
         except Exception as e:
             print(f"Error getting document list: {str(e)}")
@@ -102,53 +526,48 @@ class VectorStore:
     
     def delete_document(self, source: str) -> bool:
         """Delete documents by source filename"""
-        try:
-            # Get documents with matching source
-            collection = self.vectorstore._collection
-            results = collection.get()
-            
-            if not results['documents']:
+        with self._source_lock(source):
+            try:
+                ids_to_delete = self._source_ids(source)
+                
+                if ids_to_delete:
+                    self.index.delete(ids_to_delete)
+                    self.keyword_index.remove(ids_to_delete)
+                    self.manifest.remove_source(source)
+                    self.manifest.save()
+                    self.document_sources.discard(source)
+                    self.index.persist()
+                    self._notify_change({source})
+                    print(f"Deleted {len(ids_to_delete)} documents with source: {source}")
+                    return True
+                
                 return False
             
-            # Find documents to delete
-            ids_to_delete = []
-            for i, metadata in enumerate(results['metadatas']):
-                if metadata and metadata.get('source') == source:
-                    ids_to_delete.append(results['ids'][i])
-            
-            if ids_to_delete:
-                collection.delete(ids=ids_to_delete)
-                self.document_sources.discard(source)
-                self.vectorstore.persist()
-                print(f"Deleted {len(ids_to_delete)} documents with source: {source}")
-                return True
-            
-            return False
-            
-        except Exception as e:
-            print(f"Error deleting document: {str(e)}")
-            return False
+            except Exception as e:
+                print(f"Error deleting document: {str(e)}")
+                return False
     
     def clear_all(self) -> bool:
         """Clear all documents from vector store"""
-        try:
-            self.vectorstore._client.delete_collection("rag_documents")
-            self.document_sources.clear()
-            print("Cleared all documents from vector store")
-            return True
-        except Exception as e:
-            print(f"Error clearing vector store: {str(e)}")
-            return False
+        with self._all_sources_locked():
+            try:
+                self.index.clear()
+                self.document_sources.clear()
+                self.keyword_index.clear()
+                self.manifest.clear()
+                self._notify_change(None)
+                print("Cleared all documents from vector store")
+                return True
+            except Exception as e:
+                print(f"Error clearing vector store: {str(e)}")
+                return False
     
     def reinitialize(self):
         """Reinitialize vector store after clearing"""
         try:
-            # Reinitialize Chroma vector store
-            self.vectorstore = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-                collection_name="rag_documents"
-            )
+            # Reopen the index backend
+            self.index.close()
+            self.index = self._open_index()
             self.document_sources.clear()
             print("Vector store reinitialized")
         except Exception as e:
@@ -157,23 +576,12 @@ class VectorStore:
     def get_stats(self) -> Dict[str, Any]:
         """Get vector store statistics"""
         try:
-            collection = self.vectorstore._collection
-            results = collection.get()
-            
-            total_documents = len(results['documents']) if results['documents'] else 0
-            
-            # Count documents by source
-            source_counts = {}
-            if results['metadatas']:
-                for metadata in results['metadatas']:
-                    if metadata:
-                        source = metadata.get('source', 'Unknown')
-                        source_counts[source] = source_counts.get(source, 0) + 1
-            
             return {
-                'total_documents': total_documents,
+                'total_documents': self.index.count(),
                 'unique_sources': len(self.document_sources),
-                'source_counts': source_counts,
+                'source_counts': self.manifest.source_counts(),
+                'query_cache': self.embeddings.query_cache_stats(),
+                'index': self.index.describe(),
                 'persist_directory': self.persist_directory
             }
             
@@ -181,29 +589,49 @@ class VectorStore:
             print(f"Error getting vector store stats: {str(e)}")
             return {}
     
+    def counts(self) -> Dict[str, int]:
+        """Chunk and source totals from counters kept by the manifest (no index or collection call)"""
+        return {'total_chunks': self.manifest.total_chunks(), 'unique_sources': len(self.document_sources)}
+    
+    def list_sources(self) -> List[Dict[str, Any]]:
+        """Per-source chunk counts and ingest time from the manifest"""
+        return self.manifest.summary()
+    
     def _load_existing_sources(self):
-        """Load existing document sources from vector store"""
+        """Load existing document sources from the manifest (built once from the collection for older stores)"""
         try:
-            collection = self.vectorstore._collection
-            results = collection.get()
+            if not self.manifest.exists:
+                self._record_sources(
+                    (chunk_id, Document(page_content='', metadata=metadata))
+                    for chunk_id, _text, metadata in self.index.iter_all(include_documents=False)
+                )
+                self.manifest.save()
+                print(f"Built source manifest for {len(self.manifest)} sources")
             
-            if results['metadatas']:
-                for metadata in results['metadatas']:
-                    if metadata:
-                        source = metadata.get('source', 'Unknown')
-                        self.document_sources.add(source)
+            self.document_sources.update(entry['source'] for entry in self.manifest.summary())
             
             print(f"Loaded {len(self.document_sources)} existing document sources")
             
         except Exception as e:
             print(f"Error loading existing sources: {str(e)}")
     
+    def _ensure_keyword_index(self):
+        """Build the keyword index from the collection once if it is missing (existing stores)"""
+        try:
+            if len(self.keyword_index) > 0 or self.index.count() == 0:
+                return
+            self.keyword_index.add(
+                (chunk_id, text, metadata.get('source', 'Unknown'))
+                for chunk_id, text, metadata in self.index.iter_all()
+            )
+            print(f"Built keyword index for {len(self.keyword_index)} existing chunks")
+        except Exception as e:
+            print(f"Error building keyword index: {str(e)}")
+    
     def is_empty(self) -> bool:
         """Check if vector store is empty"""
         try:
-            collection = self.vectorstore._collection
-            results = collection.get()
-            return len(results['documents']) == 0 if results['documents'] else True
+            return self.index.count() == 0
         except Exception as e:
             print(f"Error checking if vector store is empty: {str(e)}")
             return True 
\ No newline at end of file
@@ -22,9 +22,18 @@ class Config:
     MAX_CONTENT_LENGTH = int(os.getenv('MAX_FILE_SIZE', 16 * 1024 * 1024))  # 16MB
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
     
+    # Ingestion Configuration (background parse/embed/persist workers)
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2))
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 32))
+    PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', 0)) or None  # batch parsing processes, default = CPU count
+    PARSE_PAGES_PER_TASK = int(os.getenv('PARSE_PAGES_PER_TASK', 50))  # large PDFs are split into page ranges
+    
     # Vector Store Configuration
     VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH', 'data/vectorstore')
     EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 32))
+    EMBED_THREADS = int(os.getenv('EMBED_THREADS', 0))  # torch intra-op threads, 0 = torch default (all cores)
+    EMBED_PROCESSES = int(os.getenv('EMBED_PROCESSES', 0))  # >1 embeds on a process pool (one model copy per process)
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
     
@@ -33,14 +42,85 @@ class Config:
     LOCAL_LLM_ENDPOINT = os.getenv('LOCAL_LLM_ENDPOINT', 'http://localhost:1234/v1/chat/completions')
     LOCAL_MODEL_NAME = os.getenv('LOCAL_MODEL_NAME', 'phi-2')
     
+    # Local LLM HTTP client (pooled, with retries)
+    LOCAL_LLM_POOL_SIZE = int(os.getenv('LOCAL_LLM_POOL_SIZE', 10))
+    LOCAL_LLM_CONNECT_TIMEOUT = float(os.getenv('LOCAL_LLM_CONNECT_TIMEOUT', 3.05))  # seconds
+    LOCAL_LLM_READ_TIMEOUT = float(os.getenv('LOCAL_LLM_READ_TIMEOUT', 30))  # seconds between bytes
+    LOCAL_LLM_MAX_RETRIES = int(os.getenv('LOCAL_LLM_MAX_RETRIES', 2))
+    LOCAL_LLM_BACKOFF = float(os.getenv('LOCAL_LLM_BACKOFF', 0.25))  # base of the jittered exponential backoff
+    
+    # LLM Admission Control (per provider: concurrent generations, then a bounded priority queue, then 503)
+    LOCAL_LLM_MAX_CONCURRENCY = int(os.getenv('LOCAL_LLM_MAX_CONCURRENCY', 2))
+    LOCAL_LLM_QUEUE_SIZE = int(os.getenv('LOCAL_LLM_QUEUE_SIZE', 16))
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 16))
+    GEMINI_QUEUE_SIZE = int(os.getenv('GEMINI_QUEUE_SIZE', 64))
+    LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 15))  # seconds a request may wait for a slot
+    
+    # LLM Routing (fallback to the other provider, circuit breaker, hedged requests)
+    LLM_FALLBACK_TO_LOCAL = os.getenv('LLM_FALLBACK_TO_LOCAL', 'true').lower() == 'true'  # Gemini -> LM Studio
+    LLM_FALLBACK_TO_GEMINI = os.getenv('LLM_FALLBACK_TO_GEMINI', 'false').lower() == 'true'  # LM Studio -> Gemini (sends local documents to the cloud)
+    FALLBACK_GEMINI_MODEL = os.getenv('FALLBACK_GEMINI_MODEL', 'gemini-pro')  # used when the local LLM falls back to Gemini
+    LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'false').lower() == 'true'
+    LLM_HEDGE_INITIAL_DELAY = float(os.getenv('LLM_HEDGE_INITIAL_DELAY', 5))  # seconds, until enough latency samples exist
+    LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))  # floor of the p95-based hedge delay
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+    LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', 3))  # consecutive failures that open the circuit
+    LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', 30))  # seconds before an open circuit lets a trial through
+    
+    # Health Monitor (/vectorstore-status serves the last background check results)
+    HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 10))  # seconds between provider probes
+    HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', 2))  # seconds, LM Studio probe
+    
     # RAG Configuration
     MAX_RETRIEVAL_DOCS = 3
-    TEMPERATURE = 0.7
-    MAX_TOKENS = 1000
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 10))  # chunks sent to the LLM after hybrid fusion
+    HYBRID_ALPHA = float(os.getenv('HYBRID_ALPHA', 0.5))  # 1.0 = dense only, 0.0 = keyword only
+    RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', 8))  # asgi.py: thread pool for retrieval and store calls
+    TEMPERATURE = float(os.getenv('TEMPERATURE', 0.7))
+    MAX_TOKENS = int(os.getenv('MAX_TOKENS', 1000))
+    GEMINI_MODELS_TTL = int(os.getenv('GEMINI_MODELS_TTL', 300))  # seconds /gemini-models reuses the model list
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 6000))  # max tokens of document context per prompt
+    CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', 3.0))  # token estimate for Vietnamese text
+    LOCAL_CONTEXT_WINDOW = int(os.getenv('LOCAL_CONTEXT_WINDOW', 4096))  # context window of the LM Studio model
+    
+    # Re-ranking Configuration (cross-encoder over the RETRIEVAL_TOP_K fused hits)
+    RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+    RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')  # multilingual
+    RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', 4))  # chunks kept for the prompt
+    RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', 32))
+    RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', 4096))  # cached (query, chunk) scores
+    
+    # Vector Index Configuration
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')  # chroma | faiss
+    FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')  # flat | sq8 | pq | ivfpq | hnsw
+    FAISS_RERANK_FACTOR = int(os.getenv('FAISS_RERANK_FACTOR', 10))  # sq8/pq/ivfpq: candidates re-ranked exactly = k * factor
+    FAISS_NLIST = int(os.getenv('FAISS_NLIST', 1024))  # IVF clusters
+    FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 64))  # PQ sub-quantizers (must divide the embedding dimension)
+    FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', 16))  # IVF clusters scanned per query
+    FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))  # HNSW graph degree
+    FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', 64))  # HNSW search breadth
+    
+    # Query Embedding Configuration
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))  # in-process LRU of query vectors
+    WARM_UP = os.getenv('WARM_UP', 'true').lower() == 'true'  # dummy encode + query at startup
+    PRELOAD = os.getenv('PRELOAD', 'true').lower() == 'true'  # load model/store in a background thread at startup
+    
+    # Answer Cache Configuration
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 512))
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))  # seconds
+    # Cosine threshold of the semantic tier, on the vector store's embeddings (intfloat/multilingual-e5-large).
+    # e5 scores even unrelated questions ~0.7-0.8 and one-word variants in the mid 0.9s, so only near-identical
+    # wording may hit; re-tune this when the embedding model changes
+    ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', 0.99))
     
     # UI Configuration
     THEME_DEFAULT = 'light'
-    CHAT_HISTORY_LIMIT = 50
+    CHAT_HISTORY_LIMIT = int(os.getenv('CHAT_HISTORY_LIMIT', 50))  # turns kept per conversation
+    
+    # Chat History Configuration (server-side; the session cookie only holds the conversation id)
+    CHAT_HISTORY_DB = os.getenv('CHAT_HISTORY_DB', 'data/chat_history.sqlite3')
+    CHAT_HISTORY_RETENTION_DAYS = float(os.getenv('CHAT_HISTORY_RETENTION_DAYS', 30))  # 0 = keep forever
+    CHAT_HISTORY_PROMPT_TURNS = int(os.getenv('CHAT_HISTORY_PROMPT_TURNS', 10))  # recent turns passed to the LLM
     
     @classmethod
     def validate(cls):
@@ -5,11 +5,12 @@ A Flask-based web application for RAG (Retrieval-Augmented Generation) chatbot
 
 import os
 import json
+import hashlib
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, session, send_from_directory, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from langchain.schema import Document
 import shutil
 import re
 import requests
@@ -18,8 +19,17 @@ import time
 import uuid
 
 from backend.llm_provider import LLMProvider
+from backend.admission import OverloadedError
+from backend.llm_router import LLMRouter
+from backend.health import HealthMonitor
 from backend.document_loader import DocumentLoader
-from backend.vector_store import VectorStore
+from backend.ingestion import IngestionQueue, QueueFullError
+from backend.answer_cache import AnswerCache, normalize_question
+from backend.chat_history import ChatHistoryStore
+from backend.single_flight import SingleFlight, AsyncSingleFlight
+from backend.lazy import LazyComponent, preload
+from backend.http_client import local_llm_client, local_llm_async_client, async_client_started
+from config import Config
 
 # Load environment variables
 load_dotenv()
@@ -28,55 +38,109 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
-
 # Configuration
 UPLOAD_FOLDER = 'data/uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'docx'}
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
-
-# Ensure upload directory exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# Initialize components
-vector_store = VectorStore()
-document_loader = DocumentLoader()
-llm_provider = LLMProvider()
-
-processing_status = {}  # doc_id: {"progress": float, "status": str, "error": str}
+bp = Blueprint('main', __name__)
+
+def build_vector_store():
+    """Load the embedding model and open Chroma (slow: done lazily or by the preload thread)"""
+    from backend.vector_store import VectorStore
+    store = VectorStore()
+    # Câu trả lời dựa trên file vừa được cập nhật/xóa sẽ bị loại khỏi cache
+    store.add_change_listener(answer_cache.invalidate_sources)
+    # Số chunk/nguồn trong /vectorstore-status được cập nhật ngay sau mỗi lần ghi
+    store.add_change_listener(lambda sources: health_monitor.refresh('store'))
+    # Chạy thử model embedding và Chroma một lần để request đầu tiên không bị chậm
+    if Config.WARM_UP:
+        store.warm_up()
+    return store
+
+def build_reranker():
+    """Load the cross-encoder used to re-rank retrieved chunks"""
+    from backend.reranker import CrossEncoderReranker
+    reranker = CrossEncoderReranker(
+        Config.RERANK_MODEL,
+        top_n=Config.RERANK_TOP_N,
+        batch_size=Config.RERANK_BATCH_SIZE,
+        cache_size=Config.RERANK_CACHE_SIZE
+    )
+    if Config.WARM_UP:
+        reranker.warm_up()
+    return reranker
+
+def build_llm_router():
+    """Fallback / hedging layer over the LLM provider"""
+    return LLMRouter(
+        llm_provider.resolve(),
+        fallback_to_local=Config.LLM_FALLBACK_TO_LOCAL,
+        fallback_to_gemini=Config.LLM_FALLBACK_TO_GEMINI,
+        hedging=Config.LLM_HEDGING_ENABLED,
+        fallback_gemini_model=Config.FALLBACK_GEMINI_MODEL,
+        hedge_initial_delay=Config.LLM_HEDGE_INITIAL_DELAY,
+        hedge_min_delay=Config.LLM_HEDGE_MIN_DELAY,
+        hedge_min_samples=Config.LLM_HEDGE_MIN_SAMPLES,
+        failure_threshold=Config.LLM_BREAKER_FAILURES,
+        reset_seconds=Config.LLM_BREAKER_RESET
+    )
+
+def build_chat_store():
+    """Open the chat history database (prunes expired conversations)"""
+    return ChatHistoryStore(
+        Config.CHAT_HISTORY_DB,
+        max_turns=Config.CHAT_HISTORY_LIMIT,
+        retention_days=Config.CHAT_HISTORY_RETENTION_DAYS
+    )
+
+def build_ingestion_queue():
+    """Start ingestion workers; the store and loader behind them stay lazy"""
+    return IngestionQueue(
+        document_loader,
+        vector_store,
+        num_workers=Config.INGEST_WORKERS,
+        max_queued=Config.INGEST_QUEUE_SIZE,
+        parse_workers=Config.PARSE_WORKERS,
+        pages_per_task=Config.PARSE_PAGES_PER_TASK
+    )
+
+# Initialize components (lazily: built on first use or by the background preload)
+answer_cache = AnswerCache(
+    max_entries=Config.ANSWER_CACHE_SIZE,
+    ttl_seconds=Config.ANSWER_CACHE_TTL,
+    similarity_threshold=Config.ANSWER_CACHE_SIMILARITY
+)
+# Gộp các request giống nhau đang chạy đồng thời (WSGI: threads, asgi.py: event loop)
+request_flight = SingleFlight()
+async_request_flight = AsyncSingleFlight()
+vector_store = LazyComponent('vector_store', build_vector_store)
+document_loader = LazyComponent('document_loader', DocumentLoader)
+llm_provider = LazyComponent('llm_provider', LLMProvider)
+llm_router = LazyComponent('llm_router', build_llm_router)
+ingestion_queue = LazyComponent('ingestion_queue', build_ingestion_queue)
+reranker = LazyComponent('reranker', build_reranker)
+chat_store = LazyComponent('chat_store', build_chat_store)
+
+# Từ khóa cố định luôn được thêm vào truy vấn BM25
+EXTRA_KEYWORDS = ['208HV', 'NMLD']
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Main page"""
     return render_template('index.html')
 
-@app.route('/test')
+@bp.route('/test')
 def test():
     """Test upload page"""
     return render_template('test_upload.html')
 
-def process_document(doc_id, file_path):
-    try:
-        total_chunks = 100  # Giả lập, thực tế là số chunk thực tế
-        for i in range(total_chunks):
-            time.sleep(0.05)  # Giả lập thời gian xử lý mỗi chunk
-            processing_status[doc_id]['progress'] = (i + 1) / total_chunks
-        processing_status[doc_id]['progress'] = 1.0
-        processing_status[doc_id]['status'] = 'done'
-    except Exception as e:
-        processing_status[doc_id]['status'] = 'error'
-        processing_status[doc_id]['error'] = str(e)
-
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and process for RAG"""
     try:
@@ -99,124 +163,372 @@ def upload_file():
         
         # Save file
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        # Nếu file trùng tên, xóa chunk cũ trong vector store trước khi thêm mới
-        vector_store.delete_document(filename)
-
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         logger.info(f"File saved to: {filepath}")
         
-        # Process document and add to vector store
-        logger.info("Processing document...")
-        documents = document_loader.load_document(filepath)
-        logger.info(f"Document loader returned: {len(documents) if documents else 0} documents")
-        
-        if documents:
-            logger.info(f"Loaded {len(documents)} document chunks")
-            logger.info("Adding documents to vector store...")
-            success = vector_store.add_documents(documents)
-            logger.info(f"Add documents result: {success}")
-            
-            if success:
-                logger.info("Documents added to vector store successfully")
-                doc_id = str(uuid.uuid4())
-                processing_status[doc_id] = {"progress": 0.0, "status": "processing"}
-                threading.Thread(target=process_document, args=(doc_id, filepath)).start()
-                return jsonify({
-                    'success': True,
-                    'message': f'File {filename} uploaded and processed successfully ({len(documents)} chunks)',
-                    'filename': filename,
-                    'doc_id': doc_id,
-                    'processing': True
-                })
-            else:
-                logger.error("Failed to add documents to vector store")
-                return jsonify({'error': 'Failed to add documents to vector store'}), 500
-        else:
-            logger.error("No documents loaded from file")
-            return jsonify({'error': 'Failed to process document - no content extracted'}), 500
+        # Parse, embed and persist in the background; the client polls /processing-status
+        try:
+            job = ingestion_queue.submit(filename, filepath)
+        except QueueFullError as e:
+            logger.warning(f"Ingestion queue full, rejecting {filename}")
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '10'
+            return response, 503
+        logger.info(f"Queued {filename} for ingestion (doc_id={job.doc_id})")
+        return jsonify({
+            'success': True,
+            'message': f'File {filename} uploaded, processing in background',
+            'filename': filename,
+            'doc_id': job.doc_id,
+            'processing': True
+        })
     
     except Exception as e:
         logger.error(f"Upload error: {str(e)}", exc_info=True)
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
-@app.route('/processing-status')
+@bp.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    """Upload many files at once; they are parsed in parallel and ingested in the background"""
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+        
+        saved = {}
+        rejected = []
+        for file in files:
+            if file.filename == '' or not allowed_file(file.filename):
+                rejected.append({'filename': file.filename, 'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'})
+                continue
+            filename = secure_filename(file.filename)
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+            file.save(filepath)
+            saved[filename] = filepath
+        
+        if not saved:
+            return jsonify({'error': 'No valid files provided', 'rejected': rejected}), 400
+        
+        try:
+            batch = ingestion_queue.submit_batch(list(saved.items()))
+        except QueueFullError as e:
+            logger.warning("Ingestion queue full, rejecting batch upload")
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '10'
+            return response, 503
+        logger.info(f"Queued batch of {len(saved)} files for ingestion (doc_id={batch.doc_id})")
+        return jsonify({
+            'success': True,
+            'message': f'{len(saved)} files uploaded, processing in background',
+            'doc_id': batch.doc_id,
+            'files': [{'filename': job.filename, 'doc_id': job.doc_id} for job in batch.children],
+            'rejected': rejected,
+            'processing': True
+        })
+    except Exception as e:
+        logger.error(f"Batch upload error: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@bp.route('/processing-status')
 def processing_status_api():
+    """Get ingestion progress of an uploaded document (parsed pages, chunks embedded/persisted)"""
     doc_id = request.args.get('doc_id')
-    status = processing_status.get(doc_id)
-    if not status:
+    job = ingestion_queue.get(doc_id)
+    if not job:
         return jsonify({"progress": 1.0, "status": "done"})
-    return jsonify(status)
+    return jsonify(job.to_dict())
+
+def retrieve_documents(user_message):
+    """Truy xuất kết hợp (embedding + BM25, hợp nhất bằng RRF), giới hạn top-k"""
+    hits = vector_store.hybrid_search(
+        user_message,
+        k=Config.RETRIEVAL_TOP_K,
+        alpha=Config.HYBRID_ALPHA,
+        extra_keywords=EXTRA_KEYWORDS
+    )
+    if Config.RERANK_ENABLED and hits:
+        # Cross-encoder chấm lại các ứng viên, chỉ giữ RERANK_TOP_N chunk tốt nhất
+        try:
+            hits = reranker.rerank(user_message, [doc for doc, _score in hits])
+        except Exception as e:
+            logger.warning(f"Re-ranking failed, using fused ranking: {str(e)}")
+    # Điểm đi kèm từng chunk để bộ đóng gói ngữ cảnh xếp hạng (bản sao, không sửa chỉ mục BM25)
+    return [Document(page_content=doc.page_content, metadata={**doc.metadata, 'score': score}) for doc, score in hits]
+
+def list_sources(relevant_docs):
+    """Danh sách file nguồn (không trùng lặp) của các chunk đã dùng"""
+    return sorted(list({doc.metadata.get('source', 'Unknown') for doc in relevant_docs}))
+
+def chunk_ids_of(relevant_docs):
+    """Chunk id của các đoạn đã truy xuất (khóa của tầng cache chính xác)"""
+    return [doc.metadata.get('id') for doc in relevant_docs]
+
+def conversation_id():
+    """Id hội thoại trong session (cookie chỉ chứa id, lịch sử lưu ở server)"""
+    if 'conversation_id' not in session:
+        session['conversation_id'] = ChatHistoryStore.new_conversation_id()
+        # Bỏ lịch sử cũ còn nằm trong cookie (trước khi lưu ở server)
+        session.pop('chat_history', None)
+    return session['conversation_id']
+
+def chat_model_key(data):
+    """Khóa model cho answer cache: '<model_type>:<model_name>'"""
+    model_type = data.get('model_type', 'gemini')
+    return f"{model_type}:{data.get('model_name') if model_type == 'local' else data.get('model_name', 'gemini-pro')}"
+
+def overloaded_response(error):
+    """503 with Retry-After when the LLM provider sheds the request"""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+def chat_lookup(user_message, model_key, chat_history=None):
+    """Cache ngữ nghĩa -> truy xuất -> cache chính xác.
+
+    Lịch sử hội thoại nằm trong prompt nên là một phần của khóa cache.
+    Trả về (entry hoặc None, relevant_docs, chunk_ids, sources, query_embedding).
+    """
+    history = history_digest(chat_history)
+    relevant_docs, chunk_ids, sources = [], [], []
+    cached, query_embedding = lookup_semantic_cache(user_message, model_key, history)
+    if cached is None:
+        relevant_docs = retrieve_documents(user_message)
+        chunk_ids = chunk_ids_of(relevant_docs)
+        sources = list_sources(relevant_docs)
+        cached = answer_cache.get_exact(user_message, model_key, chunk_ids, history)
+    return cached, relevant_docs, chunk_ids, sources, query_embedding
+
+def history_digest(chat_history):
+    """Hash of the turns that go into the prompt ('' for a new conversation)"""
+    if not chat_history:
+        return ''
+    turns = [(turn.get('user', ''), turn.get('assistant', '')) for turn in chat_history]
+    return hashlib.sha1(json.dumps(turns, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def flight_key(kind, user_message, model_key, chunk_ids=(), chat_history=None):
+    """Khóa single-flight: (loại, câu hỏi chuẩn hóa, model, tập chunk id, lịch sử hội thoại).
+    
+    Lịch sử nằm trong prompt, nên hai hội thoại khác nhau không bao giờ dùng chung một câu trả lời.
+    """
+    return (kind, normalize_question(user_message), model_key,
+            frozenset(chunk_id for chunk_id in chunk_ids if chunk_id), history_digest(chat_history))
+
+def local_models_url():
+    """URL /v1/models của LM Studio (suy ra từ LOCAL_LLM_ENDPOINT)"""
+    lmstudio_url = os.getenv('LOCAL_LLM_ENDPOINT', 'http://127.0.0.1:1234/v1/chat/completions')
+    # Lấy host từ endpoint
+    if '/v1/chat/completions' in lmstudio_url:
+        base_url = lmstudio_url.split('/v1/chat/completions')[0]
+    else:
+        base_url = 'http://127.0.0.1:1234'
+    return base_url + '/v1/models'
+
+def check_store():
+    """Health check: chunk and source counts from the manifest counters (O(1), no index call)"""
+    if not vector_store.is_ready:
+        # Không tự nạp model embedding chỉ để kiểm tra trạng thái
+        return {'ok': False, 'loading': True}
+    return vector_store.counts()
+
+def check_local_llm():
+    """Health check: LM Studio answers /v1/models (no retries)"""
+    resp = local_llm_client().get(local_models_url(), timeout=Config.HEALTH_PROBE_TIMEOUT, retries=0)
+    result = {'ok': resp.status_code == 200}
+    if llm_router.is_ready:
+        result['circuit'] = llm_router.health['local'].breaker.state
+    return result
+
+def check_gemini():
+    """Health check: API key configured and circuit not open (no billable call)"""
+    result = {'ok': llm_provider.gemini_api_key is not None}
+    if llm_router.is_ready:
+        result['circuit'] = llm_router.health['gemini'].breaker.state
+        result['ok'] = result['ok'] and result['circuit'] != 'open'
+    return result
+
+def vectorstore_status_payload():
+    """/vectorstore-status body built from the cached health snapshot (constant cost)"""
+    snapshot = health_monitor.snapshot()
+    checks = snapshot['checks']
+    store = checks.get('store', {})
+    return {
+        'db_connected': store.get('ok', False),
+        'total_documents': store.get('unique_sources', 0),
+        'total_chunks': store.get('total_chunks', 0),
+        'unique_sources': store.get('unique_sources', 0),
+        'model_status': {
+            'gemini': checks.get('gemini', {}).get('ok', False),
+            'local': checks.get('local_llm', {}).get('ok', False)
+        },
+        'checked_at': snapshot['generated_at'],
+        'checks': checks
+    }
+
+# Trạng thái được làm mới ở thread nền; /vectorstore-status chỉ đọc snapshot
+health_monitor = HealthMonitor(
+    {'store': check_store, 'local_llm': check_local_llm, 'gemini': check_gemini},
+    interval=Config.HEALTH_CHECK_INTERVAL
+)
+
+def lookup_semantic_cache(user_message, model_key, history=''):
+    """Tầng cache ngữ nghĩa: trả về (entry hoặc None, embedding của câu hỏi)"""
+    try:
+        query_embedding = vector_store.embed_query(user_message)
+    except Exception as e:
+        logger.warning(f"Query embedding for answer cache failed: {str(e)}")
+        return None, None
+    return answer_cache.get_semantic(query_embedding, model_key, user_message, history), query_embedding
 
-@app.route('/chat', methods=['POST'])
+@bp.route('/chat', methods=['POST'])
 def chat():
     """Handle chat requests with RAG"""
     try:
         data = request.get_json()
         user_message = data.get('message', '')
         model_type = data.get('model_type', 'gemini')  # 'gemini' or 'local'
-        model_name = data.get('model_name', 'gemini-pro')
+        model_name = data.get('model_name')  # None: default model of the provider
         
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
         
-        # Retrieve relevant documents (embedding search)
-        relevant_docs = vector_store.search(user_message, k=10)
-        
-        # Tìm thêm các chunk chứa từ khóa đặc biệt trong câu hỏi
-        keywords = re.findall(r'\b\w{3,}\b', user_message)
-        keywords += ['208HV', 'NMLD']  # Thêm các từ khóa cố định nếu muốn
-        keywords = list(set([k.lower() for k in keywords]))
-        all_docs = vector_store.get_document_list()
-        extra_docs = []
-        for doc in all_docs:
-            content = doc.get('content_preview', '').lower()
-            if any(kw in content for kw in keywords):
-                extra_docs.append(doc)
-        # Chuyển extra_docs sang dạng Document nếu cần
-        # Loại bỏ trùng lặp theo id
-        doc_ids = set(d.metadata.get('id') for d in relevant_docs)
-        for d in extra_docs:
-            if d['id'] not in doc_ids:
-                from langchain.schema import Document
-                relevant_docs.append(Document(page_content=d['content_preview'], metadata=d['metadata']))
-        # Lấy 10 lượt hội thoại gần nhất
-        chat_history = session.get('chat_history', [])[-10:]
-        # Generate response using selected LLM, truyền history
-        if model_type == 'local':
-            response = llm_provider.generate_local_response(user_message, relevant_docs, chat_history=chat_history, model_name=data.get('model_name'))
+        model_key = chat_model_key(data)
+        # Lấy các lượt hội thoại gần nhất (cũng là một phần của khóa cache)
+        chat_history = chat_store.recent(conversation_id(), Config.CHAT_HISTORY_PROMPT_TURNS)
+        # Câu hỏi giống nhau gửi đồng thời chỉ truy xuất một lần
+        cached, relevant_docs, chunk_ids, sources, query_embedding = request_flight.do(
+            flight_key('lookup', user_message, model_key, chat_history=chat_history),
+            lambda: chat_lookup(user_message, model_key, chat_history)
+        )
+        context = route = None
+        if cached is not None:
+            response, sources = cached['answer'], cached['sources']
         else:
-            response = llm_provider.generate_gemini_response(user_message, relevant_docs, model_name=model_name, chat_history=chat_history)
-        # Store chat history in session
-        if 'chat_history' not in session:
-            session['chat_history'] = []
-        session['chat_history'].append({
-            'user': user_message,
-            'assistant': response,
-            'timestamp': datetime.now().isoformat()
-        })
+            def generate():
+                # Generate response using selected LLM (lỗi/chậm thì chuyển sang provider còn lại), truyền history
+                answer = llm_router.complete(user_message, relevant_docs, chat_history=chat_history, model_type=model_type, model_name=model_name)
+                return answer, llm_provider.context_stats(), llm_router.last_route()
+            
+            # ... và cùng ngữ cảnh thì chỉ gọi LLM một lần, các request khác chờ kết quả
+            response, context, route = request_flight.do(flight_key('generate', user_message, model_key, chunk_ids, chat_history), generate)
+            if response.startswith('Error'):
+                context = route = None
+            elif not route['fallback']:
+                # Câu trả lời từ provider dự phòng không được cache dưới model đã chọn
+                answer_cache.put(user_message, model_key, chunk_ids, sources, response, query_embedding, history_digest(chat_history))
+        chat_store.append(conversation_id(), user_message, response)
         return jsonify({
             'response': response,
-            'sources': sorted(list({doc.metadata.get('source', 'Unknown') for doc in relevant_docs}))
+            'sources': sources,
+            'cached': cached is not None,
+            'context': context,
+            'provider': route
         })
+    except OverloadedError as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Chat error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/documents', methods=['GET'])
+def sse_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream chat response tokens via Server-Sent Events (events: delta, done, error)"""
+    try:
+        data = request.get_json()
+        user_message = data.get('message', '')
+        model_type = data.get('model_type', 'gemini')  # 'gemini' or 'local'
+        model_name = data.get('model_name')  # None: default model of the provider
+        
+        if not user_message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        model_key = chat_model_key(data)
+        chat_history = chat_store.recent(conversation_id(), Config.CHAT_HISTORY_PROMPT_TURNS)
+        cached, relevant_docs, chunk_ids, sources, query_embedding = request_flight.do(
+            flight_key('lookup', user_message, model_key, chat_history=chat_history),
+            lambda: chat_lookup(user_message, model_key, chat_history)
+        )
+        if cached is not None:
+            # Cache hit: gửi toàn bộ câu trả lời trong một delta
+            sources = cached['sources']
+            events = iter([{'html': cached['answer'], 'pending': ''}])
+        else:
+            # Header chưa gửi: nếu hàng đợi LLM đã đầy thì trả 503 ngay thay vì mở stream
+            llm_router.check(model_type)
+            
+            def open_events():
+                yield from llm_router.stream(user_message, relevant_docs, chat_history=chat_history, model_type=model_type, model_name=model_name)
+                # Thống kê ngữ cảnh và provider đã trả lời đo trong thread sinh câu trả lời, gửi kèm cho mọi request đang chờ
+                yield {'context': llm_provider.context_stats(), 'provider': llm_router.last_route()}
+            
+            # Các request trùng nhau nhận cùng một luồng token
+            events = request_flight.stream(flight_key('stream', user_message, model_key, chunk_ids, chat_history), open_events)
+        
+        # Id hội thoại phải có trong cookie trước khi stream (header đã gửi đi);
+        # câu hỏi được lưu ngay, câu trả lời được ghi khi stream kết thúc
+        turn_id = chat_store.append(conversation_id(), user_message)
+        
+        def generate():
+            parts = []
+            failed = False
+            saved = False
+            pending = ''
+            context_stats = route = None
+            try:
+                for event in events:
+                    if 'html' not in event:
+                        context_stats, route = event.get('context'), event.get('provider')
+                        continue
+                    parts.append(event['html'])
+                    pending = event.get('pending', '')
+                    failed = failed or event.get('error', False)
+                    yield sse_event('delta', event)
+                response = ''.join(parts)
+                chat_store.set_assistant(turn_id, response)
+                saved = True
+                context = provider = None
+                if cached is None and response and not failed:
+                    if not route['fallback']:
+                        answer_cache.put(user_message, model_key, chunk_ids, sources, response, query_embedding, history_digest(chat_history))
+                    context, provider = context_stats, route
+                yield sse_event('done', {'response': response, 'sources': sources, 'cached': cached is not None, 'context': context, 'provider': provider})
+            except Exception as e:
+                logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+                yield sse_event('error', {'error': str(e)})
+            finally:
+                # Client ngắt kết nối giữa chừng (GeneratorExit) hoặc lỗi: vẫn lưu phần câu trả lời client đã hiển thị
+                if not saved:
+                    chat_store.set_assistant(turn_id, ''.join(parts) + pending)
+                # Rời luồng token chung ngay: khi không còn ai đọc, upstream dừng và trả slot LLM
+                if hasattr(events, 'close'):
+                    events.close()
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except OverloadedError as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/documents', methods=['GET'])
 def get_documents():
     """Get list of unique uploaded documents"""
     try:
-        documents = vector_store.get_document_list()
-        # Lấy danh sách tên file duy nhất
-        unique_sources = list({doc['source'] for doc in documents})
-        return jsonify({'documents': [{'source': s} for s in unique_sources]})
+        # Danh sách file duy nhất kèm số chunk, lấy từ manifest (không quét toàn bộ collection)
+        return jsonify({'documents': vector_store.list_sources()})
     except Exception as e:
         logger.error(f"Get documents error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/vector-debug', methods=['GET'])
+@bp.route('/vector-debug', methods=['GET'])
 def vector_debug():
     """Trả về toàn bộ dữ liệu vector store để debug (chỉ dùng cho phát triển)"""
     try:
@@ -226,43 +538,42 @@ def vector_debug():
         logger.error(f"Vector debug error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/history', methods=['GET'])
+@bp.route('/history', methods=['GET'])
 def get_chat_history():
-    """Get chat history"""
+    """Get chat history, newest first (?limit=20&before=<turn id> for the next page)"""
     try:
-        history = session.get('chat_history', [])
-        return jsonify({'history': history})
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        before = request.args.get('before', type=int)
+        if 'conversation_id' not in session:
+            return jsonify({'history': [], 'next_before': None})
+        return jsonify(chat_store.page(session['conversation_id'], limit=limit, before=before))
     except Exception as e:
         logger.error(f"Get history error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/clear-history', methods=['POST'])
+@bp.route('/clear-history', methods=['POST'])
 def clear_history():
     """Clear chat history"""
     try:
-        session.pop('chat_history', None)
+        if 'conversation_id' in session:
+            chat_store.clear(session.pop('conversation_id'))
         return jsonify({'success': True, 'message': 'Chat history cleared'})
     except Exception as e:
         logger.error(f"Clear history error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/gemini-models', methods=['GET'])
+@bp.route('/gemini-models', methods=['GET'])
 def gemini_models():
     """Get available Gemini models from Google API"""
     try:
-        import google.generativeai as genai
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
+        if not llm_provider.gemini_api_key:
             return jsonify({'error': 'Google API key not configured'}), 400
-        genai.configure(api_key=api_key)
-        models = genai.list_models()
-        # Lọc các model text (không phải vision)
-        model_list = [m.name for m in models if 'vision' not in m.name]
-        return jsonify({'models': model_list})
+        # Danh sách model được cache (GEMINI_MODELS_TTL giây)
+        return jsonify({'models': llm_provider.gemini.list_models()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/clear-vectorstore', methods=['POST'])
+@bp.route('/clear-vectorstore', methods=['POST'])
 def clear_vectorstore():
     """Clear all documents from vector store"""
     try:
@@ -274,6 +585,7 @@ def clear_vectorstore():
         # Khởi tạo lại ChromaDB sau khi clear
         logger.info("Reinitializing vectorstore...")
         vector_store.reinitialize()
+        health_monitor.refresh('store')
         logger.info("Vectorstore reinitialized successfully")
         
         if success:
@@ -284,12 +596,12 @@ def clear_vectorstore():
         logger.error(f"Clear vectorstore error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/admin')
+@bp.route('/admin')
 def admin_dashboard():
     """Admin dashboard for managing vectorstore and documents"""
     return render_template('admin.html')
 
-@app.route('/delete-document', methods=['POST'])
+@bp.route('/delete-document', methods=['POST'])
 def delete_document():
     """Delete all chunks of a document by source filename"""
     try:
@@ -306,18 +618,18 @@ def delete_document():
         logger.error(f"Delete document error: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api-docs')
+@bp.route('/api-docs')
 def api_docs():
     return render_template('api_docs.html')
 
-@app.route('/api-list')
+@bp.route('/api-list')
 def api_list():
     endpoints = []
-    for rule in app.url_map.iter_rules():
+    for rule in current_app.url_map.iter_rules():
         if rule.endpoint == 'static':
             continue
         methods = list(rule.methods - {'HEAD', 'OPTIONS'})
-        doc = app.view_functions[rule.endpoint].__doc__
+        doc = current_app.view_functions[rule.endpoint].__doc__
         for m in methods:
             endpoints.append({
                 'method': m,
@@ -327,18 +639,11 @@ def api_list():
     endpoints = sorted(endpoints, key=lambda x: (x['path'], x['method']))
     return jsonify({'endpoints': endpoints})
 
-@app.route('/local-models', methods=['GET'])
+@bp.route('/local-models', methods=['GET'])
 def local_models():
     """Get available local LLM models from LM Studio API"""
     try:
-        lmstudio_url = os.getenv('LOCAL_LLM_ENDPOINT', 'http://127.0.0.1:1234/v1/chat/completions')
-        # Lấy host từ endpoint
-        if '/v1/chat/completions' in lmstudio_url:
-            base_url = lmstudio_url.split('/v1/chat/completions')[0]
-        else:
-            base_url = 'http://127.0.0.1:1234'
-        models_url = base_url + '/v1/models'
-        resp = requests.get(models_url, timeout=5)
+        resp = local_llm_client().get(local_models_url(), timeout=(Config.LOCAL_LLM_CONNECT_TIMEOUT, 5))
         if resp.status_code == 200:
             data = resp.json()
             # LM Studio trả về {'data': [ {id: model_name, ...}, ... ]}
@@ -349,40 +654,88 @@ def local_models():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/vectorstore-status', methods=['GET'])
+@bp.route('/vectorstore-status', methods=['GET'])
 def vectorstore_status():
-    """Get vectorstore and model status for UI"""
+    """Get vectorstore and model status for UI (cached snapshot with per-check timestamps)"""
     try:
-        # DB status
-        stats = vector_store.get_stats()
-        db_connected = not vector_store.is_empty() or stats.get('total_documents', 0) >= 0
-        # Model status
-        gemini_ok = llm_provider.gemini_api_key is not None
-        # Test local LLM connection (optional, fast check)
-        local_ok = False
-        try:
-            import requests
-            lmstudio_url = os.getenv('LOCAL_LLM_ENDPOINT', 'http://127.0.0.1:1234/v1/chat/completions')
-            resp = requests.get(lmstudio_url.replace('/v1/chat/completions','/v1/models'), timeout=2)
-            local_ok = resp.status_code == 200
-        except Exception:
-            local_ok = False
-        return jsonify({
-            'db_connected': db_connected,
-            'total_documents': stats.get('unique_sources', 0),
-            'total_chunks': stats.get('total_documents', 0),
-            'unique_sources': stats.get('unique_sources', 0),
-            'model_status': {
-                'gemini': gemini_ok,
-                'local': local_ok
-            }
-        })
+        return jsonify(vectorstore_status_payload())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/logoBSR.png')
+@bp.route('/logoBSR.png')
 def serve_logo():
     return send_from_directory('.', 'logoBSR.png')
 
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Request counts, retries and latency percentiles of outgoing LLM HTTP calls (plus LLM queue and routing, re-ranker and request-coalescing counters)"""
+    data = {'local_llm_http': local_llm_client().stats()}
+    if async_client_started():
+        data['local_llm_http_async'] = local_llm_async_client().stats()
+    if llm_provider.is_ready:
+        data['admission'] = llm_provider.admission_stats()
+    if llm_router.is_ready:
+        data['llm_router'] = llm_router.stats()
+    if reranker.is_ready:
+        data['reranker'] = reranker.stats()
+    data['single_flight'] = {'sync': request_flight.stats(), 'async': async_request_flight.stats()}
+    return jsonify(data)
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@bp.route('/readyz')
+def readyz():
+    """Readiness: embedding model, vector store and LLM provider are loaded"""
+    components = {component.name: component.describe() for component in (vector_store, document_loader, llm_provider)}
+    ready = all(component['ready'] for component in components.values())
+    return jsonify({'ready': ready, 'components': components}), 200 if ready else 503
+
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background(preload_components=None):
+    """Start the health monitor and, if preload_components (default Config.PRELOAD), load the model
+    in a background thread; runs once per process"""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    health_monitor.start()
+    if Config.PRELOAD if preload_components is None else preload_components:
+        # Flask nhận request ngay; model và Chroma được nạp ở thread nền, /readyz báo khi xong
+        components = [vector_store, document_loader, llm_provider, ingestion_queue]
+        if Config.RERANK_ENABLED:
+            components.append(reranker)
+        preload(components)
+
+@bp.before_app_request
+def ensure_background():
+    # WSGI server dùng main:app: nạp nền ở request đầu tiên của tiến trình phục vụ, không phải lúc import
+    if not _background_started:
+        start_background()
+
+def create_app():
+    """Application factory; nothing is loaded until start_background() or the first request"""
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    
+    # Ensure upload directory exists
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    
+    app.register_blueprint(bp)
+    return app
+
+# Import (asgi.py, reloader, worker processes) không nạp model hay khởi động thread nào
+app = create_app()
+
 if __name__ == '__main__':
+    # Với reloader, tiến trình cha chỉ theo dõi file; chỉ tiến trình phục vụ (WERKZEUG_RUN_MAIN) nạp model
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background()
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -85,17 +85,22 @@ async function sendChatMessage() {
             payload.model_name = document.getElementById('localModelSelect').value;
         }
         
-        const response = await fetch('/chat', {
+        const response = await fetch('/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
         });
-        const data = await response.json();
+        const contentType = response.headers.get('Content-Type') || '';
         
-        if (data.error) {
-            addMessage(`Error: ${data.error}`, 'ai');
+        if (!response.body || !contentType.startsWith('text/event-stream')) {
+            const data = await response.json();
+            if (data.error) {
+                addMessage(`Error: ${data.error}`, 'ai');
+            } else {
+                addMessage(data.response, 'ai', data.sources);
+            }
         } else {
-            addMessage(data.response, 'ai', data.sources);
+            await readChatStream(response);
         }
     } catch (error) {
         addMessage(`Error: ${error.message}`, 'ai');
@@ -106,6 +111,65 @@ async function sendChatMessage() {
     }
 }
 
+// Đọc phản hồi SSE từ /chat/stream và hiển thị dần từng token
+async function readChatStream(response) {
+    const loading = document.getElementById('loading');
+    const chatMessages = document.getElementById('chatMessages');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let committed = '';
+    let bubble = null;
+    
+    const render = (pending = '') => {
+        if (!bubble) {
+            loading.classList.remove('show');
+            bubble = addMessage('', 'ai');
+        }
+        bubble.innerHTML = committed + pending;
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const raw = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let dataLine = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLine += line.slice(5).trim();
+            });
+            if (!dataLine) continue;
+            const data = JSON.parse(dataLine);
+            if (event === 'delta') {
+                committed += data.html;
+                render(data.pending);
+            } else if (event === 'done') {
+                committed = data.response;
+                render();
+                appendSources(bubble, data.sources);
+            } else if (event === 'error') {
+                committed += `<br>Error: ${data.error}`;
+                render();
+            }
+        }
+    }
+}
+
+function appendSources(bubble, sources) {
+    if (sources && sources.length > 0) {
+        const sourcesDiv = document.createElement('div');
+        sourcesDiv.className = 'sources';
+        sourcesDiv.innerHTML = `<span class="icon">📄</span> ${sources.map(s => `<span title="${s}">${s}</span>`).join(', ')}`;
+        bubble.appendChild(sourcesDiv);
+    }
+}
+
 function addMessage(content, sender, sources = null) {
     const chatMessages = document.getElementById('chatMessages');
     const messageDiv = document.createElement('div');
@@ -125,19 +189,22 @@ function addMessage(content, sender, sources = null) {
     const bubble = document.createElement('div');
     bubble.className = 'bubble';
     bubble.innerHTML = content;
-    
-    if (sources && sources.length > 0) {
-        const sourcesDiv = document.createElement('div');
-        sourcesDiv.className = 'sources';
-        sourcesDiv.innerHTML = `<span class="icon">📄</span> ${sources.map(s => `<span title="${s}">${s}</span>`).join(', ')}`;
-        bubble.appendChild(sourcesDiv);
-    }
+    appendSources(bubble, sources);
     
     messageDiv.appendChild(avatar);
     messageDiv.appendChild(bubble);
     
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return bubble;
+}
+
+// Mô tả giai đoạn xử lý thực tế (trang đã đọc, chunk đã embed/lưu)
+function describeIngestStage(data) {
+    if (data.stage === 'queued') return ' · đang chờ';
+    if (data.stage === 'parsing') return ` · đọc trang ${data.pages_parsed}/${data.pages_total}`;
+    if (data.stage === 'embedding') return ` · embed ${data.chunks_embedded}/${data.chunks_total}, lưu ${data.chunks_persisted}/${data.chunks_total} chunk`;
+    return '';
 }
 
 async function pollChunkingProgress(doc_id) {
@@ -159,14 +226,15 @@ async function pollChunkingProgress(doc_id) {
             const data = await res.json();
             const percent = Math.round((data.progress || 0) * 100);
             progressBar.style.width = percent + '%';
-            progressLabel.textContent = percent + '%';
+            progressLabel.textContent = percent + '%' + describeIngestStage(data);
             if (data.status === 'done' || percent >= 100) {
                 polling = false;
                 window.onbeforeunload = null;
                 progressBar.style.width = '100%';
                 progressLabel.textContent = '100%';
                 setTimeout(() => { progressContainer.style.display = 'none'; }, 800);
-                showNotification('Xử lý tài liệu thành công!', 'success');
+                const r = data.result;
+                showNotification('Xử lý tài liệu thành công!' + (r ? ` (+${r.added} mới, -${r.removed} đã xóa, ${r.unchanged} không đổi)` : ''), 'success');
                 loadDocuments();
                 break;
             }
@@ -15,6 +15,55 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from backend.document_loader import DocumentLoader
 from backend.vector_store import VectorStore
 from backend.llm_provider import LLMProvider
+from backend.keyword_index import KeywordIndex
+from backend.embedding_cache import EmbeddingCache, CachedEmbeddings
+from backend.ingestion import IngestionQueue
+from backend.answer_cache import AnswerCache
+from backend.index_backends import FaissBackend
+from backend.http_client import HTTPClient
+from backend.context_packer import ContextPacker
+from backend.reranker import CrossEncoderReranker
+from backend.chat_history import ChatHistoryStore
+from backend.single_flight import SingleFlight
+from backend.admission import AdmissionController, OverloadedError, INTERACTIVE, BACKGROUND
+from backend.llm_router import LLMRouter
+from backend.health import HealthMonitor
+from langchain.schema import Document
+
+
+class HashEmbeddings:
+    """Deterministic bag-of-words embeddings for tests (no sentence-transformers model needed)"""
+    
+    def __init__(self, dim=32, fail_on_call=None):
+        self.dim = dim
+        self.fail_on_call = fail_on_call
+        self.batches = []
+    
+    def embed_documents(self, texts):
+        self.batches.append(len(texts))
+        if self.fail_on_call == len(self.batches):
+            raise RuntimeError("embedding model failed")
+        return [self.embed_query(text) for text in texts]
+    
+    def embed_query(self, text):
+        import zlib
+        from backend.keyword_index import tokenize
+        vector = [0.0] * self.dim
+        for token in tokenize(text):
+            vector[zlib.crc32(token.encode('utf-8')) % self.dim] += 1.0
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+def stub_vector_store(directory, embeddings=None):
+    """VectorStore (configured backend) with HashEmbeddings in place of the embedding model"""
+    import backend.vector_store as vector_store_module
+    model = embeddings or HashEmbeddings()
+    original = vector_store_module.HuggingFaceEmbeddings
+    vector_store_module.HuggingFaceEmbeddings = lambda **kwargs: model
+    try:
+        return VectorStore(directory)
+    finally:
+        vector_store_module.HuggingFaceEmbeddings = original
 
 def test_document_loader():
     """Test document loading functionality"""
@@ -36,6 +85,104 @@ def test_document_loader():
     
     print()
 
+def test_streaming_chunks():
+    """Test that page-streamed chunking matches splitting the whole text, with page/page_end metadata,
+    and that a parse failure midway leaves no chunks of the file in the store"""
+    print("Testing Streaming Chunks...")
+    
+    import re
+    import tempfile
+    import fitz
+    try:
+        loader = DocumentLoader()
+        # Mỗi từ ghi số trang của nó: p3w012 = trang 3
+        pages = [(page, ''.join(f"p{page}w{i:03d} " for i in range(300))) for page in range(1, 9)]
+        streamed = list(loader.iter_chunks(iter(pages)))
+        whole = loader.text_splitter.split_text(''.join(text for _, text in pages))
+        
+        def pages_of(chunk):
+            numbers = [int(page) for page in re.findall(r'p(\d+)w', chunk)]
+            return numbers[0], numbers[-1]
+        
+        pages_ok = all((page_start, page_end) == pages_of(chunk) for chunk, page_start, page_end in streamed)
+        if [chunk for chunk, _, _ in streamed] == whole and pages_ok and any(start != end for _, start, end in streamed):
+            print(f"✅ {len(streamed)} streamed chunks match the whole-text split, page ranges correct")
+        else:
+            print(f"❌ Streamed chunks differ: {len(streamed)} vs {len(whole)}, pages ok: {pages_ok}")
+        
+        pdf_path = os.path.join(tempfile.mkdtemp(), "pages.pdf")
+        pdf = fitz.open()
+        for page in range(1, 4):
+            pdf_page = pdf.new_page()
+            for line in range(50):
+                pdf_page.insert_text((40, 40 + line * 15), ' '.join(f"p{page}w{line * 6 + i:03d}" for i in range(6)), fontsize=9)
+        pdf.save(pdf_path)
+        pdf.close()
+        documents = list(loader.iter_document(pdf_path))
+        metadata_ok = all((doc.metadata['page'], doc.metadata['page_end']) == pages_of(doc.page_content) for doc in documents) \
+            and [doc.metadata['chunk_index'] for doc in documents] == list(range(1, len(documents) + 1))
+        
+        # Lỗi parse giữa chừng: chunk của các trang đầu (cửa sổ đầu tiên) đã được ghi phải bị gỡ
+        store = stub_vector_store(tempfile.mkdtemp())
+        store.embedder.batch_size = 1
+        
+        def failing_document():
+            for page in range(1, 12):
+                yield Document(page_content=f"Trang {page}: nội dung p{page}w000", metadata={'source': 'pages.pdf', 'page': page, 'page_end': page})
+            raise ValueError("corrupt page 12")
+        
+        result = store.upsert_document('pages.pdf', failing_document())
+        if metadata_ok and result is None and 'pages.pdf' not in store.manifest and store.index.count() == 0 \
+                and len(store.keyword_index) == 0 and 'pages.pdf' not in store.document_sources:
+            print("✅ PDF chunks carry page/page_end; a parse failure midway left no chunks behind")
+        else:
+            print(f"❌ Unexpected PDF metadata ({metadata_ok}) or leftover chunks ({store.index.count()})")
+    except Exception as e:
+        print(f"❌ Streaming chunks test failed: {str(e)}")
+    
+    print()
+
+def test_load_many():
+    """Test parallel parsing: a failing file does not abort the batch and split PDFs keep page order"""
+    print("Testing Parallel Document Parsing...")
+    
+    import tempfile
+    import fitz
+    try:
+        directory = tempfile.mkdtemp()
+        pdf_path = os.path.join(directory, "long.pdf")
+        pdf = fitz.open()
+        for page in range(1, 6):
+            pdf.new_page().insert_text((40, 60), f"Trang {page} của tài liệu dài", fontsize=11)
+        pdf.save(pdf_path)
+        pdf.close()
+        txt_path = os.path.join(directory, "notes.txt")
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write("Ghi chú vận hành hệ thống 208HV")
+        broken_pdf = os.path.join(directory, "broken.pdf")
+        with open(broken_pdf, 'w') as f:
+            f.write("not a pdf")
+        unsupported = os.path.join(directory, "table.xyz")
+        with open(unsupported, 'w') as f:
+            f.write("a,b")
+        
+        paths = [broken_pdf, pdf_path, unsupported, txt_path]
+        # Mỗi trang PDF là một task riêng, chạy trên 2 process
+        results = {path: (documents, error) for path, documents, error in
+                   DocumentLoader().load_many(paths, max_workers=2, pages_per_task=1)}
+        long_docs = results[pdf_path][0] or []
+        ordered = [doc.metadata['page'] for doc in long_docs] == [1, 2, 3, 4, 5] \
+            and [doc.metadata['chunk_index'] for doc in long_docs] == [1, 2, 3, 4, 5]
+        if sorted(results) == sorted(paths) and results[broken_pdf][1] and results[unsupported][1] \
+                and results[txt_path][0] and ordered:
+            print(f"✅ 2 of 4 files parsed, failures isolated: {os.path.basename(broken_pdf)}, {os.path.basename(unsupported)}")
+        else:
+            print(f"❌ Unexpected load_many results: { {os.path.basename(p): (len(d or []), e) for p, (d, e) in results.items()} }")
+    except Exception as e:
+        print(f"❌ Parallel parsing test failed: {str(e)}")
+    
+    print()
+
 def test_vector_store():
     """Test vector store functionality"""
     print("Testing Vector Store...")
@@ -59,6 +206,911 @@ def test_vector_store():
     
     print()
 
+def test_upsert_document():
+    """Test re-upload of a modified file (added/removed/unchanged), stable chunk ids and rollback of a failed write"""
+    print("Testing Upsert Document...")
+    
+    import time
+    import tempfile
+    import threading
+    from backend.vector_store import chunk_id_for
+    try:
+        embeddings = HashEmbeddings()
+        store = stub_vector_store(tempfile.mkdtemp(), embeddings)
+        
+        def chunks(*texts):
+            return [Document(page_content=text, metadata={'source': 'doc.txt', 'page': i}) for i, text in enumerate(texts)]
+        
+        first = store.upsert_document('doc.txt', chunks("Đoạn A về 208HV", "Đoạn B về NMLD", "Đoạn C về an toàn"))
+        # Sửa file: giữ A (khác khoảng trắng) và C, bỏ B, thêm D
+        second = store.upsert_document('doc.txt', chunks("Đoạn  A về\n208HV", "Đoạn C về an toàn", "Đoạn D mới"))
+        expected_ids = {chunk_id_for('doc.txt', text) for text in ("Đoạn A về 208HV", "Đoạn C về an toàn", "Đoạn D mới")}
+        stable = chunk_id_for('doc.txt', "Đoạn  A về\n208HV") == chunk_id_for('doc.txt', "Đoạn A về 208HV") \
+            and chunk_id_for('other.txt', "Đoạn A về 208HV") != chunk_id_for('doc.txt', "Đoạn A về 208HV")
+        if first == {'added': 3, 'removed': 0, 'unchanged': 0} and second == {'added': 1, 'removed': 1, 'unchanged': 2} \
+                and stable and set(store.manifest.ids('doc.txt')) == expected_ids and store.index.count() == 3:
+            print(f"✅ Re-upload: {second}, chunk ids stable")
+        else:
+            print(f"❌ Unexpected upsert results: first={first}, second={second}, stable={stable}")
+        
+        # Model lỗi ở batch thứ 2: các chunk đã ghi ở batch 1 phải được gỡ bỏ
+        store.embedder.batch_size = 2
+        embeddings.fail_on_call = len(embeddings.batches) + 2
+        failed = store.upsert_document('doc.txt', chunks("Đoạn A về 208HV", "Phụ lục 1", "Phụ lục 2", "Phụ lục 3", "Phụ lục 4"))
+        if failed is None and set(store.manifest.ids('doc.txt')) == expected_ids and store.index.count() == 3 \
+                and len(store.keyword_index) == 3 and store.keyword_index.search('Phụ lục') == []:
+            print("✅ Failed re-upload rolled back the chunks it had written")
+        else:
+            print(f"❌ Partial write left behind: result={failed}, count={store.index.count()}, keyword={len(store.keyword_index)}")
+        
+        # Cùng một file được upload hai lần đồng thời (2 ingest worker): lần sau phải thay hẳn lần trước
+        started = threading.Event()
+        
+        def slow_chunks(*texts):
+            started.set()
+            time.sleep(0.2)  # job đầu vẫn đang ghi khi job sau bắt đầu
+            yield from chunks(*texts)
+        
+        first_job = threading.Thread(target=store.upsert_document, args=('doc.txt', slow_chunks("Bản 1 đoạn một", "Bản 1 đoạn hai")))
+        first_job.start()
+        started.wait(5)
+        second = store.upsert_document('doc.txt', chunks("Bản 2 đoạn một", "Bản 2 đoạn hai", "Bản 2 đoạn ba"))
+        first_job.join()
+        expected_ids = {chunk_id_for('doc.txt', text) for text in ("Bản 2 đoạn một", "Bản 2 đoạn hai", "Bản 2 đoạn ba")}
+        if second == {'added': 3, 'removed': 2, 'unchanged': 0} and set(store.manifest.ids('doc.txt')) == expected_ids \
+                and store.index.count() == 3 and len(store.keyword_index) == 3:
+            print("✅ Concurrent upserts of one source ran one after the other")
+        else:
+            print(f"❌ Concurrent upserts interleaved: second={second}, ids={len(store.manifest.ids('doc.txt'))}, count={store.index.count()}")
+    except Exception as e:
+        print(f"❌ Upsert document test failed: {str(e)}")
+    
+    print()
+
+def test_hybrid_search():
+    """Test reciprocal-rank fusion of a fixed dense ranking with real BM25 results for several alpha values"""
+    print("Testing Hybrid Search...")
+    
+    import tempfile
+    from backend.vector_store import RRF_K, chunk_id_for
+    try:
+        store = stub_vector_store(tempfile.mkdtemp())
+        texts = {'a': "Hệ thống 208HV vận hành liên tục", 'b': "Nhà máy Dung Quất lắp đặt 208HV", 'c': "Quy trình an toàn lao động"}
+        store.add_documents([Document(page_content=text, metadata={'source': 'kb.txt'}) for text in texts.values()])
+        ids = {name: chunk_id_for('kb.txt', text) for name, text in texts.items()}
+        names = {chunk_id: name for name, chunk_id in ids.items()}
+        # Thứ hạng dense cố định c > b > a; BM25 thật cho "208HV vận hành": a > b
+        dense = [(Document(page_content=texts[name], metadata={'source': 'kb.txt', 'id': ids[name]}), 0.0) for name in 'cba']
+        store._dense_search = lambda query, k: dense[:k]
+        
+        def ranking(alpha, query="208HV vận hành", extra_keywords=None):
+            return [(names[doc.metadata['id']], score) for doc, score in store.hybrid_search(query, k=3, alpha=alpha, extra_keywords=extra_keywords)]
+        
+        def close(actual, expected):
+            return [name for name, _ in actual] == [name for name, _ in expected] \
+                and all(abs(score - want) < 1e-12 for (_, score), (_, want) in zip(actual, expected))
+        
+        rrf = lambda rank: 1 / (RRF_K + rank)
+        checks = {
+            'alpha=0.5': close(ranking(0.5), [('a', 0.5 * rrf(3) + 0.5 * rrf(1)), ('b', 0.5 * rrf(2) + 0.5 * rrf(2)), ('c', 0.5 * rrf(1))]),
+            'alpha=1 (dense only)': close(ranking(1.0), [('c', rrf(1)), ('b', rrf(2)), ('a', rrf(3))]),
+            'alpha=0 (keyword only)': close(ranking(0.0), [('a', rrf(1)), ('b', rrf(2))]),
+            'extra keywords': [name for name, _ in ranking(0.0, "không khớp", ['Dung', 'Quất'])] == ['b']
+        }
+        if all(checks.values()):
+            print(f"✅ Fused rankings match RRF: {ranking(0.5)}")
+        else:
+            print(f"❌ Unexpected hybrid rankings: {checks}, alpha=0.5 -> {ranking(0.5)}")
+    except Exception as e:
+        print(f"❌ Hybrid search test failed: {str(e)}")
+    
+    print()
+
+def test_keyword_index():
+    """Test BM25 keyword index add/search/remove, persistence and import of the legacy JSON file"""
+    print("Testing Keyword Index...")
+    
+    import tempfile
+    
+    try:
+        index_path = os.path.join(tempfile.mkdtemp(), "keyword_index.sqlite3")
+        index = KeywordIndex(index_path)
+        index.add([
+            ('c1', 'Hệ thống 208HV vận hành liên tục', 'a.txt'),
+            ('c2', 'Nhà máy NMLD Dung Quất', 'b.txt'),
+            ('c3', 'Quy trình vận hành an toàn', 'a.txt'),
+        ])
+        results = index.search('vận hành 208HV', k=2)
+        if results and results[0][0] == 'c1':
+            print(f"✅ Keyword search ranked correctly: {results}")
+        else:
+            print(f"❌ Unexpected keyword search results: {results}")
+        
+        index.remove(['c1'])
+        reloaded = KeywordIndex(index_path)
+        if len(reloaded) == 2 and reloaded.search('208HV') == []:
+            print("✅ Keyword index removal persisted")
+        else:
+            print("❌ Keyword index removal was not persisted")
+        
+        # Store cũ: chỉ có keyword_index.json
+        legacy_dir = tempfile.mkdtemp()
+        with open(os.path.join(legacy_dir, "keyword_index.json"), 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'docs': {'c9': {'source': 'c.txt', 'len': 2, 'tf': {'dung': 1, 'quất': 1}}}}, f)
+        KeywordIndex(os.path.join(legacy_dir, "keyword_index.sqlite3")).close()
+        imported = KeywordIndex(os.path.join(legacy_dir, "keyword_index.sqlite3"))
+        if imported.search('Dung Quất') and not os.path.exists(os.path.join(legacy_dir, "keyword_index.json")):
+            print("✅ Legacy keyword index imported")
+        else:
+            print("❌ Legacy keyword index was not imported")
+    except Exception as e:
+        print(f"❌ Keyword index test failed: {str(e)}")
+    
+    print()
+
+def test_embedding_cache():
+    """Test that cached embeddings are reused instead of re-embedded"""
+    print("Testing Embedding Cache...")
+    
+    import tempfile
+    
+    class CountingEmbeddings:
+        calls = 0
+        def embed_documents(self, texts):
+            self.calls += len(texts)
+            return [[float(len(t)), 1.0] for t in texts]
+        def embed_query(self, text):
+            self.calls += 1
+            return [float(len(text)), 1.0]
+    
+    try:
+        cache = EmbeddingCache(os.path.join(tempfile.mkdtemp(), "embedding_cache.sqlite3"))
+        base = CountingEmbeddings()
+        embeddings = CachedEmbeddings(base, cache, "test-model")
+        first = embeddings.embed_documents(["alpha", "beta"])
+        second = embeddings.embed_documents(["alpha", "beta", "gamma"])
+        if base.calls == 3 and second[:2] == first:
+            print("✅ Embedding cache reused vectors for unchanged chunks")
+        else:
+            print(f"❌ Embedding cache miss count unexpected: {base.calls} model calls")
+        embeddings.embed_query("what is nmld")
+        embeddings.embed_query("what is nmld")
+        # Câu hỏi chỉ nằm trong LRU, không ghi vào SQLite
+        if embeddings.query_cache_stats() == {'entries': 1, 'hits': 1, 'misses': 1} and cache.count("test-model") == 3:
+            print("✅ Query embedding LRU served the repeated query without writing it to disk")
+        else:
+            print(f"❌ Unexpected query cache stats: {embeddings.query_cache_stats()}")
+    except Exception as e:
+        print(f"❌ Embedding cache test failed: {str(e)}")
+    
+    print()
+
+def test_ingestion_embedder():
+    """Test batched ingestion embedding: length-sorted batches of batch_size and cache reuse on re-ingest"""
+    print("Testing Ingestion Embedder...")
+    
+    import tempfile
+    import numpy as np
+    from backend.vector_store import IngestionEmbedder
+    try:
+        model = HashEmbeddings()
+        cache = EmbeddingCache(os.path.join(tempfile.mkdtemp(), "embedding_cache.sqlite3"))
+        embedder = IngestionEmbedder(CachedEmbeddings(model, cache, "hash-test"), "hash-test", batch_size=4)
+        texts = [f"đoạn {i} " + "nội dung " * (i % 5) for i in range(10)]
+        
+        first = list(embedder.embed(texts))
+        indices = [i for batch, _ in first for i in batch]
+        lengths = [len(texts[i]) for i in indices]
+        vectors = {i: vector for batch, batch_vectors in first for i, vector in zip(batch, batch_vectors)}
+        batched_ok = model.batches == [4, 4, 2] and sorted(indices) == list(range(10)) and lengths == sorted(lengths) \
+            and all(vectors[i] == model.embed_query(texts[i]) for i in range(10))
+        
+        # Ingest lại với 2 đoạn mới: chỉ 2 đoạn này đi qua model, phần còn lại lấy từ cache
+        second = list(embedder.embed(texts + ["đoạn mới A", "đoạn mới B"]))
+        reused = {i: vector for batch, batch_vectors in second for i, vector in zip(batch, batch_vectors)}
+        if batched_ok and model.batches == [4, 4, 2, 2] and len(reused) == 12 and all(np.allclose(reused[i], vectors[i], atol=1e-6) for i in range(10)):
+            print(f"✅ Embedded in batches {model.batches[:3]}, re-ingest only embedded the 2 new chunks")
+        else:
+            print(f"❌ Unexpected embedder batches: {model.batches}, sorted by length: {lengths == sorted(lengths)}")
+    except Exception as e:
+        print(f"❌ Ingestion embedder test failed: {str(e)}")
+    
+    print()
+
+def test_ingestion_queue():
+    """Test background ingestion reports real stage progress"""
+    print("Testing Ingestion Queue...")
+    
+    import time
+    
+    class FakeLoader:
+        def iter_document(self, file_path, progress_callback=None):
+            for page in range(1, 4):
+                progress_callback('parsed', page, 3)
+            return iter(['chunk'] * 10)
+    
+    class FakeStore:
+        def upsert_document(self, source, documents, progress_callback=None):
+            documents = list(documents)
+            for done in range(5, 11, 5):
+                progress_callback('embedded', done, len(documents))
+                progress_callback('persisted', done, len(documents))
+            return {'added': len(documents), 'removed': 0, 'unchanged': 0}
+    
+    try:
+        ingestion = IngestionQueue(FakeLoader(), FakeStore(), num_workers=1, max_queued=2)
+        job = ingestion.submit('sample.pdf', '/tmp/sample.pdf')
+        for _ in range(50):
+            if job.status in ('done', 'error'):
+                break
+            time.sleep(0.05)
+        status = job.to_dict()
+        if status['status'] == 'done' and status['pages_parsed'] == 3 and status['chunks_persisted'] == 10:
+            print(f"✅ Ingestion job finished with stage progress: {status['pages_parsed']} pages, {status['chunks_persisted']} chunks")
+        else:
+            print(f"❌ Unexpected ingestion status: {status}")
+    except Exception as e:
+        print(f"❌ Ingestion queue test failed: {str(e)}")
+    
+    print()
+
+def test_faiss_backend():
+    """Test FAISS index backend upsert, search, delete and reopen from disk for each index type"""
+    print("Testing FAISS Backend...")
+    
+    import tempfile
+    import numpy as np
+    
+    try:
+        rng = np.random.default_rng(1)
+        dim, n = 16, 400
+        vectors = rng.standard_normal((n, dim)).astype('float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [str(i) for i in range(n)]
+        metadatas = [{'source': f"s{i % 4}.txt"} for i in range(n)]
+        
+        for index_type, options in (('flat', {}), ('hnsw', {}), ('ivfpq', {'nlist': 4, 'pq_m': 4, 'train_size': 300})):
+            directory = tempfile.mkdtemp()
+            backend = FaissBackend(directory, index_type=index_type, **options)
+            backend.upsert(ids, vectors.tolist(), ids, metadatas)
+            backend.persist()
+            nearest = backend.query(vectors[1].tolist(), 1)[0][0]
+            backend.delete(backend.ids_for_source('s0.txt'))
+            backend.close()
+            
+            # Mở lại từ file (chỉ inverted lists của IVF được memory-map), rồi ghi tiếp sau khi mở lại
+            reopened = FaissBackend(directory, index_type=index_type, **options)
+            hits = [hit[0] for hit in reopened.query(vectors[0].tolist(), 5)]
+            stats = reopened.describe()
+            reopened.upsert(['new'], [vectors[0].tolist()], ['new'], [{'source': 'new.txt'}])
+            newest = reopened.query(vectors[0].tolist(), 1)[0][0]
+            if nearest == '1' and len(hits) == 5 and all(int(hit) % 4 != 0 for hit in hits) \
+                    and newest == 'new' and reopened.count() == n - n // 4 + 1 and stats['memory_mapped'] == (index_type == 'ivfpq'):
+                print(f"✅ FAISS {index_type}: search, delete and reopen work "
+                      f"(memory-mapped: {stats['memory_mapped']}, tombstones: {stats['tombstones']})")
+            else:
+                print(f"❌ Unexpected FAISS {index_type} results: nearest={nearest}, hits={hits}, newest={newest}, count={reopened.count()}, {stats}")
+            reopened.close()
+    except Exception as e:
+        print(f"❌ FAISS backend test failed: {str(e)}")
+    
+    print()
+
+def test_source_manifest():
+    """Test the per-source manifest: add/remove chunks, reload, legacy JSON import and rebuild from an existing index"""
+    print("Testing Source Manifest...")
+    
+    import tempfile
+    from backend.source_manifest import SourceManifest
+    
+    try:
+        directory = tempfile.mkdtemp()
+        manifest_path = os.path.join(directory, "source_manifest.sqlite3")
+        manifest = SourceManifest(manifest_path)
+        manifest.add_chunks('a.txt', ['a1', 'a2', 'a3'])
+        manifest.add_chunks('b.txt', ['b1'])
+        manifest.add_chunks('a.txt', ['a3', 'a4'])
+        manifest.save()
+        manifest.remove_chunks('a.txt', ['a1'])
+        manifest.remove_chunks('b.txt', ['b1'])
+        manifest.save()
+        manifest.close()
+        reloaded = SourceManifest(manifest_path)
+        if reloaded.exists and reloaded.source_counts() == {'a.txt': 3} and reloaded.total_chunks() == 3 and reloaded.ids('a.txt') == ['a2', 'a3', 'a4']:
+            print(f"✅ Manifest add/remove persisted: {reloaded.summary()}")
+        else:
+            print(f"❌ Unexpected manifest after reload: {reloaded.source_counts()}")
+        reloaded.close()
+        
+        # Store cũ: manifest dạng một file JSON được chuyển sang SQLite
+        legacy_dir = tempfile.mkdtemp()
+        with open(os.path.join(legacy_dir, "source_manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'sources': {'c.txt': {'ids': ['c1', 'c2'], 'chunks': 2, 'ingested_at': None}}}, f)
+        imported = SourceManifest(os.path.join(legacy_dir, "source_manifest.sqlite3"))
+        imported_ok = imported.exists and imported.ids('c.txt') == ['c1', 'c2'] \
+            and not os.path.exists(os.path.join(legacy_dir, "source_manifest.json"))
+        
+        # Store chưa có manifest: dựng lại từ metadata của index hiện có
+        index_dir = tempfile.mkdtemp()
+        backend = FaissBackend(index_dir, index_type='flat')
+        backend.upsert(['x1', 'x2', 'y1'], [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], ['x', 'x', 'y'],
+                       [{'source': 'x.txt'}, {'source': 'x.txt'}, {'source': 'y.txt'}])
+        store = VectorStore.__new__(VectorStore)
+        store.index = backend
+        store.manifest = SourceManifest(os.path.join(index_dir, "source_manifest.sqlite3"))
+        store.document_sources = set()
+        store._load_existing_sources()
+        rebuilt = SourceManifest(os.path.join(index_dir, "source_manifest.sqlite3"))
+        if imported_ok and rebuilt.exists and rebuilt.source_counts() == {'x.txt': 2, 'y.txt': 1} \
+                and store.counts() == {'total_chunks': 3, 'unique_sources': 2}:
+            print("✅ Manifest imported from legacy JSON and rebuilt from an existing index")
+        else:
+            print(f"❌ Unexpected manifest import/rebuild: imported={imported_ok}, rebuilt={rebuilt.source_counts()}")
+        backend.close()
+    except Exception as e:
+        print(f"❌ Source manifest test failed: {str(e)}")
+    
+    print()
+
+def test_quantized_recall():
+    """Test recall@10 of int8 / PQ codes with exact re-ranking against brute force"""
+    print("Testing Quantized Index Recall...")
+    
+    import tempfile
+    import numpy as np
+    
+    try:
+        rng = np.random.default_rng(0)
+        dim, n = 64, 4000
+        centers = rng.standard_normal((40, dim))
+        vectors = (centers[rng.integers(0, 40, n)] + 0.6 * rng.standard_normal((n, dim))).astype('float32')
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        queries = (centers[rng.integers(0, 40, 50)] + 0.6 * rng.standard_normal((50, dim))).astype('float32')
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :10]
+        ids = [str(i) for i in range(n)]
+        
+        for index_type, options in (('sq8', {}), ('pq', {'pq_m': 16})):
+            backend = FaissBackend(tempfile.mkdtemp(), index_type=index_type, train_size=2000, rerank_factor=10, **options)
+            backend.upsert(ids, vectors.tolist(), [''] * n, [{'source': 'synthetic'}] * n)
+            backend.persist()
+            recall = np.mean([
+                len({int(hit[0]) for hit in backend.query(query.tolist(), 10)} & set(truth[i].tolist())) / 10
+                for i, query in enumerate(queries)
+            ])
+            compression = dim * 4 / backend.describe()['bytes_per_vector']
+            if recall >= 0.95:
+                print(f"✅ {index_type}: recall@10 = {recall:.3f} at {compression:.0f}x smaller codes")
+            else:
+                print(f"❌ {index_type}: recall@10 = {recall:.3f} is below 0.95")
+            
+            # Upload lại toàn bộ hai lần: file vector phải được nén lại, không giữ các hàng đã xóa
+            for _ in range(2):
+                backend.upsert(ids, vectors.tolist(), [''] * n, [{'source': 'synthetic'}] * n)
+                backend.persist()
+            directory = backend.persist_directory
+            backend.close()
+            reopened = FaissBackend(directory, index_type=index_type, train_size=2000, rerank_factor=10, **options)
+            file_rows = os.path.getsize(reopened.vectors_path) // (dim * 4)
+            same = all(reopened.query(query.tolist(), 10)[0][0] == str(truth[i][0]) for i, query in enumerate(queries[:10]))
+            if file_rows == n and reopened.count() == n and same:
+                print(f"✅ {index_type}: vectors file compacted to {file_rows} rows after re-uploads, results unchanged")
+            else:
+                print(f"❌ {index_type}: vectors file has {file_rows} rows for {reopened.count()} chunks, results unchanged={same}")
+            reopened.close()
+    except Exception as e:
+        print(f"❌ Quantized recall test failed: {str(e)}")
+    
+    print()
+
+def test_answer_cache():
+    """Test exact/semantic answer cache hits and source invalidation"""
+    print("Testing Answer Cache...")
+    
+    try:
+        cache = AnswerCache(max_entries=8, ttl_seconds=60, similarity_threshold=0.95)
+        cache.put("What is NMLD?", "gemini:gemini-pro", ["c1", "c2"], ["a.pdf"], "answer", [1.0, 0.0, 0.0])
+        exact = cache.get_exact("  what is nmld ", "gemini:gemini-pro", ["c2", "c1"])
+        semantic = cache.get_semantic([0.99, 0.05, 0.0], "gemini:gemini-pro")
+        other_model = cache.get_semantic([1.0, 0.0, 0.0], "local:phi-2")
+        cache.invalidate_sources({"a.pdf"})
+        if exact and semantic and other_model is None and cache.stats()['entries'] == 0:
+            print("✅ Answer cache served exact and semantic hits and was invalidated by source")
+        else:
+            print(f"❌ Unexpected answer cache behaviour: {cache.stats()}")
+        
+        # Cặp câu hỏi gần giống nhưng hỏi điều khác (embedding bag-of-words), với ngưỡng mặc định
+        embeddings = HashEmbeddings(dim=512)
+        cache = AnswerCache()
+        question = "Điện áp định mức của máy biến áp số 1 tại trạm 208HV được quy định trong tài liệu vận hành là bao nhiêu"
+        cache.put(question, "local:phi-2", ["c1"], ["a.pdf"], "110 kV", embeddings.embed_query(question))
+        positives = [question.upper(), "Tại trạm 208HV điện áp định mức của máy biến áp số 1 được quy định trong tài liệu vận hành là bao nhiêu"]
+        negatives = [
+            question.replace("số 1", "số 2"),  # khác số hiệu máy
+            question.replace("208HV", "110HV"),  # khác mã trạm
+            "Dòng điện định mức của máy biến áp số 1 tại trạm 208HV được quy định trong tài liệu vận hành là bao nhiêu",
+            "Điện áp định mức của máy biến áp số 1 tại trạm 208HV được quy định trong tài liệu bảo dưỡng là bao lâu",
+        ]
+        hits = [cache.get_semantic(embeddings.embed_query(q), "local:phi-2", q) is not None for q in positives]
+        false_hits = [q for q in negatives if cache.get_semantic(embeddings.embed_query(q), "local:phi-2", q) is not None]
+        # Câu hỏi tiếp nối trong hội thoại khác không dùng câu trả lời đã cache
+        other_history = cache.get_semantic(embeddings.embed_query(question), "local:phi-2", question, history="abc") is None \
+            and cache.get_exact(question, "local:phi-2", ["c1"], history="abc") is None
+        if all(hits) and not false_hits and other_history and cache.get_exact(question, "local:phi-2", ["c1"]):
+            print(f"✅ Paraphrases hit, {len(negatives)} negative pairs and other histories missed at threshold {cache.similarity_threshold}")
+        else:
+            print(f"❌ Semantic cache hits={hits}, false hits={false_hits}, other history missed={other_history}")
+    except Exception as e:
+        print(f"❌ Answer cache test failed: {str(e)}")
+    
+    print()
+
+def test_context_packer():
+    """Test chunk merging, overlap removal and the token budget of the context packer"""
+    print("Testing Context Packer...")
+    
+    try:
+        text = "".join(f"Điều {i}. Quy định này áp dụng cho sinh viên khóa {i}. " for i in range(1, 40))
+        first, second = text[:900], text[600:1500]
+        docs = [
+            Document(page_content=second, metadata={'source': 'a.pdf', 'chunk_index': 1, 'score': 0.02}),
+            Document(page_content="Nội dung không liên quan.", metadata={'source': 'b.pdf', 'chunk_index': 0, 'score': 0.01}),
+            Document(page_content=first, metadata={'source': 'a.pdf', 'chunk_index': 0, 'score': 0.03}),
+        ]
+        packer = ContextPacker(token_budget=2000, chars_per_token=3.0)
+        context, stats = packer.pack(docs, 'gemini-pro')
+        small_context, small_stats = ContextPacker(token_budget=150).pack(docs, 'gemini-pro')
+        if (text[:1500].strip() in context and context.index('a.pdf') < context.index('b.pdf')
+                and stats['segments'] == 2 and small_stats['tokens_used'] <= 150 and small_stats['segments_used'] == 1):
+            print(f"✅ Context packed: {stats['tokens_used']}/{stats['token_budget']} tokens, overlap removed")
+        else:
+            print(f"❌ Unexpected packing: {stats}, {small_stats}")
+    except Exception as e:
+        print(f"❌ Context packer test failed: {str(e)}")
+    
+    print()
+
+def test_reranker():
+    """Test cross-encoder ordering, top_n cut and the (query, chunk) score cache with a stand-in model"""
+    print("Testing Reranker...")
+    
+    class KeywordOverlapModel:
+        """Stands in for CrossEncoder: score = shared words, counts predict calls"""
+        calls = 0
+        def predict(self, pairs, batch_size=32, show_progress_bar=False):
+            self.calls += 1
+            return [len(set(q.lower().split()) & set(t.lower().split())) for q, t in pairs]
+    
+    try:
+        reranker = CrossEncoderReranker('stand-in', top_n=2)
+        reranker._model = KeywordOverlapModel()
+        docs = [
+            Document(page_content="Giờ làm việc của văn phòng", metadata={'id': 'c1'}),
+            Document(page_content="Quy định nghỉ phép năm của nhân viên", metadata={'id': 'c2'}),
+            Document(page_content="Nghỉ phép năm được tính theo quy định", metadata={'id': 'c3'}),
+        ]
+        first = reranker.rerank("quy định nghỉ phép năm", docs)
+        second = reranker.rerank("Quy định nghỉ phép năm ", docs)
+        ids = [doc.metadata['id'] for doc, _score in first]
+        if ids == ['c2', 'c3'] and second == first and reranker._model.calls == 1:
+            print(f"✅ Reranker kept {ids} with one batched call: {reranker.stats()}")
+        else:
+            print(f"❌ Unexpected reranking {ids}: {reranker.stats()}")
+    except Exception as e:
+        print(f"❌ Reranker test failed: {str(e)}")
+    
+    print()
+
+def test_chat_history():
+    """Test turn retention, streaming answer updates and history pagination"""
+    print("Testing Chat History Store...")
+    
+    import tempfile
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ChatHistoryStore(os.path.join(tmp, "history.sqlite3"), max_turns=5)
+            conversation = store.new_conversation_id()
+            for i in range(8):
+                store.append(conversation, f"question {i}", f"answer {i}")
+            turn_id = store.append(conversation, "streamed question")
+            store.set_assistant(turn_id, "streamed answer")
+            first = store.page(conversation, limit=3)
+            second = store.page(conversation, limit=3, before=first['next_before'])
+            recent = store.recent(conversation, 2)
+            if (store.stats()['turns'] == 5 and first['history'][0]['assistant'] == "streamed answer"
+                    and len(second['history']) == 2 and second['next_before'] is None
+                    and [turn['user'] for turn in recent] == ["question 7", "streamed question"]):
+                print("✅ Chat history kept the last 5 turns and paginated them")
+            else:
+                print(f"❌ Unexpected chat history: {first}, {second}")
+    except Exception as e:
+        print(f"❌ Chat history test failed: {str(e)}")
+    
+    print()
+
+def test_single_flight():
+    """Test that identical concurrent calls and streams run once and every waiter gets the result"""
+    print("Testing Single Flight...")
+    
+    import time
+    import asyncio
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.single_flight import AsyncSingleFlight
+    try:
+        flight = SingleFlight()
+        runs = []
+        release = threading.Event()
+        
+        def held_answer():
+            runs.append('call')
+            # Chỉ trả kết quả khi cả 8 request đã vào cùng flight này
+            while sum(flight.stats()['by_kind']['generate'].values()) < 8:
+                time.sleep(0.01)
+            return "answer"
+        
+        def held_stream():
+            runs.append('stream')
+            release.wait()
+            yield from ["a", "b", "c"]
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            answers = list(pool.map(lambda _: flight.do(('generate', 'q'), held_answer), range(8)))
+        # Upstream bị giữ lại cho đến khi cả 8 subscriber đã đăng ký
+        subscribers = [flight.stream(('stream', 'q'), held_stream) for _ in range(8)]
+        release.set()
+        streams = [''.join(subscriber) for subscriber in subscribers]
+        if answers == ["answer"] * 8 and streams == ["abc"] * 8 and runs == ['call', 'stream']:
+            print(f"✅ 8 concurrent calls and streams ran once each: {flight.stats()['by_kind']}")
+        else:
+            print(f"❌ Unexpected coalescing: runs={runs}, {flight.stats()}")
+        
+        # Mọi client ngắt kết nối: upstream phải dừng (giải phóng slot LLM), không chạy đến hết
+        closed = threading.Event()
+        
+        def endless_stream():
+            try:
+                while True:
+                    time.sleep(0.01)
+                    yield "token"
+            finally:
+                closed.set()
+        
+        first, second = (flight.stream(('stream', 'endless'), endless_stream) for _ in range(2))
+        next(first), next(second)
+        first.close()
+        one_left_running = not closed.wait(0.1)
+        second.close()
+        stopped = closed.wait(2) and flight.stats()['in_flight'] == 0
+        
+        async def async_abandon():
+            async_flight = AsyncSingleFlight()
+            async_closed = asyncio.Event()
+            
+            async def endless_async_stream():
+                try:
+                    while True:
+                        await asyncio.sleep(0.01)
+                        yield "token"
+                finally:
+                    async_closed.set()
+            
+            subscribers = [async_flight.stream(('stream', 'endless'), endless_async_stream) for _ in range(2)]
+            for subscriber in subscribers:
+                await subscriber.__anext__()
+            await subscribers[0].aclose()
+            await asyncio.sleep(0.1)
+            still_running = not async_closed.is_set()
+            await subscribers[1].aclose()
+            await asyncio.wait_for(async_closed.wait(), 2)
+            return still_running and async_flight.stats()['in_flight'] == 0
+        
+        async_stopped = asyncio.run(async_abandon())
+        if one_left_running and stopped and async_stopped:
+            print("✅ Upstream kept running for the remaining subscriber and stopped when the last one left")
+        else:
+            print(f"❌ Abandoned stream not stopped: one left running={one_left_running}, sync={stopped}, async={async_stopped}")
+    except Exception as e:
+        print(f"❌ Single flight test failed: {str(e)}")
+    
+    print()
+
+def test_admission():
+    """Test that queued interactive requests run before background ones and a full queue is shed"""
+    print("Testing Admission Control...")
+    
+    import time
+    import threading
+    try:
+        controller = AdmissionController('test', max_in_flight=1, max_queue=2, queue_timeout=5)
+        order = []
+        
+        def run(label, priority):
+            with controller.slot(priority):
+                order.append(label)
+        
+        # Giữ slot duy nhất để hai request sau phải xếp hàng
+        with controller.slot():
+            background = threading.Thread(target=run, args=('background', BACKGROUND))
+            background.start()
+            while controller.stats()['queue_depth'] < 1:
+                time.sleep(0.01)
+            interactive = threading.Thread(target=run, args=('interactive', INTERACTIVE))
+            interactive.start()
+            while controller.stats()['queue_depth'] < 2:
+                time.sleep(0.01)
+            try:
+                controller.acquire()
+                shed = None
+            except OverloadedError as e:
+                shed = e
+        background.join()
+        interactive.join()
+        stats = controller.stats()
+        if order == ['interactive', 'background'] and shed is not None and stats['shed'] == 1:
+            print(f"✅ Priority order {order}, shed with Retry-After {shed.retry_after}s, max queue {stats['max_queue_depth_seen']}")
+        else:
+            print(f"❌ Unexpected admission: order={order}, shed={shed}, {stats}")
+    except Exception as e:
+        print(f"❌ Admission test failed: {str(e)}")
+    
+    print()
+
+def test_gemini_registry():
+    """Test Gemini handle reuse, LRU bound on handles and the model list TTL with a stub google.generativeai"""
+    print("Testing Gemini Registry...")
+    
+    import time
+    import types
+    from unittest import mock
+    from backend.gemini_registry import GeminiModelRegistry
+    try:
+        calls = {'configure': 0, 'models': [], 'list': 0}
+        genai = types.ModuleType('google.generativeai')
+        genai.configure = lambda api_key: calls.update(configure=calls['configure'] + 1)
+        
+        class GenerativeModel:
+            def __init__(self, model_name, generation_config=None):
+                calls['models'].append(model_name)
+                self.generation_config = generation_config
+        
+        def list_models():
+            calls['list'] += 1
+            return [types.SimpleNamespace(name='models/gemini-pro'), types.SimpleNamespace(name='models/gemini-pro-vision')]
+        
+        genai.GenerativeModel = GenerativeModel
+        genai.list_models = list_models
+        import google
+        with mock.patch.dict(sys.modules, {'google.generativeai': genai}), mock.patch.object(google, 'generativeai', genai, create=True):
+            registry = GeminiModelRegistry('test-key', list_ttl=0.2, max_handles=2)
+            first = registry.model('gemini-pro')
+            reused = registry.model('gemini-pro') is first
+            registry.model('model-b')
+            registry.model('gemini-pro')  # dùng lại: model-b thành cũ nhất
+            registry.model('model-c')
+            lru_ok = registry.stats()['handles'] == ['gemini-pro', 'model-c'] and registry.model('gemini-pro') is first
+            registry.model('model-b')
+            
+            names = registry.list_models()
+            registry.list_models()
+            cached_list = calls['list'] == 1
+            time.sleep(0.25)
+            registry.list_models()
+            registry.list_models(force=True)
+        if reused and lru_ok and calls['configure'] == 1 and calls['models'] == ['gemini-pro', 'model-b', 'model-c', 'model-b'] \
+                and names == ['models/gemini-pro'] and cached_list and calls['list'] == 3:
+            print(f"✅ Handles reused and bounded to {registry.max_handles}, model list refreshed after TTL")
+        else:
+            print(f"❌ Unexpected registry behaviour: {calls}, {registry.stats()}")
+    except Exception as e:
+        print(f"❌ Gemini registry test failed: {str(e)}")
+    
+    print()
+
+def test_llm_router():
+    """Test fallback to the other provider, the circuit breaker and that local -> Gemini is opt-in (no LLM server needed)"""
+    print("Testing LLM Router...")
+    
+    import threading
+    try:
+        provider = LLMProvider()
+        provider.gemini_api_key = provider.gemini_api_key or 'test-key'
+        calls = []
+        threads = set()
+        
+        def local_down(prompt, model_name=None, priority=INTERACTIVE):
+            calls.append('local')
+            threads.add(threading.current_thread())
+            raise requests.exceptions.ConnectionError("connection refused")
+        
+        def gemini_ok(prompt, model_name, priority=INTERACTIVE):
+            calls.append('gemini')
+            threads.add(threading.current_thread())
+            return "Câu trả lời từ Gemini"
+        
+        # Thay lời gọi LLM thật bằng hàm giả: local lỗi kết nối, Gemini trả lời
+        provider._local_complete = local_down
+        provider._gemini_complete = gemini_ok
+        docs = [Document(page_content="Nội dung thử nghiệm", metadata={'source': 'test.txt'})]
+        # Mặc định local không được chuyển sang Gemini
+        default_answer = LLMRouter(provider).complete("Xin chào", docs, model_type='local')
+        default_ok = default_answer.startswith("Error: Cannot connect") and calls == ['local']
+        calls.clear()
+        router = LLMRouter(provider, fallback_to_gemini=True, failure_threshold=2, reset_seconds=60)
+        answers = [router.complete("Xin chào", docs, model_type='local') for _ in range(3)]
+        route = router.last_route()
+        # Sau 2 lần lỗi mạch mở: lần thứ 3 đi thẳng sang Gemini; không hedging thì gọi ngay trên thread của request
+        if (default_ok and all(answer.startswith("Câu trả lời") for answer in answers) and route['fallback']
+                and calls == ['local', 'gemini', 'local', 'gemini', 'gemini'] and threads == {threading.current_thread()}):
+            print(f"✅ Fell back to {route['provider']}, local circuit {router.health['local'].breaker.state}")
+        else:
+            print(f"❌ Unexpected routing: default={default_answer!r}, calls={calls}, threads={len(threads)}, {router.stats()}")
+    except Exception as e:
+        print(f"❌ LLM router test failed: {str(e)}")
+    
+    print()
+
+def test_health_monitor():
+    """Test that checks run in the background and the snapshot is served with timestamps"""
+    print("Testing Health Monitor...")
+    
+    import time
+    try:
+        counts = {'store': 0}
+        
+        def check_store():
+            counts['store'] += 1
+            return {'total_chunks': 42}
+        
+        def check_down():
+            raise ConnectionError("connection refused")
+        
+        monitor = HealthMonitor({'store': check_store, 'local_llm': check_down}, interval=60)
+        monitor.start()
+        # Lần kiểm tra đầu chạy ngay; refresh() chỉ chạy lại check được yêu cầu
+        while counts['store'] < 1:
+            time.sleep(0.01)
+        monitor.refresh('store')
+        while counts['store'] < 2:
+            time.sleep(0.01)
+        monitor.stop()
+        checks = monitor.snapshot()['checks']
+        if checks['store']['ok'] and checks['store']['total_chunks'] == 42 and checks['store']['checked_at'] \
+                and not checks['local_llm']['ok'] and checks['local_llm']['error']:
+            print(f"✅ Snapshot: store {checks['store']['age_seconds']}s old, local_llm error '{checks['local_llm']['error']}'")
+        else:
+            print(f"❌ Unexpected snapshot: {checks}")
+    except Exception as e:
+        print(f"❌ Health monitor test failed: {str(e)}")
+    
+    print()
+
+def test_http_client():
+    """Test pooled client retries and latency metrics against a stub OpenAI-compatible server"""
+    print("Testing HTTP Client...")
+    
+    import time
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        calls = 0
+        slow_calls = 0
+        dropped = {'GET': 0, 'POST': 0}
+        def drop(self):
+            # Đóng kết nối sau khi đã nhận request, không trả lời (RemoteDisconnected)
+            StubHandler.dropped[self.command] += 1
+            self.close_connection = True
+        def do_GET(self):
+            self.drop()
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path == '/drop':
+                return self.drop()
+            if self.path == '/slow':
+                # Đang sinh câu trả lời lâu hơn read timeout
+                StubHandler.slow_calls += 1
+                time.sleep(0.5)
+                return
+            StubHandler.calls += 1
+            # The first completion fails as if the server were still loading the model
+            status = 503 if StubHandler.calls == 1 else 200
+            body = json.dumps({'choices': [{'message': {'content': 'xin chào'}}]}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = HTTPClient(pool_size=2, max_retries=2, backoff_base=0.01)
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+        response = client.post(url, json={'messages': []})
+        stats = client.stats()['POST /v1/chat/completions']
+        try:
+            client.post(f"http://127.0.0.1:{server.server_address[1]}/slow", json={}, timeout=(1, 0.1))
+            read_timeout_raised = False
+        except requests.exceptions.ReadTimeout:
+            read_timeout_raised = True
+        for method in ('GET', 'POST'):
+            try:
+                client.request(method, f"http://127.0.0.1:{server.server_address[1]}/drop", json={})
+            except requests.exceptions.ConnectionError:
+                pass
+        closed_port = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        closed_port.server_close()
+        try:
+            client.post(f"http://127.0.0.1:{closed_port.server_address[1]}/refused", json={})
+        except requests.exceptions.ConnectionError:
+            pass
+        refused = client.stats()['POST /refused']
+        if response.status_code == 200 and stats['requests'] == 2 and stats['retries'] == 1:
+            print(f"✅ Retried 503 and recorded latency: p50 {stats['p50_ms']} ms")
+        else:
+            print(f"❌ Unexpected HTTP client result: {response.status_code}, {stats}")
+        if read_timeout_raised and StubHandler.slow_calls == 1:
+            print("✅ Read timeout on a completion POST was not retried")
+        else:
+            print(f"❌ Read timeout retried or swallowed: {StubHandler.slow_calls} calls")
+        if StubHandler.dropped == {'GET': 3, 'POST': 1} and refused['requests'] == 3:
+            print("✅ Dropped connection retried for GET only, refused connection retried")
+        else:
+            print(f"❌ Unexpected connection error retries: dropped={StubHandler.dropped}, refused={refused}")
+    except Exception as e:
+        print(f"❌ HTTP client test failed: {str(e)}")
+    finally:
+        server.shutdown()
+    
+    print()
+
+def test_streaming_formatter():
+    """Test that HTML streamed from split deltas equals format_html of the full answer"""
+    print("Testing Streaming HTML Formatter...")
+    
+    import random
+    from backend.llm_provider import StreamingHTMLFormatter
+    try:
+        provider = LLMProvider()
+        answer = ("**Tổng quan:** hệ thống 208HV\n"
+                  "- mục một\n- mục hai có **Ghi chú:** kèm theo\n"
+                  "1. bước đầu\n2. bước hai\n"
+                  "Kết luận\n\n* mục cuối")
+        expected = provider.format_html(answer)
+        
+        def streamed(deltas):
+            formatter = StreamingHTMLFormatter()
+            html = ''
+            for delta in deltas:
+                html += formatter.feed(delta)
+                formatter.pending()  # chỉ để hiển thị tạm, không được làm thay đổi trạng thái
+            return html + formatter.flush()
+        
+        rng = random.Random(7)
+        splits = {
+            'bold label split': ["**Tổng qu", "an:** hệ thống 208HV\n- mục", " một\n- mục hai có **Ghi", " chú:** kèm theo\n1", ". bước đầu\n2. bước hai\nKết luận\n\n*", " mục cuối"],
+            'one character per delta': list(answer),
+            'random sizes': [],
+        }
+        cursor = 0
+        while cursor < len(answer):
+            size = rng.randint(1, 9)
+            splits['random sizes'].append(answer[cursor:cursor + size])
+            cursor += size
+        mismatched = [name for name, deltas in splits.items() if streamed(deltas) != expected]
+        if not mismatched and '<b>Tổng quan:</b>' in expected and '<ul>' in expected and '<ol>' in expected:
+            print("✅ Split deltas (bold labels, list items across chunks) give the same HTML as the full text")
+        else:
+            print(f"❌ Streamed HTML differs for: {mismatched}")
+    except Exception as e:
+        print(f"❌ Streaming formatter test failed: {str(e)}")
+    
+    print()
+
 def test_llm_provider():
     """Test LLM provider functionality"""
     print("Testing LLM Provider...")
@@ -85,6 +1137,161 @@ def test_llm_provider():
     
     print()
 
+def test_lazy_components():
+    """Test one build under concurrent first access, retry after a failed build, and /readyz before and after loading"""
+    print("Testing Lazy Components...")
+    
+    import time
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.lazy import LazyComponent
+    try:
+        builds = []
+        
+        def slow_factory():
+            builds.append(threading.current_thread().name)
+            time.sleep(0.2)
+            return object()
+        
+        component = LazyComponent('slow', slow_factory)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            instances = list(pool.map(lambda _: component.resolve(), range(8)))
+        
+        attempts = []
+        
+        def flaky_factory():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("model download failed")
+            return "ready"
+        
+        flaky = LazyComponent('flaky', flaky_factory)
+        try:
+            flaky.resolve()
+        except RuntimeError:
+            pass
+        failed = flaky.describe()
+        if len(builds) == 1 and all(instance is instances[0] for instance in instances) \
+                and failed['error'] == "model download failed" and not failed['ready'] and flaky.resolve() == "ready":
+            print("✅ 8 concurrent first accesses built the component once; a failed build is retried")
+        else:
+            print(f"❌ Unexpected lazy builds: {len(builds)} builds, flaky={failed}")
+        
+        import main
+        imported_idle = not main._background_started and main.health_monitor._thread is None
+        main.start_background(preload_components=False)
+        originals = (main.vector_store, main.document_loader, main.llm_provider)
+        # Thành phần giả: /readyz chỉ xem trạng thái đã nạp hay chưa
+        main.vector_store, main.document_loader, main.llm_provider = (
+            LazyComponent(name, object) for name in ('vector_store', 'document_loader', 'llm_provider')
+        )
+        try:
+            client = main.app.test_client()
+            before = client.get('/readyz')
+            for lazy in (main.vector_store, main.document_loader, main.llm_provider):
+                lazy.resolve()
+            after = client.get('/readyz')
+        finally:
+            main.vector_store, main.document_loader, main.llm_provider = originals
+        if imported_idle and before.status_code == 503 and not before.get_json()['ready'] and after.status_code == 200:
+            print("✅ Importing main started nothing; /readyz went from 503 to 200 once components loaded")
+        else:
+            print(f"❌ Unexpected readiness: import idle={imported_idle}, before={before.status_code}, after={after.status_code}")
+    except Exception as e:
+        print(f"❌ Lazy components test failed: {str(e)}")
+    
+    print()
+
+def test_asgi_app():
+    """Test asgi.py /chat and /chat/stream in-process and that Flask routes share its session cookie"""
+    print("Testing ASGI App...")
+    
+    import tempfile
+    try:
+        from starlette.testclient import TestClient
+        import asgi
+        import main
+        from backend.lazy import LazyComponent
+        
+        async def local_complete(prompt, model_name=None, priority=INTERACTIVE):
+            return "Trả lời đầy đủ"
+        
+        async def local_stream(prompt, model_name=None, priority=INTERACTIVE):
+            for delta in ["Trả lời ", "từng ", "phần"]:
+                yield delta
+        
+        # LLM, truy xuất và lịch sử được thay bằng bản giả / tạm, không cần LM Studio hay model embedding
+        provider = LLMProvider()
+        provider._local_complete_async = local_complete
+        provider._local_stream_async = local_stream
+        docs = [Document(page_content="Nội dung thử nghiệm", metadata={'source': 'a.txt', 'chunk_id': 'c1'})]
+        store = ChatHistoryStore(os.path.join(tempfile.mkdtemp(), "chat.sqlite3"))
+        # Không nạp model thật khi lifespan khởi động
+        main.start_background(preload_components=False)
+        asgi.llm_router = LazyComponent('llm_router', lambda: LLMRouter(provider))
+        asgi.chat_lookup = lambda user_message, model_key, chat_history=None: (None, docs, ['c1'], ['a.txt'], None)
+        asgi.answer_cache = AnswerCache()
+        asgi.chat_store = main.chat_store = LazyComponent('chat_store', lambda: store)
+        
+        with TestClient(asgi.app) as client:
+            chat = client.post('/chat', json={'message': 'Câu hỏi 1', 'model_type': 'local'})
+            cookie_set = 'set-cookie' in chat.headers
+            with client.stream('POST', '/chat/stream', json={'message': 'Câu hỏi 2', 'model_type': 'local'}) as stream:
+                body = ''.join(stream.iter_text())
+                stream_cookie = 'set-cookie' in stream.headers
+            # /history do Flask phục vụ (qua a2wsgi) đọc cùng cookie session
+            history = client.get('/history').json()['history']
+        done = json.loads(body.split('event: done\ndata: ')[1].split('\n')[0])
+        if chat.status_code == 200 and chat.json()['response'] == "Trả lời đầy đủ" and cookie_set and not stream_cookie \
+                and done['response'] == "Trả lời từng phần" and done['provider']['provider'] == 'local' \
+                and [turn['user'] for turn in history] == ['Câu hỏi 2', 'Câu hỏi 1'] \
+                and history[0]['assistant'] == "Trả lời từng phần" and asgi.answer_cache.stats()['entries'] == 2:
+            print("✅ /chat and /chat/stream answered in one conversation shared with Flask routes")
+        else:
+            print(f"❌ Unexpected ASGI results: chat={chat.status_code} {chat.text[:200]}, cookie={cookie_set}/{stream_cookie}, history={history}")
+    except ImportError as e:
+        print(f"⚠️  ASGI dependencies not installed: {str(e)}")
+    except Exception as e:
+        print(f"❌ ASGI app test failed: {str(e)}")
+    
+    print()
+
+def test_stream_disconnect():
+    """Test that /chat/stream keeps the partial answer when the client disconnects mid-stream"""
+    print("Testing Stream Disconnect...")
+    
+    import tempfile
+    from unittest import mock
+    try:
+        import main
+        from backend.lazy import LazyComponent
+        
+        def local_stream(prompt, model_name=None, priority=INTERACTIVE):
+            yield "Phần đầu "
+            yield "phần sau"
+        
+        provider = LLMProvider()
+        provider._local_stream = local_stream
+        docs = [Document(page_content="Nội dung thử nghiệm", metadata={'source': 'a.txt', 'chunk_id': 'c1'})]
+        store = ChatHistoryStore(os.path.join(tempfile.mkdtemp(), "chat.sqlite3"))
+        with mock.patch.object(main, 'chat_store', LazyComponent('chat_store', lambda: store)), \
+                mock.patch.object(main, 'llm_router', LazyComponent('llm_router', lambda: LLMRouter(provider))), \
+                mock.patch.object(main, 'chat_lookup', lambda user_message, model_key, chat_history=None: (None, docs, ['c1'], ['a.txt'], None)):
+            client = main.app.test_client()
+            response = client.post('/chat/stream', json={'message': 'Câu hỏi', 'model_type': 'local'}, buffered=False)
+            first = next(iter(response.response))
+            # Client đóng kết nối sau delta đầu tiên
+            response.close()
+            history = client.get('/history').json['history']
+        if b'event: delta' in first and len(history) == 1 and history[0]['assistant'] == "Phần đầu ":
+            print("✅ Partial answer saved after the client disconnected")
+        else:
+            print(f"❌ Unexpected history after disconnect: {history}")
+    except Exception as e:
+        print(f"❌ Stream disconnect test failed: {str(e)}")
+    
+    print()
+
 def test_flask_app():
     """Test Flask application endpoints"""
     print("Testing Flask Application...")
@@ -186,8 +1393,33 @@ def main():
     
     # Test individual components
     test_document_loader()
+    test_streaming_chunks()
+    test_load_many()
     test_vector_store()
+    test_upsert_document()
+    test_keyword_index()
+    test_hybrid_search()
+    test_embedding_cache()
+    test_ingestion_embedder()
+    test_ingestion_queue()
+    test_faiss_backend()
+    test_source_manifest()
+    test_quantized_recall()
+    test_answer_cache()
+    test_context_packer()
+    test_reranker()
+    test_chat_history()
+    test_single_flight()
+    test_admission()
+    test_gemini_registry()
+    test_llm_router()
+    test_health_monitor()
+    test_http_client()
+    test_streaming_formatter()
     test_llm_provider()
+    test_lazy_components()
+    test_asgi_app()
+    test_stream_disconnect()
     
     # Test Flask application
     test_flask_app()